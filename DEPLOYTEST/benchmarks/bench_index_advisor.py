@@ -0,0 +1,215 @@
+# benchmarks/bench_index_advisor.py
+"""
+Propone índices y columnas generadas para la carga de detections y mide las consultas antes y después
+de aplicarlos.
+
+Crea (si no existe) una base de datos sintética con la tabla detections en un MySQL local, ejecuta la
+carga (por defecto, las formas de consulta de los ejemplos del generador de SQL; o el registro de un
+QueryPipeline con --workload, ver WORKLOAD_LOG) y muestra las recomendaciones de IndexAdvisor.
+Con --apply las aplica, vuelve a medir y, salvo --keep, las revierte al terminar.
+
+Uso:
+    python bench_index_advisor.py --user root --password secret --rows 1000000 --apply
+    python bench_index_advisor.py --workload /var/log/detections/workload.jsonl --database detections
+"""
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import mysql.connector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from index_advisor import IndexAdvisor, WorkloadRecorder, aplicar, analizar_sql, columnas_tabla, indices_existentes  # noqa: E402
+
+
+COLORES = ["Rojo", "Blanco", "Negro", "Gris", "Azul", "Verde", "Amarillo"]
+TIPOS = ["auto", "camioneta", "moto", "bus", "camion"]
+
+
+def consultas_por_defecto(inicio_ms, fin_ms):
+    """
+    Formas de consulta de los ejemplos del generador de SQL, sobre el último día de datos.
+    """
+    rango = f"init_time BETWEEN {inicio_ms} AND {fin_ms}"
+    return [
+        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, attribute_id, count(attribute_id) "
+        f"FROM detections WHERE {rango} GROUP BY 1, 2 LIMIT 25",
+        f"SELECT description, COUNT(*) AS cantidad_detecciones FROM detections WHERE attribute_id = 2 AND {rango} "
+        "GROUP BY description LIMIT 25",
+        f"SELECT * FROM detections WHERE attribute_id = 2 AND description = 'Rojo' AND {rango} LIMIT 25",
+        f"SELECT COUNT(*) FROM detections WHERE LEFT(object_id, LENGTH(object_id) - 27) = 'CAM007' AND {rango}",
+        "SELECT * FROM detections ORDER BY init_time DESC LIMIT 25",
+    ]
+
+
+def conectar(args, database=True):
+    return mysql.connector.connect(
+        host=args.host, port=args.port, user=args.user, password=args.password,
+        **({"database": args.database} if database else {})
+    )
+
+
+def crear_datos_sinteticos(args):
+    """
+    Crea la tabla detections con `args.rows` filas repartidas en `args.cameras` cámaras y `args.days` días.
+    El object_id es el identificador de la cámara seguido de 27 caracteres, como en producción.
+    """
+    conn = conectar(args, database=False)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+        cursor.execute(f"USE `{args.database}`")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                init_time BIGINT,
+                object_id VARCHAR(64),
+                attribute_id INT,
+                description VARCHAR(64),
+                acurrancy DOUBLE
+            )
+        """)
+        cursor.execute("SELECT COUNT(*) FROM detections")
+        existentes = cursor.fetchone()[0]
+        if existentes >= args.rows:
+            print(f"Reutilizando {existentes} filas existentes en '{args.database}'.")
+            return
+
+        print(f"Insertando {args.rows - existentes} filas en '{args.database}'...")
+        aleatorio = random.Random(args.seed)
+        fin = int(time.time() * 1000)
+        inicio = fin - args.days * 86400000
+        lote = []
+        for _ in range(args.rows - existentes):
+            atributo = aleatorio.randint(1, 4)
+            descripcion = aleatorio.choice(COLORES) if atributo == 2 else aleatorio.choice(TIPOS)
+            lote.append((
+                aleatorio.randint(inicio, fin),
+                f"CAM{aleatorio.randrange(args.cameras):03d}_{uuid.uuid4().hex[:26]}",
+                atributo,
+                descripcion,
+                round(aleatorio.uniform(0.5, 1.0), 3),
+            ))
+            if len(lote) == 5000:
+                cursor.executemany(
+                    "INSERT INTO detections (init_time, object_id, attribute_id, description, acurrancy) "
+                    "VALUES (%s, %s, %s, %s, %s)", lote
+                )
+                conn.commit()
+                lote = []
+        if lote:
+            cursor.executemany(
+                "INSERT INTO detections (init_time, object_id, attribute_id, description, acurrancy) "
+                "VALUES (%s, %s, %s, %s, %s)", lote
+            )
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def medir(conn, consultas, repeticiones, workload=None):
+    """
+    :return: {sql: mediana en segundos}; si se entrega `workload`, registra cada ejecución.
+    """
+    cursor = conn.cursor()
+    medianas = {}
+    try:
+        for sql in consultas:
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                cursor.execute(sql)
+                filas = cursor.fetchall()
+                segundos = time.perf_counter() - inicio
+                tiempos.append(segundos)
+                if workload is not None:
+                    workload.registrar(sql, segundos=segundos, filas=len(filas))
+            medianas[sql] = statistics.median(tiempos)
+    finally:
+        cursor.close()
+    return medianas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("MYSQL_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MYSQL_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("MYSQL_USER", "root"))
+    parser.add_argument("--password", default=os.getenv("MYSQL_PASSWORD", ""))
+    parser.add_argument("--database", default="bench_index_advisor")
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--cameras", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workload", help="Registro JSON Lines de un QueryPipeline (WORKLOAD_LOG); por defecto, la carga sintética")
+    parser.add_argument("--top", type=int, default=10, help="Formas de consulta más costosas del registro que se miden")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--apply", action="store_true", help="Aplica las recomendaciones y mide de nuevo")
+    parser.add_argument("--keep", action="store_true", help="No revierte las recomendaciones aplicadas")
+    args = parser.parse_args()
+
+    if args.workload:
+        formas = WorkloadRecorder.cargar(args.workload).resumen()[: args.top]
+        consultas = [forma["ejemplo"] for forma in formas]
+    else:
+        crear_datos_sinteticos(args)
+        hoy = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        inicio_ms = int(hoy.timestamp() * 1000)
+        consultas = consultas_por_defecto(inicio_ms, inicio_ms + 86399999)
+
+    conn = conectar(args)
+    try:
+        workload = WorkloadRecorder()
+        antes = medir(conn, consultas, args.repeat, workload)
+        tablas = sorted({a["tabla"] for a in (analizar_sql(sql) for sql in consultas) if a is not None})
+        recomendaciones = IndexAdvisor().recomendar(
+            workload.resumen(), indices_existentes(conn, tablas), columnas_tabla(conn, tablas)
+        )
+
+        print("\nRecomendaciones:")
+        if not recomendaciones:
+            print("  (ninguna: la carga ya está cubierta por los índices existentes)")
+        for r in recomendaciones:
+            print(f"  [{r['segundos'] * 1000:9.1f} ms, {r['consultas']} consultas] {r['ddl']}")
+
+        if not args.apply or not recomendaciones:
+            for sql, segundos in antes.items():
+                print(f"{segundos * 1000:9.1f} ms  {sql}")
+            return
+
+        print("\nAplicando...")
+        for ddl, error in aplicar(conn, recomendaciones):
+            print(f"  {'ERROR ' + error if error else 'ok'}: {ddl}")
+        cursor = conn.cursor()
+        for tabla in tablas:
+            cursor.execute(f"ANALYZE TABLE `{tabla}`")
+            cursor.fetchall()
+        cursor.close()
+
+        despues = medir(conn, consultas, args.repeat)
+        print(f"\n{'antes':>10} {'después':>10} {'mejora':>8}  consulta")
+        for sql in consultas:
+            mejora = antes[sql] / despues[sql] if despues[sql] else float("inf")
+            print(f"{antes[sql] * 1000:8.1f}ms {despues[sql] * 1000:8.1f}ms {mejora:7.1f}x  {sql}")
+        total_antes, total_despues = sum(antes.values()), sum(despues.values())
+        print(f"\nTotal: {total_antes * 1000:.1f} ms -> {total_despues * 1000:.1f} ms "
+              f"({total_antes / total_despues if total_despues else float('inf'):.1f}x)")
+
+        if not args.keep:
+            print("\nRevirtiendo (use --keep para conservar los cambios)...")
+            for ddl, error in aplicar(conn, recomendaciones, deshacer=True):
+                print(f"  {'ERROR ' + error if error else 'ok'}: {ddl}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/bench_pipeline_replay.py
+"""
+Mide el pipeline completo (QueryPipeline.run) con las llamadas al LLM grabadas, sin depender de OpenAI.
+
+1. Grabar (una vez, con una clave real): ejecuta las preguntas contra OpenAI y guarda cada
+   solicitud/respuesta en el archivo de fixtures.
+       python bench_pipeline_replay.py --mode record --openai-key sk-... --user root --password secret
+
+2. Reproducir (sin red): repite las preguntas respondiendo desde las fixtures, con latencia simulada
+   opcional, y reporta latencias y throughput.
+       python bench_pipeline_replay.py --mode replay --latency lognormal:0.9,0.4 --seed 7 --concurrency 8
+
+La base de datos sigue siendo un MySQL local (el mismo esquema de detections que usa la aplicación).
+
+Para que las repeticiones midan siempre el mismo trabajo, por defecto se desactivan los atajos que aprenden
+de las consultas anteriores: la caché de resultados, las plantillas de intención, el índice de preguntas y
+los rollups. Cada uno se activa con su opción y el reporte indica cuáles estaban activos.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from app import QueryPipeline  # noqa: E402
+from llm_backend import LatencyModel, RecordingBackend, ReplayBackend  # noqa: E402
+from llm_client import get_llm_client  # noqa: E402
+
+
+PREGUNTAS = [
+    "¿Cuántos vehículos se detectaron hoy?",
+    "¿Cuántos vehículos rojos se detectaron ayer?",
+    "Detecciones por cámara hoy",
+    "Muestra las últimas placas detectadas",
+    "Compara la cantidad de autos blancos y negros de hoy",
+    "¿Cuál es la precisión promedio de las detecciones de ayer?",
+    "Muestra un gráfico de barras de vehículos por color",
+    "Lista las placas que empiezan con AB",
+]
+
+
+def percentil(valores, q):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("record", "replay"), default="replay")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_fixtures.jsonl"))
+    parser.add_argument("--latency", default="none", help='"none", "recorded", segundos fijos o "lognormal:<mediana>,<sigma>"')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--questions", help="Archivo con una pregunta por línea (por defecto, PREGUNTAS)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--openai-key", default=os.getenv("OPENAI_API_KEY", ""))
+    parser.add_argument("--host", default=os.getenv("MYSQL_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MYSQL_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("MYSQL_USER", "root"))
+    parser.add_argument("--password", default=os.getenv("MYSQL_PASSWORD", ""))
+    parser.add_argument("--database", default=os.getenv("MYSQL_DATABASE", "detections"))
+    parser.add_argument("--result-cache-ttl", type=int, default=0,
+                        help="TTL de la caché de resultados (0 para medir siempre la ejecución del SQL)")
+    parser.add_argument("--intent-templates", action="store_true",
+                        help="Resolver las preguntas frecuentes con las plantillas de intención, sin LLM")
+    parser.add_argument("--question-index", action="store_true",
+                        help="Reutilizar el SQL de preguntas parecidas ya resueltas (las repeticiones no llaman al LLM)")
+    parser.add_argument("--rollup-interval", type=float, default=None,
+                        help="Segundos entre actualizaciones de los rollups de detections (por defecto, desactivados)")
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            preguntas = [linea.strip() for linea in f if linea.strip()]
+    else:
+        preguntas = PREGUNTAS
+
+    if args.mode == "record":
+        backend = RecordingBackend(args.fixtures)
+        repeticiones = 1
+    else:
+        backend = ReplayBackend(args.fixtures, latency=LatencyModel(args.latency, seed=args.seed))
+        repeticiones = args.repeat
+    client = get_llm_client()
+    client.backend = backend
+
+    db_config = {
+        "host": args.host, "port": args.port, "user": args.user, "password": args.password, "database": args.database,
+    }
+    pipeline = QueryPipeline(
+        db_config, args.openai_key or None, result_cache_ttl=args.result_cache_ttl,
+        intent_templates=args.intent_templates, question_index=args.question_index,
+        rollup_interval=args.rollup_interval or 0,
+    )
+    pipeline.cargar_esquema()
+    atajos = {
+        "result_cache_ttl": args.result_cache_ttl,
+        "intent_templates": args.intent_templates,
+        "question_index": args.question_index,
+        "rollup_interval": args.rollup_interval,
+    }
+
+    def medir(pregunta):
+        inicio = time.perf_counter()
+        pipeline.run(pregunta)
+        return pregunta, time.perf_counter() - inicio
+
+    trabajo = [p for _ in range(repeticiones) for p in preguntas]
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            tiempos = list(executor.map(medir, trabajo))
+        total = time.perf_counter() - inicio
+    finally:
+        pipeline.close()
+
+    por_pregunta = {}
+    for pregunta, segundos in tiempos:
+        por_pregunta.setdefault(pregunta, []).append(segundos)
+    for pregunta, valores in por_pregunta.items():
+        print(f"{statistics.median(valores) * 1000:9.1f} ms  {pregunta}")
+
+    todos = [segundos for _, segundos in tiempos]
+    print(
+        f"\n{len(todos)} consultas ({args.mode}, concurrencia {args.concurrency}) | "
+        f"p50 {percentil(todos, 0.5) * 1000:.1f} ms | p95 {percentil(todos, 0.95) * 1000:.1f} ms | "
+        f"{len(todos) / total:.1f} consultas/s"
+    )
+    print("Atajos: " + ", ".join(f"{nombre}={valor}" for nombre, valor in atajos.items()))
+    if args.mode == "record":
+        print(f"Grabadas {backend.grabadas} llamadas en {args.fixtures}")
+    else:
+        print(f"Fixtures: {backend.stats}")
+    for caller, metricas in client.stats()["callers"].items():
+        print(f"  {caller}: {metricas}")
+
+
+if __name__ == "__main__":
+    main()
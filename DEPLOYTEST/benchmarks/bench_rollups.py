@@ -0,0 +1,122 @@
+# benchmarks/bench_rollups.py
+"""
+Compara las consultas de conteo sobre detections contra las mismas consultas reescritas por AggregateRouter
+sobre los rollups por hora y por día de RollupMaintainer.
+
+Crea (si no existe) una base de datos sintética con la tabla detections en un MySQL local (ver
+bench_index_advisor.py), construye los rollups (la primera vez resume todos los datos) y, para cada consulta,
+mide la mediana de tiempo y las filas leídas por el servidor (Handler_read_*) de ambas versiones y verifica
+que entreguen el mismo resultado.
+
+Uso:
+    python bench_rollups.py --user root --password secret --rows 2000000 --days 30
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+from bench_index_advisor import conectar, crear_datos_sinteticos
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from rollups import AggregateRouter, RollupMaintainer  # noqa: E402
+
+
+def consultas_por_defecto(inicio_mes_ms, inicio_semana_ms, fin_ms):
+    mes = f"init_time BETWEEN {inicio_mes_ms} AND {fin_ms}"
+    semana = f"init_time BETWEEN {inicio_semana_ms} AND {fin_ms}"
+    return [
+        f"SELECT COUNT(*) AS total FROM detections WHERE {mes}",
+        f"SELECT COUNT(*) AS total FROM detections WHERE description = 'Rojo' AND {mes}",
+        f"SELECT description, COUNT(*) AS cantidad_detecciones FROM detections WHERE attribute_id = 2 AND {semana} "
+        "GROUP BY description ORDER BY cantidad_detecciones DESC",
+        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, attribute_id, COUNT(attribute_id) AS cantidad "
+        f"FROM detections WHERE {mes} GROUP BY 1, 2",
+        "SELECT DATE(FROM_UNIXTIME(init_time / 1000)) AS dia, COUNT(*) AS cantidad FROM detections "
+        f"WHERE LEFT(object_id, LENGTH(object_id) - 27) = 'CAM007' AND {mes} GROUP BY dia ORDER BY dia",
+    ]
+
+
+def filas_leidas(cursor):
+    cursor.execute("SHOW SESSION STATUS LIKE 'Handler_read%'")
+    return sum(int(valor) for _, valor in cursor.fetchall())
+
+
+def medir(conn, sql, params, repeticiones):
+    """
+    :return: Tupla (mediana en segundos, filas leídas por ejecución, filas del resultado ordenadas).
+    """
+    cursor = conn.cursor()
+    tiempos = []
+    try:
+        for _ in range(repeticiones):
+            antes = filas_leidas(cursor)
+            inicio = time.perf_counter()
+            cursor.execute(sql, params)
+            filas = cursor.fetchall()
+            tiempos.append(time.perf_counter() - inicio)
+            leidas = filas_leidas(cursor) - antes
+    finally:
+        cursor.close()
+    return statistics.median(tiempos), leidas, sorted(filas, key=repr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("MYSQL_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MYSQL_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("MYSQL_USER", "root"))
+    parser.add_argument("--password", default=os.getenv("MYSQL_PASSWORD", ""))
+    parser.add_argument("--database", default="bench_rollups")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--cameras", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    crear_datos_sinteticos(args)
+
+    mantenedor = RollupMaintainer(lambda: conectar(args), lag_ms=0)
+    inicio = time.perf_counter()
+    mantenedor.actualizar()
+    if not mantenedor.listo:
+        sys.exit("No se pudieron preparar los rollups (ver el log).")
+    print(f"Rollups actualizados en {time.perf_counter() - inicio:.1f} s "
+          f"(watermark {datetime.datetime.fromtimestamp(mantenedor.watermark / 1000)}).")
+    router = AggregateRouter(mantenedor)
+
+    hoy = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    fin_ms = int(time.time() * 1000)
+    consultas = consultas_por_defecto(
+        int((hoy - datetime.timedelta(days=args.days - 1)).timestamp() * 1000),
+        int((hoy - datetime.timedelta(days=6)).timestamp() * 1000),
+        fin_ms,
+    )
+
+    conn = conectar(args)
+    try:
+        print(f"\n{'detalle':>10} {'rollups':>10} {'mejora':>8} {'filas leídas':>22}  consulta")
+        for sql in consultas:
+            cursor = conn.cursor()
+            reescrita, params = router.enrutar(cursor, sql)
+            cursor.close()
+            if reescrita == sql:
+                print(f"{'':>10} {'':>10} {'':>8} {'':>22}  (no se reescribe) {sql}")
+                continue
+            t_detalle, leidas_detalle, filas_detalle = medir(conn, sql, None, args.repeat)
+            t_rollup, leidas_rollup, filas_rollup = medir(conn, reescrita, params, args.repeat)
+            mejora = t_detalle / t_rollup if t_rollup else float("inf")
+            igual = "" if filas_detalle == filas_rollup else "  ¡RESULTADOS DISTINTOS!"
+            print(f"{t_detalle * 1000:8.1f}ms {t_rollup * 1000:8.1f}ms {mejora:7.1f}x "
+                  f"{leidas_detalle:>10} -> {leidas_rollup:<9}  {sql}{igual}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
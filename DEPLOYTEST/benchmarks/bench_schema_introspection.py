@@ -0,0 +1,110 @@
+# benchmarks/bench_schema_introspection.py
+"""
+Compara la extracción del esquema tabla por tabla (N+1) contra el modo masivo de DBSchemaAgent.
+
+Crea (si no existe) una base de datos sintética con N tablas en un MySQL local y mide
+DBSchemaAgent.get_schema_dict con bulk_introspection=False y bulk_introspection=True.
+
+Uso:
+    python bench_schema_introspection.py --user root --password secret --tables 500 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import mysql.connector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from db_schema import DBSchemaAgent  # noqa: E402
+
+
+def crear_esquema_sintetico(args):
+    """
+    Crea la base de datos de prueba con `args.tables` tablas. Cada tabla tiene una llave primaria,
+    varias columnas de distintos tipos y una llave foránea hacia la tabla anterior.
+    """
+    conn = mysql.connector.connect(host=args.host, port=args.port, user=args.user, password=args.password)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+        cursor.execute(f"USE `{args.database}`")
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s", (args.database,)
+        )
+        existentes = cursor.fetchone()[0]
+        if existentes >= args.tables:
+            print(f"Reutilizando {existentes} tablas existentes en '{args.database}'.")
+            return
+
+        print(f"Creando {args.tables} tablas en '{args.database}'...")
+        for i in range(args.tables):
+            fk = ""
+            if i > 0:
+                fk = f", parent_id INT, FOREIGN KEY (parent_id) REFERENCES `t_{i - 1:04d}`(id)"
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS `t_{i:04d}` (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    init_time BIGINT,
+                    object_id VARCHAR(64),
+                    attribute_id INT,
+                    description VARCHAR(64),
+                    acurrancy DOUBLE,
+                    created_at DATETIME
+                    {fk}
+                )
+            """)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def medir(args, bulk):
+    def get_connection():
+        return mysql.connector.connect(
+            host=args.host, port=args.port, user=args.user, password=args.password, database=args.database
+        )
+
+    tiempos = []
+    tablas = 0
+    for _ in range(args.repeat):
+        agent = DBSchemaAgent(get_connection, args.database, include_sample_data=False, bulk_introspection=bulk)
+        inicio = time.perf_counter()
+        schema = agent.get_schema_dict()
+        tiempos.append(time.perf_counter() - inicio)
+        tablas = len(schema)
+    return tablas, tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("MYSQL_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MYSQL_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("MYSQL_USER", "root"))
+    parser.add_argument("--password", default=os.getenv("MYSQL_PASSWORD", ""))
+    parser.add_argument("--database", default="bench_schema_introspection")
+    parser.add_argument("--tables", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    crear_esquema_sintetico(args)
+
+    resultados = {}
+    for nombre, bulk in (("tabla por tabla", False), ("masivo", True)):
+        tablas, tiempos = medir(args, bulk)
+        resultados[nombre] = statistics.median(tiempos)
+        print(
+            f"{nombre:>16}: {tablas} tablas | mediana {statistics.median(tiempos) * 1000:.1f} ms "
+            f"| mín {min(tiempos) * 1000:.1f} ms | máx {max(tiempos) * 1000:.1f} ms"
+        )
+
+    if resultados["masivo"] > 0:
+        print(f"Aceleración: {resultados['tabla por tabla'] / resultados['masivo']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,33 @@
 # app.py
 
-import mysql.connector
-import pandas as pd
 import datetime
+import logging
+import os
 import re
-
-from db_schema import DBSchemaAgent
+import threading
+import time
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from columnar_result import ColumnarResult
+from connection_pool import get_pool
+from schema_registry import get_schema_registry
 from semantic_mapping import SemanticMappingAgent
 from query_interpreter import UserQueryAgent
 from sql_generator import SQLGenerationAgent
 from query_executor import QueryExecutor
+from result_cache import ResultCache
+from sql_compiler import parametrizar_sql, renderizar_sql
+from sql_guard import SQLGuard
 from response_formatter import ResponseFormatter
 from data_analyzer import DataAnalysisAgent
+from intent_templates import IntentRegistry
+from llm_usage import RequestUsage, contabilizar, propagar_contexto, uso_actual
+from question_index import QuestionIndex
+from index_advisor import WorkloadRecorder
+from rollups import AggregateRouter, RollupMaintainer
+from pagination import KeysetPaginator
 
 
 def infer_table_from_query(query, semantic_map):
@@ -159,143 +175,632 @@ def check_if_chart_request(query):
     return False, None
 
 
-def process_query(prompt, db_config, openai_api_key):
+class QueryPipeline:
     """
-    Procesa la consulta del usuario:
-      - Verifica si es para el asistente.
-      - Detecta si se solicita un gráfico.
-      - Extrae el esquema y genera el mapa semántico.
-      - Interpreta la consulta en lenguaje natural.
-      - Infiera la tabla si no se indica.
-      - Genera y ejecuta la consulta SQL.
-      - Formatea la respuesta (incluyendo análisis de datos si corresponde).
+    Pipeline de consulta de larga vida para una configuración de base de datos.
+
+    Se construye una sola vez por db_config y conserva entre mensajes los agentes ya
+    inicializados, el esquema, el mapa semántico y el pool de conexiones, de modo que
+    cada mensaje solo paga el costo de interpretar, generar y ejecutar su consulta.
     """
-    # Verificar si es una consulta para el asistente
-    if es_consulta_asistente(prompt):
+
+    def __init__(self, db_config, openai_api_key, model="gpt-3.5-turbo", sql_limit=25, pool_size=5, max_concurrency=4,
+                 result_cache_ttl=60, top_k_tables=3, single_round_trip=True, intent_templates=True, question_index=True,
+                 token_budget=None, max_rows_examined=1000000, max_execution_ms=15000, prepared_statements=32,
+                 workload_log=None, rollup_interval=None):
+        """
+        :param db_config: Diccionario con host, user, password, database y port.
+        :param openai_api_key: Clave API de OpenAI.
+        :param model: Modelo de lenguaje usado para interpretar las consultas.
+        :param sql_limit: Límite de registros indicado al generador de SQL.
+        :param pool_size: Tamaño del pool de conexiones compartido.
+        :param max_concurrency: Máximo de ramas (generación de SQL, ejecución y formateo) en paralelo
+                                para las consultas comparativas.
+        :param result_cache_ttl: Segundos de vida de los resultados en la caché de consultas (0 la desactiva).
+        :param top_k_tables: Tablas relevantes que se incluyen en el prompt de interpretación (None incluye
+                             el esquema y el mapa semántico completos).
+        :param single_round_trip: Si es True, la estructura y el SQL se piden en una sola llamada al LLM;
+                                  si esa respuesta no es válida se usa el camino de dos pasos.
+        :param intent_templates: Si es True, las preguntas frecuentes que coinciden con una plantilla de
+                                 intención se ejecutan directamente, sin llamar al LLM.
+        :param question_index: Si es True, las preguntas muy parecidas a otras ya resueltas reutilizan su SQL
+                               y las algo parecidas se usan como ejemplos en el prompt.
+        :param token_budget: Máximo de tokens de LLM por pregunta. Al superarlo, la respuesta se arma localmente
+                             (modo rápido y sin llamadas a GPT para el formateo). None para no limitar.
+        :param max_rows_examined: Máximo de filas que puede recorrer (según EXPLAIN) el SQL generado por el LLM;
+                                  las consultas que lo superan se rechazan con un motivo que se muestra al usuario.
+                                  None desactiva la guardia de SQL.
+        :param max_execution_ms: Tiempo máximo de ejecución de cada consulta generada por el LLM, en milisegundos.
+        :param prepared_statements: Sentencias preparadas que se guardan por conexión del pool (0 las desactiva).
+                                    Los literales del SQL generado se pasan como parámetros, de modo que las
+                                    preguntas con la misma forma reutilizan la sentencia y su plan.
+        :param workload_log: Archivo JSON Lines donde se registra cada consulta ejecutada con su tiempo, para
+                             el asesor de índices (por defecto, la variable de entorno WORKLOAD_LOG; sin ella,
+                             el registro queda solo en memoria, en self.workload).
+        :param rollup_interval: Segundos entre actualizaciones de las tablas de resumen de detections por hora y
+                                por día (ver RollupMaintainer). Los conteos que se pueden responder con ellas se
+                                reescriben para leerlas en vez de la tabla de detalle. Por defecto, la variable
+                                de entorno ROLLUP_INTERVAL; sin ella (o con 0) los rollups quedan desactivados.
+        """
+        self.db_config = dict(db_config)
+        self.openai_api_key = openai_api_key
+        self.pool = get_pool(self.db_config, size=pool_size, prepared_statements=prepared_statements)
+        self.get_connection = self.pool.get_connection
+
+        self.semantic_agent = SemanticMappingAgent(custom_rules=None)
+        self.user_query_agent = UserQueryAgent(
+            llm_api_key=openai_api_key, model=model, temperature=0.0, top_k_tables=top_k_tables
+        )
+        self.sql_generator = SQLGenerationAgent(limit=sql_limit, openai_api_key=openai_api_key)
+        self.intent_registry = (
+            IntentRegistry(parse_date_reference=self.sql_generator._parse_date_reference) if intent_templates else None
+        )
+        self.question_index = (
+            QuestionIndex(parse_date_reference=self.sql_generator._parse_date_reference) if question_index else None
+        )
+        # Preguntas repetidas (p. ej. "¿Cuántos vehículos se detectaron hoy?") generan el mismo SQL
+        self.result_cache = ResultCache(ttl=result_cache_ttl) if result_cache_ttl else None
+        # El SQL generado por el LLM se revisa antes de ejecutarse; el compilado localmente ya viene acotado
+        self.sql_guard = (
+            SQLGuard(max_rows_examined=max_rows_examined, max_execution_ms=max_execution_ms)
+            if max_rows_examined is not None else None
+        )
+        self.workload = WorkloadRecorder(path=workload_log or os.getenv("WORKLOAD_LOG"))
+        # Los conteos por día/hora, cámara, atributo y descripción se responden con los rollups de detections
+        if rollup_interval is None:
+            rollup_interval = float(os.getenv("ROLLUP_INTERVAL") or 0)
+        self.rollups = RollupMaintainer(self.get_connection, intervalo=rollup_interval) if rollup_interval else None
+        if self.rollups is not None:
+            self.rollups.start()
+        self.query_executor = QueryExecutor(
+            self.get_connection, result_cache=self.result_cache, guard=self.sql_guard, workload=self.workload,
+            router=AggregateRouter(self.rollups) if self.rollups is not None else None,
+        )
+        # Los listados se piden por páginas de sql_limit filas; las siguientes no pasan por el LLM
+        self.paginador = KeysetPaginator(self.query_executor, tamano=sql_limit)
+        self.analysis_agent = DataAnalysisAgent(time_unit='ms')
+        # Hilos para el trabajo bloqueante de base de datos en run_async (acotado al tamaño del pool)
+        self.db_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="QueryPipelineDB")
+        # Hilos para las ramas paralelas de run (una por estructura de consulta)
+        self.max_concurrency = max_concurrency
+        self.single_round_trip = single_round_trip
+        self.token_budget = token_budget
+        self.fanout_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="QueryPipelineRama")
+        # Solo se usa para resolver partes ya planificadas, que no dependen del estado de comparativas
+        self._formateador_partes = ResponseFormatter(openai_api_key)
+
+        self.schema = None
+        self.semantic_map = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def close(self):
+        """
+        Detiene la actualización de los rollups y los hilos del pipeline. Las tareas en curso terminan, pero
+        el pipeline ya no acepta consultas. El pool de conexiones es compartido y no se cierra.
+        """
+        if self.rollups is not None:
+            self.rollups.stop()
+        self.db_executor.shutdown(wait=False)
+        self.fanout_executor.shutdown(wait=False)
+
+    def cargar_esquema(self):
+        """
+        Obtiene el esquema del registro compartido y regenera el mapa semántico solo si el esquema cambió.
+
+        :return: Tupla (schema, semantic_map).
+        """
+        schema = get_schema_registry().get_schema(
+            self.db_config, self.get_connection, main_tables=None, include_sample_data=False
+        )
+        if schema is not self.schema:
+            self.semantic_agent.map_cache = {}
+            self.semantic_map = self.semantic_agent.generate_map(schema)
+            self.schema = schema
+        return self.schema, self.semantic_map
+
+    def _nuevo_formateador(self):
+        # ResponseFormatter acumula estado de comparativas durante una misma respuesta,
+        # por lo que se crea uno por mensaje (su construcción no tiene costo).
+        return ResponseFormatter(self.openai_api_key)
+
+    def _analizar_resultado(self, resultado):
+        """
+        Análisis estadístico de un resultado si incluye una columna 'timestamp' y alguna columna numérica.
+
+        :return: Diccionario {"agg_data": ...} o None.
+        """
+        if not isinstance(resultado, ColumnarResult) or "timestamp" not in resultado.columns:
+            return None
+        numeric_cols = [col for col in resultado.columns if col != "timestamp"]
+        if not numeric_cols:
+            return None
+        # Se reutiliza el DataFrame del resultado (el mismo que muestra el frontend)
+        df = resultado.to_pandas()[["timestamp", numeric_cols[0]]]
+        agg_df = self.analysis_agent.aggregate_by_time(df, "timestamp", numeric_cols[0], freq='D')
+        return {"agg_data": agg_df.to_dict(orient="list")}
+
+    def run(self, prompt, rapido=False):
+        """
+        Procesa la consulta del usuario:
+          - Verifica si es para el asistente.
+          - Detecta si se solicita un gráfico.
+          - Obtiene el esquema y el mapa semántico (cacheados).
+          - Interpreta la consulta en lenguaje natural.
+          - Infiere la tabla si no se indica.
+          - Genera y ejecuta la consulta SQL.
+          - Formatea la respuesta (incluyendo análisis de datos si corresponde).
+
+        :param prompt: Consulta del usuario en lenguaje natural.
+        :param rapido: Si es True, los conteos y resultados agrupados se responden con el resumen local,
+                       sin la llamada a GPT que lo reformula (útil para clientes sensibles a la latencia).
+        :return: Diccionario con estructura_consulta, sql, resultados, formatted_response, analysis_result
+                 y llm_usage (tokens y costo de la pregunta en total, por etapa y por modelo).
+        """
+        # Verificar si es una consulta para el asistente
+        if es_consulta_asistente(prompt):
+            return self._respuesta_asistente()
+
+        uso = RequestUsage(self.token_budget)
+        with contabilizar(uso):
+            estructura_consulta, sql, resultados = self._consultar(prompt)
+            result = self._responder(prompt, estructura_consulta, sql, resultados, rapido)
+        result["llm_usage"] = uso.resumen()
+        return result
+
+    def run_stream(self, prompt, rapido=False):
+        """
+        Igual que run, pero la respuesta formateada se entrega como generador de fragmentos de texto
+        para mostrarla a medida que GPT la produce (por ejemplo, con st.write_stream).
+
+        La primera parte de la respuesta se transmite token a token; las demás se resuelven en paralelo
+        mientras tanto y se entregan en orden. Al agotar el generador, result["formatted_response"]
+        queda con el texto completo.
+
+        :param prompt: Consulta del usuario en lenguaje natural.
+        :param rapido: Igual que en run.
+        :return: El mismo diccionario que run (con formatted_response vacío hasta agotar el generador)
+                 más "formatted_response_stream".
+        """
+        if es_consulta_asistente(prompt):
+            result = self._respuesta_asistente()
+            result["formatted_response_stream"] = iter([result["formatted_response"]])
+            return result
+
+        uso = RequestUsage(self.token_budget)
+        with contabilizar(uso):
+            estructura_consulta, sql, resultados = self._consultar(prompt)
+            partes = self._planificar_partes(estructura_consulta, sql, resultados, rapido)
+        result = self._armar_resultado(prompt, estructura_consulta, sql, resultados, [])
+        result["llm_usage"] = uso.resumen()
+        result["formatted_response_stream"] = self._transmitir_partes(partes, result, uso)
+        return result
+
+    def _transmitir_partes(self, partes, result, uso):
+        """
+        Generador de fragmentos de la respuesta: la primera parte en streaming y las siguientes
+        (ya encargadas a fanout_executor) a medida que se necesitan. El uso de tokens del formateo
+        se suma a `uso` y result["llm_usage"] se actualiza al terminar.
+        """
+        # Mensaje final de los gráficos (lo que _armar_resultado agregó al texto vacío)
+        cierre = result["formatted_response"]
+        textos = []
+        with contabilizar(uso):
+            siguientes = [
+                self.fanout_executor.submit(propagar_contexto(self._formateador_partes.resolver_parte), p)
+                for p in partes[1:]
+            ]
+            try:
+                if partes:
+                    for delta in self._formateador_partes.resolver_parte_stream(partes[0]):
+                        textos.append(delta)
+                        yield delta
+                for futuro in siguientes:
+                    texto = "\n\n" + futuro.result()
+                    textos.append(texto)
+                    yield texto
+                if cierre:
+                    texto = ("\n\n" if textos else "") + cierre
+                    textos.append(texto)
+                    yield texto
+            finally:
+                for futuro in siguientes:
+                    futuro.cancel()
+                result["formatted_response"] = "".join(textos)
+                result["llm_usage"] = uso.resumen()
+
+    def _consultar(self, prompt):
+        """
+        Obtiene el esquema, interpreta la consulta, genera el SQL y lo ejecuta.
+
+        :return: Tupla (estructura_consulta, sql, resultados); listas si la consulta es comparativa.
+        """
+        schema, semantic_map = self.cargar_esquema()
+
+        # Preguntas frecuentes: plantilla de intención y ejecución directa, sin LLM para el SQL
+        intencion = self._resolver_intencion(prompt, schema)
+        if intencion is not None:
+            estructura_consulta, plantilla, params = intencion
+            resultados = self._ejecutar_consulta(plantilla, params, verificar=False)
+            return estructura_consulta, renderizar_sql(plantilla, params), resultados
+
+        # Preguntas parecidas a otras ya resueltas: se reutiliza su SQL o se usan como ejemplos en el prompt
+        reuso, ejemplos = self._buscar_similares(prompt)
+        if reuso is not None:
+            estructura_consulta, sql = reuso
+            resultados = self._ejecutar_generado(sql)
+            if resultados is not None:
+                return estructura_consulta, sql, resultados
+
+        # Interpretar la consulta en lenguaje natural (usando OpenAI); en modo combinado llega también el SQL
+        inicio_llm = time.perf_counter()
+        combinado = None
+        if self.single_round_trip:
+            combinado = self.user_query_agent.interpretar_y_generar_sql(
+                prompt, schema, semantic_map, limit=self.sql_generator.limit, ejemplos=ejemplos
+            )
+        if combinado is None:
+            combinado = (self.user_query_agent.interpretar_consulta(prompt, schema, semantic_map, ejemplos=ejemplos), None)
+        self._registrar_latencia_llm(inicio_llm)
+        estructura_consulta = self._completar_estructura(combinado[0], prompt, semantic_map)
+
+        # Generar (si falta) y ejecutar el SQL de cada estructura en paralelo (una rama por estructura)
+        estructuras = estructura_consulta if isinstance(estructura_consulta, list) else [estructura_consulta]
+        sqls = self._sql_por_estructura(estructuras, combinado[1])
+        ramas = list(self.fanout_executor.map(
+            propagar_contexto(lambda est, sql: self._ejecutar_rama(est, schema, sql)), estructuras, sqls
+        ))
+        estructura_consulta, sql, resultados = self._unir_ramas(estructura_consulta, estructuras, ramas)
+        self._registrar_pregunta(prompt, estructura_consulta, sql, resultados)
+        return estructura_consulta, sql, resultados
+
+    def _responder(self, prompt, estructura_consulta, sql, resultados, rapido=False):
+        """
+        Formatea la respuesta (se planifica en orden y las llamadas a GPT se hacen en paralelo) y arma el resultado.
+        """
+        partes = self._planificar_partes(estructura_consulta, sql, resultados, rapido)
+        formatted_responses = list(
+            self.fanout_executor.map(propagar_contexto(self._formateador_partes.resolver_parte), partes)
+        )
+        return self._armar_resultado(prompt, estructura_consulta, sql, resultados, formatted_responses)
+
+    async def run_async(self, prompt, rapido=False):
+        """
+        Versión asíncrona de run. Las llamadas al LLM usan HTTP asíncrono y el trabajo de base de datos
+        se delega a un pool de hilos acotado, de modo que un solo event loop atiende muchas consultas a la vez.
+
+        :param prompt: Consulta del usuario en lenguaje natural.
+        :param rapido: Igual que en run.
+        :return: El mismo diccionario que run.
+        """
+        if es_consulta_asistente(prompt):
+            return self._respuesta_asistente()
+
+        uso = RequestUsage(self.token_budget)
+        with contabilizar(uso):
+            # Las tareas creadas dentro del bloque heredan el contexto (y con él, `uso`)
+            result = await self._run_async(prompt, rapido)
+        result["llm_usage"] = uso.resumen()
+        return result
+
+    async def _run_async(self, prompt, rapido):
+        loop = asyncio.get_running_loop()
+        schema, semantic_map = await loop.run_in_executor(self.db_executor, self.cargar_esquema)
+
+        intencion = self._resolver_intencion(prompt, schema)
+        if intencion is not None:
+            estructura_consulta, plantilla, params = intencion
+            resultados = await loop.run_in_executor(
+                self.db_executor, lambda: self._ejecutar_consulta(plantilla, params, verificar=False)
+            )
+            return await self._responder_async(
+                prompt, estructura_consulta, renderizar_sql(plantilla, params), resultados, rapido=rapido
+            )
+
+        reuso, ejemplos = self._buscar_similares(prompt)
+        if reuso is not None:
+            estructura_consulta, sql = reuso
+            resultados = await loop.run_in_executor(self.db_executor, self._ejecutar_generado, sql)
+            if resultados is not None:
+                return await self._responder_async(prompt, estructura_consulta, sql, resultados, rapido=rapido)
+
+        inicio_llm = time.perf_counter()
+        combinado = None
+        if self.single_round_trip:
+            combinado = await self.user_query_agent.interpretar_y_generar_sql_async(
+                prompt, schema, semantic_map, limit=self.sql_generator.limit, ejemplos=ejemplos
+            )
+        if combinado is None:
+            combinado = (
+                await self.user_query_agent.interpretar_consulta_async(prompt, schema, semantic_map, ejemplos=ejemplos),
+                None,
+            )
+        self._registrar_latencia_llm(inicio_llm)
+        estructura_consulta = self._completar_estructura(combinado[0], prompt, semantic_map)
+
+        limite = asyncio.Semaphore(self.max_concurrency)
+
+        async def acotado(coro):
+            async with limite:
+                return await coro
+
+        estructuras = estructura_consulta if isinstance(estructura_consulta, list) else [estructura_consulta]
+        sqls = self._sql_por_estructura(estructuras, combinado[1])
+        ramas = await asyncio.gather(
+            *(acotado(self._ejecutar_rama_async(est, schema, sql)) for est, sql in zip(estructuras, sqls))
+        )
+        estructura_consulta, sql, resultados = self._unir_ramas(estructura_consulta, estructuras, ramas)
+        self._registrar_pregunta(prompt, estructura_consulta, sql, resultados)
+        return await self._responder_async(prompt, estructura_consulta, sql, resultados, acotado, rapido)
+
+    async def _responder_async(self, prompt, estructura_consulta, sql, resultados, acotado=None, rapido=False):
+        """
+        Versión asíncrona de _responder. `acotado` limita la concurrencia de las llamadas a GPT.
+        """
+        if acotado is None:
+            limite = asyncio.Semaphore(self.max_concurrency)
+
+            async def acotado(coro):
+                async with limite:
+                    return await coro
+
+        partes = self._planificar_partes(estructura_consulta, sql, resultados, rapido)
+        formatted_responses = list(await asyncio.gather(
+            *(acotado(self._formateador_partes.resolver_parte_async(parte)) for parte in partes)
+        ))
+        return self._armar_resultado(prompt, estructura_consulta, sql, resultados, formatted_responses)
+
+    def _resolver_intencion(self, prompt, schema):
+        """
+        Busca una plantilla de intención para la pregunta.
+
+        :return: Tupla (estructura, plantilla_sql, params), o None si no hay plantilla o están desactivadas.
+        """
+        if self.intent_registry is None:
+            return None
+        intencion = self.intent_registry.resolver(prompt, schema)
+        if intencion is None:
+            return None
+        _, estructura, plantilla, params = intencion
+        return estructura, plantilla, params
+
+    def _buscar_similares(self, prompt):
+        """
+        Busca la pregunta en el índice de preguntas ya resueltas.
+
+        :return: Tupla (reuso, ejemplos) de QuestionIndex.resolver, o (None, None) si el índice está desactivado.
+        """
+        if self.question_index is None:
+            return None, None
+        return self.question_index.resolver(prompt)
+
+    def _registrar_pregunta(self, prompt, estructura_consulta, sql, resultados):
+        # Solo se guardan las consultas de una estructura cuyo SQL se ejecutó sin error ni rechazo
+        if self.question_index is not None and isinstance(resultados, ColumnarResult) and not resultados.get("rechazo"):
+            self.question_index.registrar(prompt, estructura_consulta, sql)
+
+    def _registrar_latencia_llm(self, inicio):
+        # Latencia de interpretación con LLM, para estimar lo que ahorran las plantillas de intención
+        if self.intent_registry is not None:
+            self.intent_registry.registrar_latencia_llm(time.perf_counter() - inicio)
+
+    def _sql_por_estructura(self, estructuras, sql):
+        """
+        Reparte el SQL del modo combinado entre las estructuras (None donde hay que generarlo).
+        """
+        if sql is None:
+            return [None] * len(estructuras)
+        return sql if isinstance(sql, list) else [sql]
+
+    def _ejecutar_rama(self, estructura, schema, sql=None):
+        """
+        Genera (si no viene del modo combinado) y ejecuta el SQL de una estructura. Las estructuras
+        simples se compilan localmente a SQL parametrizado, sin llamar al LLM.
+
+        :return: Tupla (sql, resultado), o None si la tabla de la estructura no es válida.
+        """
+        compilado = self.sql_generator.compilar(estructura, schema)
+        if compilado is not None:
+            plantilla, params = compilado
+            resultado = self._ejecutar_consulta(plantilla, params, verificar=False)
+            return renderizar_sql(plantilla, params), resultado
+        if sql is None:
+            prompt = self.sql_generator.preparar_prompt(estructura, schema)
+            if prompt is None:
+                return None
+            sql = self.sql_generator.solicitar_sql(prompt)
+        return sql, self._ejecutar_generado(sql)
+
+    async def _ejecutar_rama_async(self, estructura, schema, sql=None):
+        loop = asyncio.get_running_loop()
+        compilado = self.sql_generator.compilar(estructura, schema)
+        if compilado is not None:
+            plantilla, params = compilado
+            resultado = await loop.run_in_executor(
+                self.db_executor, lambda: self._ejecutar_consulta(plantilla, params, verificar=False)
+            )
+            return renderizar_sql(plantilla, params), resultado
+        if sql is None:
+            prompt = self.sql_generator.preparar_prompt(estructura, schema)
+            if prompt is None:
+                return None
+            sql = await self.sql_generator.solicitar_sql_async(prompt)
+        return sql, await loop.run_in_executor(self.db_executor, self._ejecutar_generado, sql)
+
+    def _ejecutar_generado(self, sql):
+        """
+        Ejecuta el SQL generado por el LLM como plantilla con parámetros (sus literales), para reutilizar
+        la sentencia preparada de las consultas con la misma forma. La guardia revisa la consulta.
+        """
+        plantilla, params = parametrizar_sql(sql)
+        return self._ejecutar_consulta(plantilla, params)
+
+    def _ejecutar_consulta(self, plantilla, params=None, verificar=True):
+        """
+        Ejecuta una consulta con los topes del ejecutor. Los listados se ejecutan como la primera página de
+        una paginación por llave: el resultado trae la clave "pagina" si hay más filas (ver siguiente_pagina).
+        """
+        pagina = self.paginador.preparar(plantilla, params, verificar)
+        if pagina is None:
+            return self.query_executor.ejecutar_sql_acotado(plantilla, params=params, verificar=verificar)
+        return self.paginador.ejecutar(pagina)
+
+    def siguiente_pagina(self, pagina):
+        """
+        Obtiene la siguiente página de un listado directamente con el ejecutor, sin llamar al LLM.
+
+        :param pagina: Valor de la clave "pagina" del resultado anterior.
+        :return: ColumnarResult (con su propia clave "pagina" si hay más filas), o None si la consulta falla.
+        """
+        return self.paginador.ejecutar(pagina)
+
+    def _unir_ramas(self, estructura_consulta, estructuras, ramas):
+        """
+        Reúne las ramas en el orden original de las estructuras, descartando las que no tenían una tabla válida.
+
+        :return: Tupla (estructura_consulta, sql, resultados); listas si quedan varias ramas.
+        """
+        validas = [(est, rama) for est, rama in zip(estructuras, ramas) if rama is not None]
+        if isinstance(estructura_consulta, list) and len(validas) > 1:
+            return (
+                [est for est, _ in validas],
+                [rama[0] for _, rama in validas],
+                [rama[1] for _, rama in validas],
+            )
+        if validas:
+            est, (sql, resultado) = validas[0]
+            return est, sql, resultado
+        return estructura_consulta, None, None
+
+    def _planificar_partes(self, estructura_consulta, sql, resultados, rapido=False):
+        """
+        Planifica, en orden, las partes de la respuesta de todos los resultados. La planificación es
+        secuencial porque el formateador combina comparativas consecutivas; solo la resolución con GPT
+        se hace en paralelo. Si la pregunta ya agotó su presupuesto de tokens, ninguna parte usa GPT.
+        """
+        uso = uso_actual()
+        if uso is not None and uso.agotado():
+            self.logger.info("Presupuesto de tokens agotado (%d); la respuesta se arma sin GPT.", uso.presupuesto)
+            partes = self._planificar_grupos(estructura_consulta, sql, resultados, rapido=True)
+            return [self._formateador_partes.parte_sin_gpt(parte) for parte in partes]
+        return self._planificar_grupos(estructura_consulta, sql, resultados, rapido)
+
+    def _planificar_grupos(self, estructura_consulta, sql, resultados, rapido):
+        response_formatter = self._nuevo_formateador()
+        if isinstance(resultados, list):
+            grupos = [
+                response_formatter.planificar_respuesta(res, est, consulta_sql=q, rapido=rapido)
+                for res, est, q in zip(resultados, estructura_consulta, sql)
+            ]
+        else:
+            grupos = [response_formatter.planificar_respuesta(resultados, estructura_consulta, consulta_sql=sql, rapido=rapido)]
+        return [parte for grupo in grupos for parte in grupo]
+
+    def _respuesta_asistente(self):
         return {
             "estructura_consulta": {},
             "sql": "",
             "resultados": {},
             "formatted_response": obtener_mensaje_asistente(),
-            "analysis_result": None
+            "analysis_result": None,
+            "llm_usage": None
         }
-    
-    # Verificar si es una solicitud de gráfico
-    is_chart_request, chart_type = check_if_chart_request(prompt)
-
-    def get_connection():
-        return mysql.connector.connect(
-            host=db_config.get("host", "localhost"),
-            user=db_config.get("user", ""),
-            password=db_config.get("password", ""),
-            database=db_config.get("database", ""),
-            port=db_config.get("port", 3306)
-        )
-
-    db_name = db_config.get("database", "")
-
-    # Extraer el esquema
-    db_agent = DBSchemaAgent(get_connection, db_name, main_tables=None, include_sample_data=False)
-    schema = db_agent.get_schema_dict()
 
-    # Generar el mapa semántico
-    semantic_agent = SemanticMappingAgent(custom_rules=None)
-    semantic_map = semantic_agent.generate_map(schema)
-
-    # Interpretar la consulta en lenguaje natural (usando OpenAI)
-    user_query_agent = UserQueryAgent(llm_api_key=openai_api_key, model="gpt-3.5-turbo", temperature=0.0)
-    estructura_consulta = user_query_agent.interpretar_consulta(prompt, schema, semantic_map)
-    
-    # Verificar si tenemos múltiples consultas
-    is_multiple_queries = isinstance(estructura_consulta, list) and len(estructura_consulta) > 0
-    
-    if is_multiple_queries:
-        estructura_principal = estructura_consulta[0]  # Tomamos la primera consulta
-    else:
-        estructura_principal = estructura_consulta
-
-    # Si no hay tabla en la estructura, intentamos inferirla
-    if not estructura_principal.get("tabla"):
-        inferred_table = infer_table_from_query(prompt, semantic_map)
-        estructura_principal["tabla"] = inferred_table
-        
-    # Si hay múltiples consultas, asegurarse de que todas tengan una tabla asignada
-    if is_multiple_queries:
-        for i in range(len(estructura_consulta)):
-            if not estructura_consulta[i].get("tabla"):
-                estructura_consulta[i]["tabla"] = inferred_table
-
-    # Generar la consulta SQL
-    sql_generator = SQLGenerationAgent(limit=25)
-    sql = sql_generator.generar_sql(estructura_consulta, schema)
-
-    # Ejecutar la consulta SQL
-    query_executor = QueryExecutor(get_connection)
-    if isinstance(sql, list):  # Si hay varias consultas
-        resultados = [query_executor.ejecutar_sql(q) for q in sql]
-    else:  # Si es solo una consulta
-        resultados = query_executor.ejecutar_sql(sql)
-
-    # Formatear la respuesta en lenguaje natural usando GPT, pasando la consulta SQL
-    response_formatter = ResponseFormatter(openai_api_key)
-    if isinstance(resultados, list):
-        formatted_responses = [
-            response_formatter.formatear_respuesta(res, estructura_consulta[i], consulta_sql=q)
-            for i, (res, q) in enumerate(zip(resultados, sql))
-        ]
+    def _completar_estructura(self, estructura_consulta, prompt, semantic_map):
+        """
+        Normaliza la estructura interpretada y asigna la tabla inferida a las estructuras que no la indican.
+        """
+        if not estructura_consulta:
+            estructura_consulta = {}
+
+        # Verificar si tenemos múltiples consultas
+        is_multiple_queries = isinstance(estructura_consulta, list)
+        estructuras = estructura_consulta if is_multiple_queries else [estructura_consulta]
+
+        # Si alguna estructura no tiene tabla, intentamos inferirla
+        inferred_table = None
+        for estructura in estructuras:
+            if not estructura.get("tabla"):
+                if inferred_table is None:
+                    inferred_table = infer_table_from_query(prompt, semantic_map)
+                estructura["tabla"] = inferred_table
+        return estructura_consulta
+
+    def _armar_resultado(self, prompt, estructura_consulta, sql, resultados, formatted_responses):
+        """
+        Une las respuestas formateadas, agrega el análisis estadístico y arma el diccionario final.
+        """
         # Si es una solicitud de gráfico, agregar un mensaje adicional
+        is_chart_request, chart_type = check_if_chart_request(prompt)
         if is_chart_request:
-            formatted_responses.append(f"Generando {get_chart_type_name(chart_type)} con los datos solicitados.")
+            formatted_responses = formatted_responses + [
+                f"Generando {get_chart_type_name(chart_type)} con los datos solicitados."
+            ]
         formatted_response = "\n\n".join(formatted_responses)
-    else:
-        formatted_response = response_formatter.formatear_respuesta(resultados, estructura_consulta, consulta_sql=sql)
-        if is_chart_request:
-            formatted_response += f"\n\nGenerando {get_chart_type_name(chart_type)} con los datos solicitados."
-
-    # (Opcional) Análisis estadístico si la consulta incluye columnas de fechas
-    analysis_result = None
-    if is_multiple_queries and isinstance(resultados, list):
-        analysis_results = []
-        for idx, result in enumerate(resultados):
-            if result and "columns" in result and "data" in result and "timestamp" in result["columns"]:
-                df = pd.DataFrame(result["data"], columns=result["columns"])
-                numeric_cols = [col for col in result["columns"] if col != "timestamp"]
-                if numeric_cols:
-                    analysis_column = numeric_cols[0]
-                    analysis_agent = DataAnalysisAgent(time_unit='ms')
-                    df_converted = analysis_agent.convert_epoch_to_datetime(df.copy(), "timestamp")
-                    agg_df = analysis_agent.aggregate_by_time(df_converted, "timestamp", analysis_column, freq='D')
-                    analysis_results.append({"agg_data": agg_df.to_dict(orient="list")})
-            else:
-                analysis_results.append(None)
-        
-        if any(analysis_results):
-            analysis_result = next((res for res in analysis_results if res is not None), None)
-    else:
-        if resultados and isinstance(resultados, dict) and "columns" in resultados and "data" in resultados:
-            if "timestamp" in resultados["columns"]:
-                df = pd.DataFrame(resultados["data"], columns=resultados["columns"])
-                numeric_cols = [col for col in resultados["columns"] if col != "timestamp"]
-                if numeric_cols:
-                    analysis_column = numeric_cols[0]
-                    analysis_agent = DataAnalysisAgent(time_unit='ms')
-                    df_converted = analysis_agent.convert_epoch_to_datetime(df.copy(), "timestamp")
-                    agg_df = analysis_agent.aggregate_by_time(df_converted, "timestamp", analysis_column, freq='D')
-                    analysis_result = {"agg_data": agg_df.to_dict(orient="list")}
-
-    result = {
-        "estructura_consulta": estructura_consulta,
-        "sql": sql,
-        "resultados": resultados,
-        "formatted_response": formatted_response,
-        "analysis_result": analysis_result
-    }
-    
-    # Si es una solicitud de gráfico, se incluye esa información en el resultado final
-    if is_chart_request:
-        result["chart_request"] = {
-            "type": chart_type,
-            "request": prompt
+
+        # (Opcional) Análisis estadístico si la consulta incluye columnas de fechas
+        if isinstance(resultados, list):
+            analysis_result = next(
+                (res for res in (self._analizar_resultado(r) for r in resultados) if res is not None), None
+            )
+        else:
+            analysis_result = self._analizar_resultado(resultados)
+
+        result = {
+            "estructura_consulta": estructura_consulta,
+            "sql": sql,
+            "resultados": resultados,
+            "formatted_response": formatted_response,
+            "analysis_result": analysis_result
         }
-    
-    return result
+
+        # Si es una solicitud de gráfico, se incluye esa información en el resultado final
+        if is_chart_request:
+            result["chart_request"] = {
+                "type": chart_type,
+                "request": prompt
+            }
+
+        return result
+
+
+_pipelines = collections.OrderedDict()
+_pipelines_lock = threading.Lock()
+# Pipelines compartidos que se mantienen a la vez; al superarlo se cierra el usado hace más tiempo
+MAX_PIPELINES = 4
+
+
+def get_pipeline(db_config, openai_api_key):
+    """
+    Retorna el QueryPipeline compartido para db_config y la clave de OpenAI, creándolo la primera vez.
+    Si ya hay MAX_PIPELINES, el usado hace más tiempo se reemplaza y se cierra (ver QueryPipeline.close).
+    """
+    key = (tuple(sorted((k, str(v)) for k, v in db_config.items())), openai_api_key)
+    reemplazados = []
+    with _pipelines_lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is None:
+            pipeline = QueryPipeline(db_config, openai_api_key)
+            _pipelines[key] = pipeline
+            while len(_pipelines) > MAX_PIPELINES:
+                reemplazados.append(_pipelines.popitem(last=False)[1])
+        else:
+            _pipelines.move_to_end(key)
+    # Fuera del lock: detener los rollups puede esperar a que termine su actualización en curso
+    for anterior in reemplazados:
+        anterior.close()
+    return pipeline
+
+
+def process_query(prompt, db_config, openai_api_key, rapido=False):
+    """
+    Envoltura de compatibilidad: procesa la consulta con el QueryPipeline compartido para db_config.
+    Con rapido=True los conteos y agrupados se responden sin reformular con GPT.
+    """
+    return get_pipeline(db_config, openai_api_key).run(prompt, rapido=rapido)
+
+
+async def process_query_async(prompt, db_config, openai_api_key, rapido=False):
+    """
+    Variante asíncrona de process_query sobre el QueryPipeline compartido para db_config.
+    """
+    return await get_pipeline(db_config, openai_api_key).run_async(prompt, rapido=rapido)
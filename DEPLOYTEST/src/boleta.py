@@ -2,17 +2,18 @@ import os
 import datetime
 import base64
 import xml.etree.ElementTree as ET
-import openai
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet
 
+from llm_client import chat_completion
+
 # Configuración de la API de OpenAI:
 # Puedes asignar tu API key directamente o asegurarte de tenerla en la variable de entorno OPENAI_API_KEY
-#openai.api_key = os.getenv("OPENAI_API_KEY") or "TU_API_KEY_AQUI"
-openai.api_key = ""
+#OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or "TU_API_KEY_AQUI"
+OPENAI_API_KEY = ""
 
 
 # Datos fijos del emisor (empresa)
@@ -262,13 +263,15 @@ def conversation_mode():
         # Agregar el mensaje del usuario al historial
         conversation_history.append({"role": "user", "content": user_input})
         try:
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
+                caller="boleta.conversation_mode",
+                api_key=OPENAI_API_KEY or None,
                 model="gpt-3.5-turbo",
                 messages=conversation_history,
                 temperature=0.7,
                 max_tokens=150
             )
-            answer = response.choices[0].message['content'].strip()
+            answer = response["choices"][0]["message"]["content"].strip()
             conversation_history.append({"role": "assistant", "content": answer})
             print("Agente:", answer)
         except Exception as e:
@@ -2,7 +2,6 @@ import os
 import datetime
 import base64
 import xml.etree.ElementTree as ET
-import openai
 
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
@@ -20,6 +19,8 @@ from telegram.ext import (
     filters,
 )
 
+from llm_client import chat_completion
+
 # -------------------------
 # CONFIGURACIÓN DE CLAVES
 # -------------------------
@@ -27,8 +28,8 @@ from telegram.ext import (
 TELEGRAM_BOT_TOKEN = ""
 
 # Configura tu API key de OpenAI (puedes usar variable de entorno o asignarla directamente)
-#openai.api_key = os.getenv("OPENAI_API_KEY") or "TU_OPENAI_API_KEY_AQUI"
-openai.api_key= ""
+#OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or "TU_OPENAI_API_KEY_AQUI"
+OPENAI_API_KEY = ""
 # -------------------------
 # DATOS DEL EMISOR Y ARCHIVOS
 # -------------------------
@@ -290,7 +291,12 @@ def ai_generate_message(step, data):
         user_prompt = ""
     
     try:
-        response = openai.ChatCompletion.create(
+        response = chat_completion(
+            caller="boletev2.ai_generate_message",
+            api_key=OPENAI_API_KEY or None,
+            # Mensajes cortos del bot: si OpenAI tarda, mejor el texto por defecto que dejar esperando al usuario
+            timeout=8,
+            deadline=15,
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -299,7 +305,7 @@ def ai_generate_message(step, data):
             temperature=0.7,
             max_tokens=100
         )
-        return response.choices[0].message['content'].strip()
+        return response["choices"][0]["message"]["content"].strip()
     except Exception as e:
         defaults = {
             "ask_client_name": "Por favor, ingrese el nombre completo del cliente.",
@@ -1,7 +1,8 @@
 # comparative_chart_agent.py
-import openai
 import json
 
+from llm_client import chat_completion
+
 class ComparativeChartAgent:
     def __init__(self, openai_api_key, model="gpt-3.5-turbo", temperature=0.0):
         """
@@ -13,7 +14,6 @@ class ComparativeChartAgent:
         self.openai_api_key = openai_api_key
         self.model = model
         self.temperature = temperature
-        openai.api_key = self.openai_api_key
 
     def generate_chart_data(self, comparative_json):
         """
@@ -34,7 +34,9 @@ class ComparativeChartAgent:
         )
         
         try:
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
+                caller="ComparativeChartAgent",
+                api_key=self.openai_api_key,
                 model=self.model,
                 messages=[
                     {"role": "system", "content": "Eres un experto en análisis de datos y visualización."},
@@ -0,0 +1,197 @@
+# columnar_result.py
+
+import datetime
+import decimal
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def _decodificar(valor):
+    if isinstance(valor, (bytes, bytearray)):
+        try:
+            return valor.decode("utf-8")
+        except UnicodeDecodeError:
+            return bytes(valor)
+    return valor
+
+
+def _a_arreglo(valores):
+    """
+    Convierte los valores de una columna en un arreglo NumPy con el tipo más ajustado:
+      - Fechas y fechas-hora -> datetime64 (None -> NaT).
+      - Enteros sin nulos -> int64.
+      - Decimales y flotantes -> float64 (None -> NaN).
+      - Textos (los binarios se decodifican en UTF-8) y columnas mixtas -> object.
+    """
+    valores = [_decodificar(v) for v in valores]
+    presentes = [v for v in valores if v is not None]
+    tiene_nulos = len(presentes) != len(valores)
+
+    if presentes:
+        if all(isinstance(v, datetime.datetime) for v in presentes):
+            return np.array(valores, dtype="datetime64[us]")
+        if all(isinstance(v, datetime.date) and not isinstance(v, datetime.datetime) for v in presentes):
+            return np.array(valores, dtype="datetime64[D]")
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in presentes):
+            if not tiene_nulos:
+                try:
+                    return np.array(valores, dtype=np.int64)
+                except OverflowError:
+                    pass
+        elif all(isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool) for v in presentes):
+            return np.array([np.nan if v is None else float(v) for v in valores], dtype=np.float64)
+
+    arreglo = np.empty(len(valores), dtype=object)
+    arreglo[:] = valores
+    return arreglo
+
+
+class _RowView(Sequence):
+    """
+    Vista de filas (tuplas) sobre las columnas de un ColumnarResult. Las filas se construyen
+    solo al acceder a ellas, de modo que len() o un recorte no materializan el resultado completo.
+    """
+
+    def __init__(self, arrays, num_rows):
+        self._arrays = arrays
+        self._num_rows = num_rows
+
+    def __len__(self):
+        return self._num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(*(arr[index].tolist() for arr in self._arrays)))
+        if index < 0:
+            index += self._num_rows
+        if not 0 <= index < self._num_rows:
+            raise IndexError("índice de fila fuera de rango")
+        return tuple(arr[index:index + 1].tolist()[0] for arr in self._arrays)
+
+    def __iter__(self):
+        bloque = 1000
+        for inicio in range(0, self._num_rows, bloque):
+            yield from self[inicio:inicio + bloque]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ColumnarResult(Mapping):
+    """
+    Resultado de una consulta almacenado por columnas (un arreglo NumPy por columna).
+
+    Ocupa mucha menos memoria que una lista de tuplas y se convierte una sola vez a DataFrame
+    con to_pandas(), que reutilizan el análisis, la tabla y los gráficos del frontend.
+
+    Se comporta como el diccionario {"columns": [...], "data": [...]} que se usaba antes:
+    resultado["columns"], resultado["data"][0][0], resultado.get("truncated"), etc.
+    Las claves adicionales (por ejemplo "truncated") se guardan en `extras`.
+    """
+
+    def __init__(self, columns, arrays, **extras):
+        """
+        :param columns: Nombres de las columnas.
+        :param arrays: Lista de arreglos NumPy, uno por columna y todos del mismo largo.
+        :param extras: Claves adicionales del resultado (truncated, truncation_reason, ...).
+        """
+        self.columns = list(columns)
+        self.arrays = list(arrays)
+        self.num_rows = len(self.arrays[0]) if self.arrays else 0
+        self.extras = extras
+        self._df = None
+
+    @classmethod
+    def from_rows(cls, columns, rows, **extras):
+        """
+        Construye el resultado a partir de filas (lista de tuplas), como las de cursor.fetchall().
+        """
+        columns = list(columns)
+        if rows:
+            arrays = [_a_arreglo(valores) for valores in zip(*rows)]
+        else:
+            arrays = [np.empty(0, dtype=object) for _ in columns]
+        return cls(columns, arrays, **extras)
+
+    @classmethod
+    def from_chunks(cls, columns, chunks, **extras):
+        """
+        Construye el resultado a partir de bloques de filas (por ejemplo, de un ResultStream),
+        convirtiendo cada bloque a columnas antes de leer el siguiente.
+        """
+        columns = list(columns)
+        partes = [[] for _ in columns]
+        for chunk in chunks:
+            for idx, valores in enumerate(zip(*chunk)):
+                partes[idx].append(_a_arreglo(valores))
+
+        arrays = []
+        for bloques in partes:
+            if not bloques:
+                arrays.append(np.empty(0, dtype=object))
+            elif len({b.dtype for b in bloques}) == 1:
+                arrays.append(np.concatenate(bloques))
+            else:
+                # Tipos distintos entre bloques (p. ej. un bloque con nulos): se vuelve a inferir el tipo
+                arrays.append(_a_arreglo([v for b in bloques for v in b.tolist()]))
+        return cls(columns, arrays, **extras)
+
+    @property
+    def data(self):
+        return _RowView(self.arrays, self.num_rows)
+
+    @property
+    def nbytes(self):
+        """
+        Tamaño aproximado en memoria de los datos (incluye el contenido de los textos).
+        """
+        total = 0
+        for arr in self.arrays:
+            total += arr.nbytes
+            if arr.dtype == object:
+                total += sum(len(v) for v in arr if isinstance(v, (str, bytes)))
+        return total
+
+    def column(self, name):
+        """
+        Retorna el arreglo NumPy de una columna.
+        """
+        return self.arrays[self.columns.index(name)]
+
+    def to_pandas(self):
+        """
+        Retorna el resultado como DataFrame. Se construye una sola vez sobre los mismos arreglos
+        (sin copiar) y se reutiliza en llamadas posteriores; quien necesite modificarlo debe copiarlo.
+        """
+        if self._df is None:
+            if self.arrays:
+                # Se indexa por posición para admitir nombres de columna repetidos
+                df = pd.DataFrame(dict(enumerate(self.arrays)), copy=False)
+                df.columns = self.columns
+            else:
+                df = pd.DataFrame(columns=self.columns)
+            self._df = df
+        return self._df
+
+    def __getitem__(self, key):
+        if key == "columns":
+            return self.columns
+        if key == "data":
+            return self.data
+        return self.extras[key]
+
+    def __iter__(self):
+        yield "columns"
+        yield "data"
+        yield from self.extras
+
+    def __len__(self):
+        return 2 + len(self.extras)
+
+    def __repr__(self):
+        return repr({"columns": self.columns, "data": list(self.data), **self.extras})
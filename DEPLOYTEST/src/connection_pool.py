@@ -0,0 +1,397 @@
+# connection_pool.py
+
+import collections
+import logging
+import queue
+import re
+import threading
+import time
+
+import mysql.connector
+
+
+# Sentencias aplicadas a cada sesión nueva o reiniciada. Desactivamos ONLY_FULL_GROUP_BY porque
+# el SQL generado agrupa por posición (GROUP BY 1, 2) con columnas no agregadas.
+DEFAULT_SESSION_INIT = (
+    "SET SESSION sql_mode=(SELECT REPLACE(@@sql_mode, 'ONLY_FULL_GROUP_BY', ''))",
+)
+
+
+# Sentencias que pueden cambiar el estado de la sesión: variables, modo SQL, base de datos, tablas
+# temporales, bloqueos o sentencias preparadas con PREPARE
+_CAMBIA_SESION_RE = re.compile(
+    r"(?:^|;)\s*(?:/\*.*?\*/\s*)*(?:set|use|lock|unlock|prepare|do|handler|create\s+temporary)\b"
+    r"|@\w+\s*:=|\binto\s+@",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def cambia_sesion(sql):
+    """
+    Indica si una sentencia puede dejar estado en la sesión que deba reiniciarse antes de reutilizar la conexión.
+    """
+    return not isinstance(sql, str) or _CAMBIA_SESION_RE.search(sql) is not None
+
+
+class PoolExhaustedError(Exception):
+    """
+    Se lanza cuando no se obtiene una conexión libre dentro del tiempo de espera configurado.
+    """
+
+
+class PooledConnection:
+    """
+    Envoltura de una conexión obtenida del pool. Se comporta como la conexión original,
+    pero close() la devuelve al pool en lugar de cerrarla, por lo que DBSchemaAgent y
+    QueryExecutor pueden usarla sin cambios.
+    """
+
+    def __init__(self, pool, raw_connection):
+        self._pool = pool
+        self._raw = raw_connection
+        self._returned = False
+        self.sesion_modificada = False
+
+    def close(self):
+        """
+        Devuelve la conexión al pool (reiniciando el estado de la sesión si pudo cambiar).
+        """
+        if not self._returned:
+            self._returned = True
+            self._pool._release(self._raw, self.sesion_modificada)
+
+    def cursor(self, *args, **kwargs):
+        """
+        Cursor de la conexión física. Si el pool usa sentencias preparadas, el cursor registra las sentencias
+        que cambian el estado de la sesión, para reiniciarla al devolver la conexión.
+        """
+        cursor = self._raw.cursor(*args, **kwargs)
+        return _CursorDeSesion(self, cursor) if self._pool.prepared_statements else cursor
+
+    def prepared_cursor(self, template):
+        """
+        Cursor con la sentencia preparada de `template` en esta conexión física (ver ConnectionPool.prepared_statements).
+        No debe cerrarse: queda en la caché de la conexión para las siguientes consultas con la misma forma.
+
+        :return: Cursor preparado, o None si el pool no usa sentencias preparadas.
+        """
+        self._registrar(template)
+        return self._pool._prepared_cursor(self._raw, template)
+
+    def _registrar(self, sql):
+        if not self.sesion_modificada and cambia_sesion(sql):
+            self.sesion_modificada = True
+
+    def discard(self):
+        """
+        Cierra la conexión física y la retira del pool (por ejemplo, si quedó con resultados sin leer).
+        """
+        if not self._returned:
+            self._returned = True
+            self._pool._discard(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _CursorDeSesion:
+    """
+    Envoltura de un cursor de PooledConnection que marca la conexión cuando ejecuta una sentencia que
+    cambia el estado de la sesión (ver cambia_sesion).
+    """
+
+    def __init__(self, conexion, cursor):
+        self._conexion = conexion
+        self._cursor = cursor
+
+    def execute(self, operation, *args, **kwargs):
+        self._conexion._registrar(operation)
+        return self._cursor.execute(operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        self._conexion._registrar(operation)
+        return self._cursor.executemany(operation, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones MySQL para un db_config concreto.
+
+    - Limita el número de conexiones simultáneas a `size`.
+    - Verifica que la conexión siga viva al entregarla (ping) y la reemplaza si no lo está.
+    - Reinicia el estado de la sesión al devolverla y vuelve a aplicar `session_init`.
+    - Opcionalmente guarda, por conexión física, las sentencias preparadas de las últimas
+      `prepared_statements` plantillas (LRU), para que las consultas con la misma forma no se vuelvan
+      a analizar ni planificar. En ese caso la sesión solo se reinicia si se ejecutó alguna sentencia que
+      la cambia (SET, variables de usuario, tablas temporales...); el reinicio libera las sentencias
+      preparadas de la conexión, que se vuelven a preparar al usarse.
+    - Lleva contadores de checkouts, fallos y tiempo de espera.
+    """
+
+    def __init__(self, db_config, size=5, checkout_timeout=10.0, session_init=DEFAULT_SESSION_INIT, ping_after=0.0,
+                 prepared_statements=0):
+        """
+        :param db_config: Diccionario con host, user, password, database y port.
+        :param size: Número máximo de conexiones abiertas a la vez.
+        :param checkout_timeout: Segundos máximos de espera por una conexión libre.
+        :param session_init: Sentencias SQL que se aplican a cada sesión nueva o reiniciada.
+        :param ping_after: Solo se verifica la conexión si estuvo inactiva más de estos segundos.
+        :param prepared_statements: Máximo de sentencias preparadas por conexión (0 las desactiva).
+        """
+        self.db_config = db_config
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.session_init = tuple(session_init or ())
+        self.ping_after = ping_after
+        self.prepared_statements = prepared_statements
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # Conexión física -> OrderedDict(plantilla -> cursor preparado), en orden de uso
+        self._preparadas = {}
+        self._counters = {
+            "checkouts": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "in_use": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "prepared_hits": 0,
+            "prepared_misses": 0,
+            "prepared_evictions": 0,
+        }
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_connection(self):
+        """
+        Entrega una conexión del pool. Tiene la misma firma que la función get_connection
+        que reciben DBSchemaAgent y QueryExecutor.
+
+        :return: PooledConnection lista para usar.
+        """
+        inicio = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            self._count(failures=1, timeouts=1)
+            raise PoolExhaustedError(
+                f"No hay conexiones libres tras {self.checkout_timeout}s (tamaño del pool: {self.size})."
+            )
+        espera = time.perf_counter() - inicio
+
+        try:
+            raw = self._take_idle() or self._connect()
+        except Exception:
+            self._slots.release()
+            self._count(failures=1)
+            raise
+
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._counters["in_use"] += 1
+            self._counters["wait_time_total"] += espera
+            self._counters["wait_time_max"] = max(self._counters["wait_time_max"], espera)
+        return PooledConnection(self, raw)
+
+    def stats(self):
+        """
+        Retorna una copia de los contadores del pool (tiempos en milisegundos).
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        checkouts = counters["checkouts"]
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "in_use": counters["in_use"],
+            "checkouts": checkouts,
+            "failures": counters["failures"],
+            "timeouts": counters["timeouts"],
+            "created": counters["created"],
+            "discarded": counters["discarded"],
+            "wait_time_total_ms": round(counters["wait_time_total"] * 1000, 3),
+            "wait_time_max_ms": round(counters["wait_time_max"] * 1000, 3),
+            "wait_time_avg_ms": round(counters["wait_time_total"] * 1000 / checkouts, 3) if checkouts else 0.0,
+            "prepared_hits": counters["prepared_hits"],
+            "prepared_misses": counters["prepared_misses"],
+            "prepared_evictions": counters["prepared_evictions"],
+        }
+
+    def close_all(self):
+        """
+        Cierra todas las conexiones inactivas del pool.
+        """
+        while True:
+            try:
+                raw, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(raw)
+
+    def _take_idle(self):
+        while True:
+            try:
+                raw, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - idle_since < self.ping_after:
+                return raw
+            try:
+                if raw.is_connected():
+                    return raw
+            except Exception as e:
+                self.logger.warning("Fallo la verificación de la conexión: %s", e)
+            self.logger.info("Conexión inactiva caída; se descarta.")
+            self._count(discarded=1)
+            self._close_quietly(raw)
+
+    def _connect(self):
+        raw = mysql.connector.connect(
+            host=self.db_config.get("host", "localhost"),
+            user=self.db_config.get("user", ""),
+            password=self.db_config.get("password", ""),
+            database=self.db_config.get("database", ""),
+            port=self.db_config.get("port", 3306)
+        )
+        self._init_session(raw)
+        self._count(created=1)
+        return raw
+
+    def _init_session(self, raw):
+        cursor = raw.cursor()
+        try:
+            for statement in self.session_init:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    self.logger.warning("No se pudo aplicar '%s' a la sesión: %s", statement, e)
+        finally:
+            cursor.close()
+
+    def _prepared_cursor(self, raw, template):
+        if not self.prepared_statements:
+            return None
+        # Solo el hilo que tiene la conexión usa su caché; el bloqueo protege el diccionario compartido
+        with self._lock:
+            cache = self._preparadas.setdefault(raw, collections.OrderedDict())
+        cursor = cache.get(template)
+        if cursor is not None:
+            cache.move_to_end(template)
+            self._count(prepared_hits=1)
+            return cursor
+        try:
+            cursor = raw.cursor(prepared=True)
+        except Exception as e:
+            self.logger.warning("No se pudo crear un cursor preparado: %s", e)
+            return None
+        cache[template] = cursor
+        self._count(prepared_misses=1)
+        while len(cache) > self.prepared_statements:
+            _, antiguo = cache.popitem(last=False)
+            self._count(prepared_evictions=1)
+            try:
+                antiguo.close()  # Libera la sentencia en el servidor
+            except Exception:
+                pass
+        return cursor
+
+    def _release(self, raw, sesion_modificada=True):
+        try:
+            if self.prepared_statements and not sesion_modificada:
+                # Se termina la transacción (y su snapshot) sin liberar las sentencias preparadas
+                raw.rollback()
+            else:
+                # reset_session libera en el servidor las sentencias preparadas de la conexión
+                self._olvidar_preparadas(raw)
+                raw.reset_session()
+                self._init_session(raw)
+        except Exception as e:
+            self.logger.warning("No se pudo reiniciar la sesión; se descarta la conexión: %s", e)
+            self._discard(raw)
+            return
+        self._idle.put((raw, time.monotonic()))
+        self._count(in_use=-1)
+        self._slots.release()
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        self._count(discarded=1, in_use=-1)
+        self._slots.release()
+
+    def _olvidar_preparadas(self, raw):
+        with self._lock:
+            cache = self._preparadas.pop(raw, None)
+        for cursor in (cache or {}).values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _close_quietly(self, raw):
+        with self._lock:
+            self._preparadas.pop(raw, None)
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_config):
+    return tuple(sorted((k, str(v)) for k, v in db_config.items()))
+
+
+def get_pool(db_config, size=5, prepared_statements=0):
+    """
+    Retorna el pool compartido para db_config, creándolo la primera vez.
+
+    :param db_config: Diccionario de configuración de la base de datos.
+    :param size: Tamaño del pool (solo se usa al crearlo).
+    :param prepared_statements: Sentencias preparadas por conexión (solo se usa al crearlo).
+    :return: ConnectionPool.
+    """
+    key = _pool_key(db_config)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(dict(db_config), size=size, prepared_statements=prepared_statements)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """
+    Retorna los contadores de todos los pools del proceso, indexados por usuario@host:puerto/base de datos.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {
+        f"{p.db_config.get('user', '')}@{p.db_config.get('host', 'localhost')}:{p.db_config.get('port', 3306)}/{p.db_config.get('database', '')}": p.stats()
+        for p in pools
+    }
@@ -12,17 +12,20 @@ class DBSchemaAgent:
       - Datos de muestra (opcional)
     """
 
-    def __init__(self, get_connection, db_name, main_tables=None, include_sample_data=True):
+    def __init__(self, get_connection, db_name, main_tables=None, include_sample_data=True, bulk_introspection=False):
         """
         :param get_connection: Función que retorna una conexión a la base de datos.
         :param db_name: Nombre del esquema (base de datos) a utilizar.
         :param main_tables: Lista de nombres de tablas principales a procesar. Si se especifica, solo estas tablas se incluirán.
         :param include_sample_data: Si es True, extrae las 2 primeras filas de cada tabla.
+        :param bulk_introspection: Si es True, obtiene columnas y llaves foráneas de todas las tablas con
+                                   dos consultas en lugar de dos consultas por tabla.
         """
         self.get_connection = get_connection
         self.db_name = db_name
         self.main_tables = main_tables  # tabla_1 , tabla_2 correspondiente a la base de datos
         self.include_sample_data = include_sample_data
+        self.bulk_introspection = bulk_introspection
         self.cached_schema = None  # Cache para evitar múltiples lecturas
         self.logger = logging.getLogger(self.__class__.__name__)
 
@@ -68,25 +71,15 @@ class DBSchemaAgent:
             cursor.execute(query, params)
             tables = cursor.fetchall()
 
+            if self.bulk_introspection:
+                columns_by_table, relations_by_table = self._fetch_columns_and_relations_bulk(cursor)
+
             for (table_name,) in tables:
-                # Consultar las columnas de la tabla, ordenadas por posición.
-                cursor.execute("""
-                    SELECT column_name, data_type, column_key
-                    FROM information_schema.columns
-                    WHERE table_schema = %s AND table_name = %s
-                    ORDER BY ordinal_position;
-                """, (self.db_name, table_name))
-                columns_data = cursor.fetchall()
-
-                # Consultar las relaciones (llaves foráneas) de la tabla.
-                cursor.execute("""
-                    SELECT column_name, referenced_table_name, referenced_column_name
-                    FROM information_schema.key_column_usage
-                    WHERE table_schema = %s 
-                      AND table_name = %s
-                      AND referenced_table_name IS NOT NULL;
-                """, (self.db_name, table_name))
-                relations = cursor.fetchall()
+                if self.bulk_introspection:
+                    columns_data = columns_by_table.get(table_name, [])
+                    relations = relations_by_table.get(table_name, [])
+                else:
+                    columns_data, relations = self._fetch_columns_and_relations(cursor, table_name)
 
                 # Extraer las dos primeras filas de la tabla, si se ha habilitado esta opción.
                 sample_data = []
@@ -127,6 +120,115 @@ class DBSchemaAgent:
             cursor.close()
             conn.close()
 
+    def _fetch_columns_and_relations(self, cursor, table_name):
+        """
+        Obtiene las columnas y las llaves foráneas de una sola tabla (dos consultas por tabla).
+
+        :return: Tupla (columnas, relaciones) como listas de tuplas.
+        """
+        # Consultar las columnas de la tabla, ordenadas por posición.
+        cursor.execute("""
+            SELECT column_name, data_type, column_key
+            FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY ordinal_position;
+        """, (self.db_name, table_name))
+        columns_data = cursor.fetchall()
+
+        # Consultar las relaciones (llaves foráneas) de la tabla.
+        cursor.execute("""
+            SELECT column_name, referenced_table_name, referenced_column_name
+            FROM information_schema.key_column_usage
+            WHERE table_schema = %s 
+              AND table_name = %s
+              AND referenced_table_name IS NOT NULL;
+        """, (self.db_name, table_name))
+        relations = cursor.fetchall()
+
+        return columns_data, relations
+
+    def _fetch_columns_and_relations_bulk(self, cursor):
+        """
+        Obtiene las columnas y las llaves foráneas de todas las tablas del esquema con solo dos consultas
+        y las agrupa por tabla en Python.
+
+        :return: Tupla (columnas_por_tabla, relaciones_por_tabla) de diccionarios tabla -> lista de tuplas.
+        """
+        if self.main_tables:
+            placeholders = ','.join(['%s'] * len(self.main_tables))
+            table_filter = f" AND table_name IN ({placeholders})"
+            params = [self.db_name] + list(self.main_tables)
+        else:
+            table_filter = ""
+            params = [self.db_name]
+
+        cursor.execute(f"""
+            SELECT table_name, column_name, data_type, column_key
+            FROM information_schema.columns
+            WHERE table_schema = %s{table_filter}
+            ORDER BY table_name, ordinal_position;
+        """, params)
+        columns_by_table = {}
+        for table_name, column_name, data_type, column_key in cursor.fetchall():
+            columns_by_table.setdefault(table_name, []).append((column_name, data_type, column_key))
+
+        cursor.execute(f"""
+            SELECT table_name, column_name, referenced_table_name, referenced_column_name
+            FROM information_schema.key_column_usage
+            WHERE table_schema = %s{table_filter}
+              AND referenced_table_name IS NOT NULL;
+        """, params)
+        relations_by_table = {}
+        for table_name, column_name, referenced_table, referenced_column in cursor.fetchall():
+            relations_by_table.setdefault(table_name, []).append((column_name, referenced_table, referenced_column))
+
+        return columns_by_table, relations_by_table
+
+    def get_schema_fingerprint(self):
+        """
+        Calcula una huella barata del esquema para detectar cambios sin volver a extraerlo completo.
+        Combina el número de tablas y su fecha de creación (cambia con ALTER TABLE) con una suma de
+        comprobación de las columnas. Si se incluyen datos de muestra, también se considera UPDATE_TIME,
+        ya que en ese caso los cambios de datos sí alteran el esquema cacheado.
+
+        :return: Tupla comparable que identifica el estado actual del esquema.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        if self.main_tables:
+            placeholders = ','.join(['%s'] * len(self.main_tables))
+            table_filter = f" AND table_name IN ({placeholders})"
+            params = [self.db_name] + list(self.main_tables)
+        else:
+            table_filter = ""
+            params = [self.db_name]
+
+        try:
+            cursor.execute(f"""
+                SELECT COUNT(*), MAX(create_time), MAX(update_time)
+                FROM information_schema.tables
+                WHERE table_schema = %s{table_filter};
+            """, params)
+            table_count, max_create_time, max_update_time = cursor.fetchone()
+
+            cursor.execute(f"""
+                SELECT COUNT(*),
+                       SUM(CRC32(CONCAT_WS('|', table_name, column_name, data_type, column_key, ordinal_position)))
+                FROM information_schema.columns
+                WHERE table_schema = %s{table_filter};
+            """, params)
+            column_count, column_checksum = cursor.fetchone()
+
+            fingerprint = (table_count, str(max_create_time), column_count, str(column_checksum))
+            if self.include_sample_data:
+                fingerprint += (str(max_update_time),)
+            return fingerprint
+
+        finally:
+            cursor.close()
+            conn.close()
+
     def get_schema_text(self):
         """
         Retorna el esquema en un formato legible por humanos.
@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
 import time
-from app import process_query  # Importamos la función del backend
+from app import get_pipeline  # Pipeline compartido del backend
+from columnar_result import ColumnarResult
 from data_analyzer import DataAnalysisAgent
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -154,6 +155,54 @@ def is_chart_request(query):
     
     return False, None
 
+def resultado_truncado(resultados):
+    """
+    Indica si algún resultado se cortó por los topes de filas o bytes del ejecutor.
+    """
+    if isinstance(resultados, ColumnarResult):
+        return bool(resultados.get("truncated"))
+    if isinstance(resultados, list):
+        return any(isinstance(r, ColumnarResult) and r.get("truncated") for r in resultados)
+    return False
+
+def resultados_a_dataframes(resultados):
+    """
+    Retorna los DataFrames de un resultado o de una lista de resultados, omitiendo los vacíos.
+    Se usa el DataFrame que ColumnarResult ya tiene construido, sin volver a convertir las filas.
+    """
+    if isinstance(resultados, ColumnarResult):
+        resultados = [resultados]
+    if not isinstance(resultados, list):
+        return []
+    return [r.to_pandas() for r in resultados if isinstance(r, ColumnarResult) and r.num_rows]
+
+def pagina_siguiente(resultados):
+    """
+    Retorna la página siguiente de un listado (clave "pagina" del resultado), o None si no hay más filas.
+    """
+    if isinstance(resultados, ColumnarResult):
+        return resultados.get("pagina")
+    return None
+
+def mostrar_mas_resultados(content, idx):
+    """
+    Muestra las páginas ya pedidas de un listado y el botón "Más resultados", que trae la siguiente página
+    directamente del ejecutor (sin volver a interpretar la pregunta).
+    """
+    for df in resultados_a_dataframes(content.get("paginas", [])):
+        st.dataframe(df)
+    if content.get("pagina") and st.button("➕ Más resultados", key=f"mas_resultados_{idx}"):
+        with st.spinner("⏳ Buscando más resultados..."):
+            pagina = get_pipeline(db_config, openai_api_key).siguiente_pagina(content["pagina"])
+        if isinstance(pagina, ColumnarResult) and pagina.num_rows:
+            content.setdefault("paginas", []).append(pagina)
+            content["pagina"] = pagina_siguiente(pagina)
+        else:
+            content["pagina"] = None
+        st.rerun()
+
+AVISO_TRUNCADO = "⚠️ El resultado era demasiado grande; se muestran solo las primeras filas. Acota la consulta para ver el resto."
+
 # Sidebar: Configuración de la base de datos
 with st.sidebar:
     st.header("⚙️ Configuración de la Base de Datos")
@@ -163,6 +212,10 @@ with st.sidebar:
     db_password = st.text_input("Contraseña", type="password", key="db_password")
     db_host = st.text_input("Host", value="localhost", key="db_host")
     db_port = st.text_input("Puerto", value="3306", key="db_port")
+    respuesta_rapida = st.toggle(
+        "⚡ Respuesta rápida", key="respuesta_rapida",
+        help="Los conteos y resultados agrupados se responden con un resumen directo, sin esperar a GPT."
+    )
 
     if st.button("Actualizar Credenciales"):
         st.success("✅ Credenciales actualizadas.")
@@ -183,7 +236,7 @@ if "messages" not in st.session_state:
 # **Mostrar el historial de conversación**
 st.title("🤖 ChatBot SQL - Asistente de Base de Datos")
 
-for message in st.session_state.messages:
+for idx_mensaje, message in enumerate(st.session_state.messages):
     role = message["role"]
     content = message["content"]
 
@@ -194,8 +247,7 @@ for message in st.session_state.messages:
             if "sql_query" in content:
                 st.markdown("📝 **Consulta SQL generada:**")
                 st.code(content["sql_query"], language="sql")
-            if "data" in content and content["data"]:
-                df = pd.DataFrame(content["data"], columns=content.get("columns", []))
+            for df in resultados_a_dataframes(content.get("resultados")):
                 st.dataframe(df)
                 
                 # Si hay una solicitud de gráfico, mostrarlo
@@ -206,6 +258,9 @@ for message in st.session_state.messages:
                         st.line_chart(df)
                     elif content["chart_type"] == "area":
                         st.area_chart(df)
+            mostrar_mas_resultados(content, idx_mensaje)
+            if content.get("truncated"):
+                st.caption(AVISO_TRUNCADO)
                     
             if "analysis" in content:
                 st.markdown("📊 **Análisis Estadístico**")
@@ -238,16 +293,16 @@ if user_input:
         st.error("⚠️ Completa todas las credenciales en la barra lateral.")
     else:
         with st.spinner("⏳ Procesando tu consulta..."):
-            result = process_query(user_input, db_config, openai_api_key)
+            # La consulta se ejecuta aquí; el texto de la respuesta llega después, token a token
+            result = get_pipeline(db_config, openai_api_key).run_stream(user_input, rapido=respuesta_rapida)
 
         # Construir la respuesta del asistente
         assistant_response = {
             "sql_query": result["sql"],
-            "data": result["resultados"]["data"] if isinstance(result["resultados"], dict) and "data" in result["resultados"] else 
-                   [r.get("data", []) for r in result["resultados"]] if isinstance(result["resultados"], list) else [],
-            "columns": result["resultados"]["columns"] if isinstance(result["resultados"], dict) and "columns" in result["resultados"] else 
-                      [r.get("columns", []) for r in result["resultados"]] if isinstance(result["resultados"], list) else [],
-            "message": result["formatted_response"]
+            "resultados": result["resultados"],
+            "message": result["formatted_response"],
+            "truncated": resultado_truncado(result["resultados"]),
+            "pagina": pagina_siguiente(result["resultados"])
         }
         
         # Si es una solicitud de gráfico, agregar el tipo
@@ -260,7 +315,12 @@ if user_input:
         # Mostrar el mensaje del asistente en el chat
         st.session_state.messages.append({"role": "assistant", "content": assistant_response})
         with st.chat_message("assistant"):
-            st.markdown(result["formatted_response"])
+            st.write_stream(result["formatted_response_stream"])
+            # Al agotar el generador, formatted_response tiene el texto completo para el historial
+            assistant_response["message"] = result["formatted_response"]
+            if result.get("llm_usage"):
+                uso_total = result["llm_usage"]["total"]
+                st.caption(f"🔢 {uso_total['total_tokens']} tokens de LLM (≈ US$ {uso_total['cost_usd']:.4f})")
 
             if isinstance(assistant_response["sql_query"], list):
                 st.markdown("📝 **Consultas SQL generadas:**")
@@ -272,36 +332,25 @@ if user_input:
                 st.code(assistant_response["sql_query"], language="sql")
 
             # Determinar si tenemos múltiples consultas con resultados
-            has_multiple_results = isinstance(assistant_response["data"], list) and all(isinstance(i, list) for i in assistant_response["data"])
+            has_multiple_results = isinstance(assistant_response["resultados"], list)
             
-            if has_multiple_results:
-                for idx, (data, columns) in enumerate(zip(assistant_response["data"], assistant_response["columns"])):
-                    if data:  # Solo mostrar si hay datos
-                        st.markdown(f"### 📊 Resultado {idx + 1}")
-                        df = pd.DataFrame(data, columns=columns)
-                        st.dataframe(df)
-                        
-                        # Generar gráfico si se solicitó
-                        if is_chart:
-                            if chart_type == "bar":
-                                st.bar_chart(df)
-                            elif chart_type == "line":
-                                st.line_chart(df)
-                            elif chart_type == "area":
-                                st.area_chart(df)
-            else:
-                if assistant_response.get("data"):
-                    df = pd.DataFrame(assistant_response["data"], columns=assistant_response.get("columns", []))
-                    st.dataframe(df)
-                    
-                    # Generar gráfico si se solicitó
-                    if is_chart:
-                        if chart_type == "bar":
-                            st.bar_chart(df)
-                        elif chart_type == "line":
-                            st.line_chart(df)
-                        elif chart_type == "area":
-                            st.area_chart(df)
+            for idx, df in enumerate(resultados_a_dataframes(assistant_response["resultados"])):
+                if has_multiple_results:
+                    st.markdown(f"### 📊 Resultado {idx + 1}")
+                st.dataframe(df)
+                
+                # Generar gráfico si se solicitó
+                if is_chart:
+                    if chart_type == "bar":
+                        st.bar_chart(df)
+                    elif chart_type == "line":
+                        st.line_chart(df)
+                    elif chart_type == "area":
+                        st.area_chart(df)
+
+            mostrar_mas_resultados(assistant_response, len(st.session_state.messages) - 1)
+            if assistant_response.get("truncated"):
+                st.caption(AVISO_TRUNCADO)
 
             if assistant_response.get("analysis"):
                 st.markdown("📊 **Análisis Estadístico**")
@@ -0,0 +1,402 @@
+# index_advisor.py
+
+import collections
+import json
+import logging
+import re
+import threading
+import time
+import zlib
+
+from sql_compiler import parametrizar_sql, renderizar_sql
+from text_utils import clausulas_sql, condiciones_sql, dividir_sql, normalizar_expresion, profundidad_sql, separar_alias
+
+
+# Expresiones conocidas del esquema de detections y el nombre de su columna generada
+# (llaves normalizadas: minúsculas y sin espacios)
+COLUMNAS_GENERADAS = {
+    "left(object_id,length(object_id)-27)": "camera_id",
+}
+
+_FUNCIONES_ENTERAS = ("year", "month", "day", "dayofmonth", "hour", "minute", "weekday", "dayofweek", "floor")
+
+_COMPARACION_RE = re.compile(r"^(?P<lhs>.+?)\s*(?P<op><=>|<>|!=|>=|<=|=|>|<)\s*(?P<rhs>.+)$", re.DOTALL)
+_IDENTIFICADOR_RE = re.compile(r"^(?:`?\w+`?\.)?`?(\w+)`?$")
+
+
+def _termino(expresion, alias):
+    """
+    Convierte el lado izquierdo de un predicado o un elemento de GROUP BY en ("columna", nombre)
+    o ("expresion", texto). Retorna None para alias de la consulta y valores.
+    """
+    expresion = expresion.strip()
+    m = _IDENTIFICADOR_RE.match(expresion)
+    if m:
+        nombre = m.group(1)
+        if nombre.isdigit() or nombre.lower() in alias:
+            return None
+        return ("columna", nombre)
+    if "%s" in expresion or not re.search(r"\w\s*\(", expresion):
+        return None
+    return ("expresion", " ".join(expresion.replace("`", "").split()))
+
+
+def analizar_sql(sql):
+    """
+    Extrae de un SELECT sobre una sola tabla los términos que le sirven a un índice.
+
+    :return: Diccionario {"tabla", "igualdades", "rangos", "agrupar", "ordenar"} con listas de términos
+             ("columna", nombre) o ("expresion", texto), o None si la consulta no tiene esa forma (joins, etc.).
+    """
+    plantilla, _ = parametrizar_sql(sql)
+    texto = " ".join(re.sub(r"/\*.*?\*/", " ", plantilla, flags=re.DOTALL).replace(";", " ").split())
+    clausulas = clausulas_sql(texto)
+    origen = re.match(r"^`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?$", clausulas.get("from", ""), re.IGNORECASE)
+    if "select" not in clausulas or origen is None:
+        return None
+
+    # Elementos del SELECT (para resolver GROUP BY 1, 2) y sus alias
+    elementos, alias = [], set()
+    for elemento in dividir_sql(re.sub(r"^distinct\s+", "", clausulas["select"], flags=re.IGNORECASE), r","):
+        expresion, nombre = separar_alias(elemento)
+        elementos.append(expresion)
+        if nombre is not None:
+            alias.add(nombre.lower())
+
+    igualdades, rangos = [], []
+    for condicion in condiciones_sql(clausulas.get("where", "")):
+        if dividir_sql(condicion, r"\bor\b")[0] != condicion:
+            continue  # Las disyunciones no se resuelven con un índice compuesto
+        m = re.match(r"^(?P<lhs>.+?)\s+(?P<op>between|in|like|is)\b", condicion, re.IGNORECASE | re.DOTALL)
+        if m and profundidad_sql(condicion, m.start("op")) == 0:
+            lhs, op = m.group("lhs"), m.group("op").lower()
+            es_igualdad = op == "in" or (op == "is" and not re.search(r"\bis\s+not\b", condicion, re.IGNORECASE))
+            destino = igualdades if es_igualdad else rangos
+        else:
+            m = _COMPARACION_RE.match(condicion)
+            if m is None or m.group("op") in ("<>", "!="):
+                continue
+            lhs, op = m.group("lhs"), m.group("op")
+            if _termino(m.group("rhs"), alias) is not None:
+                continue  # Comparación entre columnas
+            destino = igualdades if op in ("=", "<=>") else rangos
+        termino = _termino(lhs, alias)
+        if termino is not None and termino not in destino:
+            destino.append(termino)
+
+    def resolver(lista):
+        terminos = []
+        for item in dividir_sql(lista, r","):
+            item = re.sub(r"\s+(asc|desc)$", "", item, flags=re.IGNORECASE).strip()
+            if item.isdigit() and 0 < int(item) <= len(elementos):
+                item = elementos[int(item) - 1]
+            termino = _termino(item, alias)
+            if termino is not None and termino not in terminos:
+                terminos.append(termino)
+        return terminos
+
+    return {
+        "tabla": origen.group(1),
+        "igualdades": igualdades,
+        "rangos": rangos,
+        "agrupar": resolver(clausulas.get("group by", "")),
+        "ordenar": resolver(clausulas.get("order by", "")),
+    }
+
+
+def _tipo_columna_generada(expresion):
+    funcion = re.match(r"^\s*(\w+)\s*\(", expresion)
+    funcion = funcion.group(1).lower() if funcion else ""
+    if funcion in _FUNCIONES_ENTERAS:
+        return "INT"
+    if funcion == "date":
+        return "DATE"
+    return "VARCHAR(255)"
+
+
+def _nombre_columna_generada(expresion):
+    normalizada = normalizar_expresion(expresion)
+    if normalizada in COLUMNAS_GENERADAS:
+        return COLUMNAS_GENERADAS[normalizada]
+    funcion = re.match(r"^(\w+)", normalizada)
+    return f"gc_{funcion.group(1) if funcion else 'expr'}_{zlib.crc32(normalizada.encode()):08x}"
+
+
+class WorkloadRecorder:
+    """
+    Registro del SQL ejecutado con sus tiempos, agregado por forma de consulta (la plantilla sin literales),
+    para que IndexAdvisor proponga índices según la carga real.
+
+    Opcionalmente agrega cada ejecución a un archivo JSON Lines, que luego se carga con WorkloadRecorder.cargar.
+    """
+
+    def __init__(self, max_formas=1000, path=None):
+        """
+        :param max_formas: Máximo de formas de consulta distintas (se descartan las usadas hace más tiempo).
+        :param path: Archivo JSON Lines donde se agrega cada ejecución (None para guardar solo en memoria).
+        """
+        self.max_formas = max_formas
+        self.path = path
+        self._formas = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def registrar(self, sql, params=None, segundos=0.0, filas=0):
+        """
+        Registra una ejecución. `sql` puede ser una plantilla con sus `params`.
+        """
+        if not isinstance(sql, str):
+            return
+        renderizado = renderizar_sql(sql, params)
+        forma, _ = parametrizar_sql(renderizado)
+        with self._lock:
+            entrada = self._formas.pop(forma, None) or {
+                "sql": forma, "ejemplo": renderizado, "veces": 0, "segundos": 0.0, "max_segundos": 0.0, "filas": 0,
+            }
+            entrada["veces"] += 1
+            entrada["segundos"] += segundos
+            entrada["max_segundos"] = max(entrada["max_segundos"], segundos)
+            entrada["filas"] += filas
+            self._formas[forma] = entrada
+            while len(self._formas) > self.max_formas:
+                self._formas.popitem(last=False)
+            if self.path:
+                self._agregar_archivo(renderizado, segundos, filas)
+
+    def resumen(self):
+        """
+        :return: Lista de formas {"sql", "ejemplo", "veces", "segundos", "max_segundos", "filas"},
+                 de mayor a menor tiempo total.
+        """
+        with self._lock:
+            formas = [dict(e) for e in self._formas.values()]
+        return sorted(formas, key=lambda e: e["segundos"], reverse=True)
+
+    @classmethod
+    def cargar(cls, path, max_formas=1000):
+        """
+        Construye un registro (solo en memoria) a partir de un archivo JSON Lines escrito con `path`.
+        """
+        registro = cls(max_formas=max_formas)
+        with open(path, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                try:
+                    datos = json.loads(linea)
+                except ValueError:
+                    continue
+                registro.registrar(datos["sql"], segundos=datos.get("seconds", 0.0), filas=datos.get("rows", 0))
+        return registro
+
+    def _agregar_archivo(self, sql, segundos, filas):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"sql": sql, "seconds": round(segundos, 6), "rows": filas, "ts": time.time()},
+                                   ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            self.logger.warning("No se pudo registrar la consulta en %s: %s", self.path, e)
+
+
+class IndexAdvisor:
+    """
+    Propone índices compuestos y columnas generadas para la carga registrada.
+
+    Para cada forma de consulta sobre una tabla, el índice candidato tiene primero las columnas comparadas
+    por igualdad, luego la primera columna de rango (o, sin rangos, las de GROUP BY / ORDER BY), hasta
+    `max_columnas`. Las expresiones filtradas o agrupadas (p. ej. la cámara, LEFT(object_id, ...)) no pueden
+    usar un índice: se propone una columna generada STORED con la misma expresión, que MySQL reconoce en
+    las consultas que la repiten, y el índice se arma sobre ella.
+
+    Los candidatos se ponderan por el tiempo total de las consultas que atienden; se descartan los que
+    son prefijo de otro candidato o de un índice existente.
+    """
+
+    def __init__(self, max_columnas=3, max_indices=5):
+        """
+        :param max_columnas: Máximo de columnas por índice.
+        :param max_indices: Máximo de índices propuestos por tabla.
+        """
+        self.max_columnas = max_columnas
+        self.max_indices = max_indices
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def recomendar(self, formas, indices_existentes=None, columnas=None):
+        """
+        :param formas: Resumen de WorkloadRecorder (lista de {"sql", "veces", "segundos"}).
+        :param indices_existentes: {tabla: {nombre_indice: [columnas]}} (ver indices_existentes).
+        :param columnas: {tabla: set(columnas)} para descartar alias y columnas inexistentes (opcional).
+        :return: Lista de recomendaciones {"tipo", "tabla", "nombre", "columnas"/"expresion", "ddl",
+                 "deshacer", "segundos", "consultas"}: primero las columnas generadas y luego los índices,
+                 de mayor a menor tiempo atendido.
+        """
+        indices_existentes = indices_existentes or {}
+        generadas = {}
+        candidatos = {}
+
+        for forma in formas:
+            analisis = analizar_sql(forma["sql"])
+            if analisis is None:
+                continue
+            tabla = analisis["tabla"]
+            existentes = {c.lower() for c in (columnas or {}).get(tabla, ())}
+
+            def nombre(termino):
+                tipo, valor = termino
+                if tipo == "columna":
+                    return valor if not existentes or valor.lower() in existentes else None
+                llave = (tabla, normalizar_expresion(valor))
+                generada = generadas.setdefault(llave, {
+                    "tabla": tabla, "nombre": _nombre_columna_generada(valor), "expresion": valor,
+                    "segundos": 0.0, "consultas": 0,
+                })
+                generada["segundos"] += forma["segundos"]
+                generada["consultas"] += forma["veces"]
+                return generada["nombre"]
+
+            def nombres(terminos):
+                resultado = []
+                for termino in terminos:
+                    n = nombre(termino)
+                    if n is not None and n not in resultado:
+                        resultado.append(n)
+                return resultado
+
+            columnas_indice = nombres(analisis["igualdades"])
+            rangos = [c for c in nombres(analisis["rangos"]) if c not in columnas_indice]
+            if rangos:
+                columnas_indice.append(rangos[0])
+            else:
+                siguientes = nombres(analisis["agrupar"]) or nombres(analisis["ordenar"])
+                columnas_indice += [c for c in siguientes if c not in columnas_indice]
+            columnas_indice = tuple(columnas_indice[: self.max_columnas])
+            if not columnas_indice:
+                continue
+            candidato = candidatos.setdefault((tabla, columnas_indice), {"segundos": 0.0, "consultas": 0, "ejemplos": []})
+            candidato["segundos"] += forma["segundos"]
+            candidato["consultas"] += forma["veces"]
+            if len(candidato["ejemplos"]) < 3:
+                candidato["ejemplos"].append(forma.get("ejemplo", forma["sql"]))
+
+        indices = self._depurar(candidatos, indices_existentes)
+        usadas = {(tabla, c) for (tabla, cols) in indices for c in cols}
+        recomendaciones = [
+            self._columna_generada(g) for (tabla, _), g in sorted(generadas.items(), key=lambda x: -x[1]["segundos"])
+            if (tabla, g["nombre"]) in usadas and g["nombre"].lower() not in {
+                c.lower() for c in (columnas or {}).get(tabla, ())
+            }
+        ]
+        recomendaciones += [self._indice(tabla, cols, datos) for (tabla, cols), datos in indices.items()]
+        return recomendaciones
+
+    def _depurar(self, candidatos, indices_existentes):
+        # Un candidato que es prefijo de otro queda cubierto por este (se le suma su tiempo)
+        ordenados = sorted(candidatos.items(), key=lambda x: -len(x[0][1]))
+        elegidos = {}
+        for (tabla, cols), datos in ordenados:
+            cubridor = next((k for k in elegidos if k[0] == tabla and k[1][:len(cols)] == cols), None)
+            if cubridor is not None:
+                elegidos[cubridor]["segundos"] += datos["segundos"]
+                elegidos[cubridor]["consultas"] += datos["consultas"]
+                continue
+            existentes = indices_existentes.get(tabla, {}).values()
+            if any([c.lower() for c in e[:len(cols)]] == [c.lower() for c in cols] for e in existentes):
+                continue
+            elegidos[(tabla, cols)] = dict(datos)
+
+        por_tabla = collections.defaultdict(list)
+        for llave, datos in sorted(elegidos.items(), key=lambda x: -x[1]["segundos"]):
+            por_tabla[llave[0]].append((llave, datos))
+        return {llave: datos for lista in por_tabla.values() for llave, datos in lista[: self.max_indices]}
+
+    def _columna_generada(self, generada):
+        tabla, nombre, expresion = generada["tabla"], generada["nombre"], generada["expresion"]
+        return {
+            "tipo": "columna_generada",
+            "tabla": tabla,
+            "nombre": nombre,
+            "expresion": expresion,
+            "ddl": f"ALTER TABLE `{tabla}` ADD COLUMN `{nombre}` {_tipo_columna_generada(expresion)} "
+                   f"AS ({expresion}) STORED",
+            "deshacer": f"ALTER TABLE `{tabla}` DROP COLUMN `{nombre}`",
+            "segundos": round(generada["segundos"], 6),
+            "consultas": generada["consultas"],
+        }
+
+    def _indice(self, tabla, columnas, datos):
+        nombre = f"idx_{tabla}_{'_'.join(columnas)}"[:64]
+        return {
+            "tipo": "indice",
+            "tabla": tabla,
+            "nombre": nombre,
+            "columnas": list(columnas),
+            "ddl": f"ALTER TABLE `{tabla}` ADD INDEX `{nombre}` ({', '.join(f'`{c}`' for c in columnas)})",
+            "deshacer": f"ALTER TABLE `{tabla}` DROP INDEX `{nombre}`",
+            "segundos": round(datos["segundos"], 6),
+            "consultas": datos["consultas"],
+            "ejemplos": datos["ejemplos"],
+        }
+
+
+def indices_existentes(conn, tablas):
+    """
+    Lee los índices de las tablas con SHOW INDEX.
+
+    :return: {tabla: {nombre_indice: [columnas en orden]}} (las partes funcionales se omiten).
+    """
+    resultado = {}
+    cursor = conn.cursor()
+    try:
+        for tabla in tablas:
+            cursor.execute(f"SHOW INDEX FROM `{tabla}`")
+            columnas = [d[0].lower() for d in cursor.description]
+            partes = collections.defaultdict(list)
+            for fila in cursor.fetchall():
+                fila = dict(zip(columnas, fila))
+                if fila.get("column_name"):
+                    partes[fila["key_name"]].append((int(fila["seq_in_index"]), fila["column_name"]))
+            resultado[tabla] = {nombre: [c for _, c in sorted(cols)] for nombre, cols in partes.items()}
+    finally:
+        cursor.close()
+    return resultado
+
+
+def columnas_tabla(conn, tablas):
+    """
+    :return: {tabla: set(columnas)} leído con SHOW COLUMNS.
+    """
+    resultado = {}
+    cursor = conn.cursor()
+    try:
+        for tabla in tablas:
+            cursor.execute(f"SHOW COLUMNS FROM `{tabla}`")
+            resultado[tabla] = {fila[0] for fila in cursor.fetchall()}
+    finally:
+        cursor.close()
+    return resultado
+
+
+def aplicar(conn, recomendaciones, deshacer=False):
+    """
+    Ejecuta el DDL de las recomendaciones (o su reversión, en orden inverso, con deshacer=True).
+    Agregar una columna STORED reescribe la tabla: conviene hacerlo en una réplica o en una ventana de mantención.
+
+    :return: Lista de tuplas (ddl, error) con error None si la sentencia se aplicó.
+    """
+    resultados = []
+    logger = logging.getLogger("IndexAdvisor")
+    sentencias = [r["deshacer"] for r in reversed(recomendaciones)] if deshacer else [r["ddl"] for r in recomendaciones]
+    cursor = conn.cursor()
+    try:
+        for ddl in sentencias:
+            inicio = time.perf_counter()
+            try:
+                cursor.execute(ddl)
+                logger.info("Aplicado en %.1f s: %s", time.perf_counter() - inicio, ddl)
+                resultados.append((ddl, None))
+            except Exception as e:
+                logger.warning("No se pudo aplicar '%s': %s", ddl, e)
+                resultados.append((ddl, str(e)))
+    finally:
+        cursor.close()
+    return resultados
@@ -0,0 +1,245 @@
+# intent_templates.py
+
+import logging
+import re
+import threading
+
+from text_utils import normalizar_pregunta
+
+
+# Colores en español (sin tildes, singular) -> valor guardado en detections.description
+COLORES = {
+    "rojo": "red", "roja": "red",
+    "azul": "blue",
+    "blanco": "white", "blanca": "white",
+    "negro": "black", "negra": "black",
+    "gris": "gray",
+    "verde": "green",
+    "amarillo": "yellow", "amarilla": "yellow",
+    "plateado": "silver", "plateada": "silver",
+    "cafe": "brown", "marron": "brown",
+    "naranjo": "orange", "naranja": "orange",
+}
+
+_VEHICULOS = r"(?:vehiculos?|autos?|carros?|coches?|detecciones|deteccion)"
+_FECHA = r"(?:\b(?:de |del |el |en )?(?P<fecha>hoy|ayer|\d{1,2}[/-]\d{1,2}[/-]\d{4}))?"
+_PATRON_COLOR = "|".join(sorted(COLORES, key=len, reverse=True))
+
+
+class IntentTemplate:
+    """
+    Plantilla de intención: expresiones regulares sobre la pregunta normalizada (minúsculas, sin tildes)
+    y una función que, a partir de la coincidencia, construye la estructura de consulta y el SQL parametrizado.
+    """
+
+    def __init__(self, nombre, patrones, construir, tabla="detections", descripcion=""):
+        """
+        :param nombre: Identificador de la plantilla (se usa en las métricas).
+        :param patrones: Lista de expresiones regulares; basta con que una coincida con la pregunta normalizada.
+        :param construir: Función (match, rango_fecha) -> (estructura, plantilla_sql, params). rango_fecha es
+                          (inicio_ms, fin_ms) si la pregunta nombra un día, o None.
+        :param tabla: Tabla que debe existir en el esquema para usar la plantilla.
+        :param descripcion: Texto breve de la familia de preguntas que cubre.
+        """
+        self.nombre = nombre
+        self.patrones = [re.compile(p) for p in patrones]
+        self.construir = construir
+        self.tabla = tabla
+        self.descripcion = descripcion
+
+
+def _filtro_fecha(rango, condiciones, params, filtros):
+    if rango is not None:
+        condiciones.append("init_time BETWEEN %s AND %s")
+        params.extend(rango)
+        filtros["init_time"] = {">=": rango[0], "<=": rango[1]}
+
+
+def _colores_por_dia(match, rango):
+    condiciones, params, filtros = ["attribute_id = 2"], [], {"attribute_id": 2}
+    _filtro_fecha(rango, condiciones, params, filtros)
+    sql = (
+        "SELECT description, COUNT(*) AS cantidad_detecciones FROM detections "
+        f"WHERE {' AND '.join(condiciones)} GROUP BY description ORDER BY cantidad_detecciones DESC"
+    )
+    return {"accion": "contar", "tabla": "detections", "filtros": filtros, "agrupar_por": "description"}, sql, params
+
+
+def _vehiculos_de_un_color(match, rango):
+    color = COLORES[match.group("color")]
+    condiciones, params, filtros = ["attribute_id = 2", "description = %s"], [color], {"attribute_id": 2, "description": color}
+    _filtro_fecha(rango, condiciones, params, filtros)
+    sql = f"SELECT COUNT(*) AS total FROM detections WHERE {' AND '.join(condiciones)}"
+    return {"accion": "contar", "tabla": "detections", "filtros": filtros}, sql, params
+
+
+def _detecciones_por_camara(match, rango):
+    condiciones, params, filtros = [], [], {}
+    _filtro_fecha(rango, condiciones, params, filtros)
+    where = f"WHERE {' AND '.join(condiciones)} " if condiciones else ""
+    sql = (
+        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, attribute_id, COUNT(attribute_id) AS cantidad "
+        f"FROM detections {where}GROUP BY 1, 2"
+    )
+    return {"accion": "contar", "tabla": "detections", "filtros": filtros, "agrupar_por": "camara"}, sql, params
+
+
+def _placas_por_patron(match, rango):
+    # El patrón solo admite letras y números, por lo que no trae comodines de LIKE
+    texto = match.group("patron").upper()
+    modo = match.group("modo")
+    if modo.startswith(("empie", "comien", "inici")):
+        like = f"{texto}%"
+    elif modo.startswith("termin"):
+        like = f"%{texto}"
+    else:
+        like = f"%{texto}%"
+    condiciones, params, filtros = ["attribute_id = 1", "description LIKE %s"], [like], {"attribute_id": 1, "description": {"LIKE": like}}
+    _filtro_fecha(rango, condiciones, params, filtros)
+    where = " AND ".join(condiciones)
+    if match.group("cuantas"):
+        return {"accion": "contar", "tabla": "detections", "filtros": filtros}, f"SELECT COUNT(*) AS total FROM detections WHERE {where}", params
+    sql = f"SELECT description AS placa, init_time FROM detections WHERE {where} ORDER BY init_time DESC LIMIT 25"
+    return {"accion": "listar", "tabla": "detections", "filtros": filtros}, sql, params
+
+
+PLANTILLAS_POR_DEFECTO = [
+    IntentTemplate(
+        "colores_por_dia",
+        [
+            rf"^(?:cuantos |cuantas |muestra |dame )?(?:(?:los |las )?{_VEHICULOS} )?(?:por|segun|de cada) colou?r(?:es)?\s*{_FECHA}\s*$",
+            rf"^(?:que |cuales )?colores (?:se )?(?:detectaron|hay|aparecen|se vieron)\s*{_FECHA}\s*$",
+        ],
+        _colores_por_dia,
+        descripcion="Detecciones agrupadas por color, opcionalmente de un día.",
+    ),
+    IntentTemplate(
+        "vehiculos_de_un_color",
+        [
+            rf"^cuant[oa]s {_VEHICULOS} (?:de color )?(?P<color>{_PATRON_COLOR})(?:e?s)? (?:se )?(?:detectaron|hay|hubo|pasaron)\s*{_FECHA}\s*$",
+            rf"^cuant[oa]s {_VEHICULOS} (?:de color )?(?P<color>{_PATRON_COLOR})(?:e?s)?\s*{_FECHA}\s*$",
+        ],
+        _vehiculos_de_un_color,
+        descripcion="Cantidad de vehículos de un color, opcionalmente de un día.",
+    ),
+    IntentTemplate(
+        "detecciones_por_camara",
+        [rf"^(?:cuantas |cantidad de |numero de |muestra (?:las )?)?{_VEHICULOS} (?:por|de cada) camaras?\s*{_FECHA}\s*$"],
+        _detecciones_por_camara,
+        descripcion="Cantidad de detecciones por cámara, opcionalmente de un día.",
+    ),
+    IntentTemplate(
+        "placas_por_patron",
+        [
+            r"^(?P<cuantas>cuant[oa]s )?(?:muestra |lista |busca |dame )?(?:las |los )?(?:placas|patentes|vehiculos con placas?) "
+            r"(?:que |cuya placa )?(?:se detectaron |hay )?(?P<modo>empiecen|empiezan|comiencen|comienzan|inicien|terminen|terminan|contengan|contienen|tengan|tienen)"
+            r" (?:con |en |por )?(?P<patron>[a-z0-9]{1,8})\s*" + _FECHA + r"\s*$"
+        ],
+        _placas_por_patron,
+        descripcion="Placas que empiezan, terminan o contienen un texto (conteo o listado).",
+    ),
+]
+
+
+class IntentRegistry:
+    """
+    Registro de plantillas de intención que se revisan antes de llamar al LLM.
+
+    Si la pregunta coincide con una plantilla, la estructura y el SQL se construyen localmente y la
+    consulta va directo a ejecución. Lleva métricas por plantilla y estima la latencia de LLM evitada
+    usando la latencia media medida de las preguntas que sí pasan por el LLM.
+    """
+
+    def __init__(self, templates=None, parse_date_reference=None):
+        """
+        :param templates: Lista de IntentTemplate (por defecto, PLANTILLAS_POR_DEFECTO).
+        :param parse_date_reference: Función que convierte 'hoy', 'ayer' o 'dd-mm-aaaa' en (inicio_ms, fin_ms).
+        """
+        self.templates = list(PLANTILLAS_POR_DEFECTO if templates is None else templates)
+        self.parse_date_reference = parse_date_reference
+        self._lock = threading.Lock()
+        self._consultas = 0
+        self._aciertos = {t.nombre: 0 for t in self.templates}
+        self._llm_ms_total = 0.0
+        self._llm_muestras = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def registrar(self, template):
+        """
+        Agrega una plantilla al registro (se revisa después de las existentes).
+        """
+        with self._lock:
+            self.templates.append(template)
+            self._aciertos.setdefault(template.nombre, 0)
+
+    def resolver(self, pregunta, schema=None):
+        """
+        Busca una plantilla que coincida con la pregunta.
+
+        :param pregunta: Pregunta del usuario.
+        :param schema: Esquema (opcional) para descartar plantillas cuya tabla no existe.
+        :return: Tupla (nombre, estructura, plantilla_sql, params), o None si ninguna coincide.
+        """
+        texto = normalizar_pregunta(pregunta)
+        with self._lock:
+            self._consultas += 1
+            templates = list(self.templates)
+
+        for template in templates:
+            if schema is not None and template.tabla not in schema:
+                continue
+            match = next((m for m in (p.search(texto) for p in template.patrones) if m), None)
+            if not match:
+                continue
+            try:
+                rango = self._rango(match)
+                estructura, sql, params = template.construir(match, rango)
+            except Exception as e:
+                self.logger.warning("La plantilla '%s' no pudo construir la consulta: %s", template.nombre, e)
+                continue
+            with self._lock:
+                self._aciertos[template.nombre] += 1
+            self.logger.info("Pregunta resuelta con la plantilla '%s' (sin LLM).", template.nombre)
+            return template.nombre, estructura, sql, tuple(params)
+        return None
+
+    def registrar_latencia_llm(self, segundos):
+        """
+        Registra la latencia de interpretación con LLM de una pregunta que no coincidió con ninguna plantilla.
+        """
+        with self._lock:
+            self._llm_ms_total += segundos * 1000
+            self._llm_muestras += 1
+
+    def stats(self):
+        """
+        Retorna las métricas por plantilla: aciertos, tasa de aciertos sobre todas las preguntas y
+        milisegundos de LLM evitados (estimados con la latencia media medida).
+        """
+        with self._lock:
+            consultas = self._consultas
+            aciertos = dict(self._aciertos)
+            llm_ms_medio = self._llm_ms_total / self._llm_muestras if self._llm_muestras else 0.0
+        total = sum(aciertos.values())
+        return {
+            "questions": consultas,
+            "hits": total,
+            "hit_rate": round(total / consultas, 4) if consultas else 0.0,
+            "avg_llm_ms": round(llm_ms_medio, 1),
+            "llm_ms_avoided": round(total * llm_ms_medio, 1),
+            "templates": {
+                nombre: {
+                    "hits": n,
+                    "hit_rate": round(n / consultas, 4) if consultas else 0.0,
+                    "llm_ms_avoided": round(n * llm_ms_medio, 1),
+                }
+                for nombre, n in aciertos.items()
+            },
+        }
+
+    def _rango(self, match):
+        fecha = match.groupdict().get("fecha")
+        if not fecha or self.parse_date_reference is None:
+            return None
+        return self.parse_date_reference(fecha)
+
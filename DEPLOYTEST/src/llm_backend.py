@@ -0,0 +1,302 @@
+# llm_backend.py
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import openai
+
+from llm_cache import LLMCache
+
+
+class FixtureNotFound(Exception):
+    """
+    El modo replay no tiene una respuesta grabada para la llamada.
+    """
+
+
+def _params_de_llave(kwargs):
+    # La clave de API y el plazo no cambian la respuesta
+    return {k: v for k, v in kwargs.items() if k not in ("model", "messages", "api_key", "request_timeout")}
+
+
+def llave_exacta(kwargs):
+    """
+    Llave de una llamada: modelo, mensajes (con espacios normalizados) y parámetros.
+    """
+    return LLMCache.make_key(kwargs.get("model"), kwargs.get("messages", []), **_params_de_llave(kwargs))
+
+
+def llave_aproximada(kwargs):
+    """
+    Llave sin los dígitos de los mensajes, para reutilizar grabaciones cuyos prompts solo difieren
+    en fechas o marcas de tiempo (p. ej. los rangos de 'hoy' en milisegundos).
+    """
+    mensajes = [
+        {**m, "content": re.sub(r"\d+", "0", m["content"])} if isinstance(m.get("content"), str) else m
+        for m in kwargs.get("messages", [])
+    ]
+    return LLMCache.make_key(kwargs.get("model"), mensajes, **_params_de_llave(kwargs))
+
+
+class OpenAIBackend:
+    """
+    Backend en vivo: llama a la API de OpenAI.
+    """
+
+    nombre = "live"
+    cacheable = True
+
+    def create(self, **kwargs):
+        return openai.ChatCompletion.create(**kwargs)
+
+    async def acreate(self, **kwargs):
+        return await openai.ChatCompletion.acreate(**kwargs)
+
+
+class RecordingBackend:
+    """
+    Backend de grabación: delega en otro backend (por defecto, OpenAI en vivo) y agrega cada par
+    solicitud/respuesta, con su latencia, al archivo de fixtures (JSON Lines).
+
+    Las respuestas en streaming se graban como la lista de fragmentos, al terminar de consumirse.
+    """
+
+    nombre = "record"
+    # La caché persistente se salta para que cada llamada quede grabada
+    cacheable = False
+
+    def __init__(self, path, inner=None):
+        """
+        :param path: Archivo de fixtures; se crea si no existe y las grabaciones se agregan al final.
+        :param inner: Backend que responde de verdad (por defecto, OpenAIBackend).
+        """
+        self.path = path
+        self.inner = inner or OpenAIBackend()
+        self.grabadas = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def create(self, **kwargs):
+        inicio = time.perf_counter()
+        response = self.inner.create(**kwargs)
+        if kwargs.get("stream"):
+            return self._grabar_stream(kwargs, response, inicio)
+        self._grabar(kwargs, {"response": response, "latency": time.perf_counter() - inicio})
+        return response
+
+    async def acreate(self, **kwargs):
+        inicio = time.perf_counter()
+        response = await self.inner.acreate(**kwargs)
+        self._grabar(kwargs, {"response": response, "latency": time.perf_counter() - inicio})
+        return response
+
+    def _grabar_stream(self, kwargs, response, inicio):
+        chunks = []
+        primera = None
+        for chunk in response:
+            if primera is None:
+                primera = time.perf_counter() - inicio
+            chunks.append(chunk)
+            yield chunk
+        self._grabar(kwargs, {
+            "chunks": chunks,
+            "latency": primera if primera is not None else time.perf_counter() - inicio,
+            "duration": time.perf_counter() - inicio,
+        })
+
+    def _grabar(self, kwargs, datos):
+        registro = {
+            "key": llave_exacta(kwargs),
+            "fuzzy_key": llave_aproximada(kwargs),
+            "request": {"model": kwargs.get("model"), "messages": kwargs.get("messages"), "params": _params_de_llave(kwargs)},
+            "recorded_at": time.time(),
+            **datos,
+        }
+        try:
+            linea = json.dumps(registro, ensure_ascii=False, default=str)
+            with self._lock:
+                directorio = os.path.dirname(self.path)
+                if directorio:
+                    os.makedirs(directorio, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+                self.grabadas += 1
+        except Exception as e:
+            self.logger.warning("No se pudo grabar la llamada al LLM: %s", e)
+
+
+class LatencyModel:
+    """
+    Latencia simulada del modo replay.
+
+    - "none": sin espera.
+    - "recorded": la latencia medida al grabar (multiplicada por `escala`).
+    - "<segundos>": latencia constante, p. ej. "0.8".
+    - "lognormal:<mediana>,<sigma>": latencia log-normal con esa mediana en segundos, p. ej. "lognormal:0.9,0.4".
+    """
+
+    def __init__(self, especificacion="none", escala=1.0, seed=None):
+        """
+        :param especificacion: Modelo de latencia (ver la descripción de la clase).
+        :param escala: Factor aplicado a la latencia resultante.
+        :param seed: Semilla del generador, para repetir exactamente la misma secuencia de latencias.
+        """
+        self.especificacion = str(especificacion or "none").strip().lower()
+        self.escala = escala
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if self.especificacion.startswith("lognormal:"):
+            mediana, sigma = (float(v) for v in self.especificacion.split(":", 1)[1].split(","))
+            self._lognormal = (mediana, sigma)
+        elif self.especificacion not in ("none", "recorded"):
+            self._constante = float(self.especificacion)
+
+    def muestrear(self, grabada=None):
+        """
+        :param grabada: Latencia registrada en la fixture (segundos), para el modo "recorded".
+        :return: Segundos a esperar.
+        """
+        if self.especificacion == "none":
+            return 0.0
+        if self.especificacion == "recorded":
+            segundos = grabada or 0.0
+        elif self.especificacion.startswith("lognormal:"):
+            mediana, sigma = self._lognormal
+            with self._lock:
+                segundos = self._random.lognormvariate(0.0, sigma) * mediana
+        else:
+            segundos = self._constante
+        return max(0.0, segundos * self.escala)
+
+
+class ReplayBackend:
+    """
+    Backend de reproducción: responde con las llamadas grabadas, sin red, con latencia simulada opcional.
+
+    Busca primero por la llave exacta y, si no hay, por la llave sin dígitos (prompts que solo difieren
+    en fechas). Si una misma llamada se grabó varias veces, las respuestas se entregan en rotación.
+    """
+
+    nombre = "replay"
+    cacheable = False
+
+    def __init__(self, path, latency=None, strict=True):
+        """
+        :param path: Archivo de fixtures grabado con RecordingBackend.
+        :param latency: LatencyModel (por defecto, sin espera).
+        :param strict: Si es True, una llamada sin grabación lanza FixtureNotFound (cada agente usa
+                       entonces su respaldo); si es False, responde un contenido vacío "{}".
+        """
+        self.path = path
+        self.latency = latency or LatencyModel()
+        self.strict = strict
+        self._exactas = collections.defaultdict(list)
+        self._aproximadas = collections.defaultdict(list)
+        self._turnos = collections.Counter()
+        self._lock = threading.Lock()
+        self.stats = {"exact": 0, "fuzzy": 0, "missing": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._cargar()
+
+    def create(self, **kwargs):
+        registro = self._buscar(kwargs)
+        espera = self.latency.muestrear(registro.get("latency"))
+        if kwargs.get("stream"):
+            return self._reproducir_stream(registro, espera)
+        time.sleep(espera)
+        return registro["response"]
+
+    async def acreate(self, **kwargs):
+        registro = self._buscar(kwargs)
+        await asyncio.sleep(self.latency.muestrear(registro.get("latency")))
+        if "response" not in registro:
+            return _respuesta_de_chunks(registro["chunks"])
+        return registro["response"]
+
+    def _reproducir_stream(self, registro, espera):
+        chunks = registro.get("chunks")
+        if chunks is None:
+            chunks = _chunks_de_respuesta(registro["response"])
+        time.sleep(espera)
+        # El resto de la duración grabada se reparte entre los fragmentos (solo con latencia "recorded")
+        intervalo = 0.0
+        if self.latency.especificacion == "recorded" and registro.get("duration") and len(chunks) > 1:
+            intervalo = max(0.0, registro["duration"] - registro.get("latency", 0.0)) * self.latency.escala / (len(chunks) - 1)
+        for idx, chunk in enumerate(chunks):
+            if idx and intervalo:
+                time.sleep(intervalo)
+            yield chunk
+
+    def _buscar(self, kwargs):
+        with self._lock:
+            for indice, llave, contador in (
+                (self._exactas, llave_exacta(kwargs), "exact"),
+                (self._aproximadas, llave_aproximada(kwargs), "fuzzy"),
+            ):
+                registros = indice.get(llave)
+                if registros:
+                    self.stats[contador] += 1
+                    turno = self._turnos[(contador, llave)]
+                    self._turnos[(contador, llave)] += 1
+                    return registros[turno % len(registros)]
+            self.stats["missing"] += 1
+        if self.strict:
+            raise FixtureNotFound("No hay una respuesta grabada para esta llamada al LLM.")
+        self.logger.warning("Llamada al LLM sin grabación; se responde un contenido vacío.")
+        return {"response": {"choices": [{"message": {"role": "assistant", "content": "{}"}, "finish_reason": "stop"}]}}
+
+    def _cargar(self):
+        if not os.path.exists(self.path):
+            self.logger.warning("El archivo de fixtures %s no existe; todas las llamadas quedarán sin grabación.", self.path)
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for numero, linea in enumerate(f, 1):
+                if not linea.strip():
+                    continue
+                try:
+                    registro = json.loads(linea)
+                except ValueError as e:
+                    self.logger.warning("Línea %d de %s inválida: %s", numero, self.path, e)
+                    continue
+                self._exactas[registro["key"]].append(registro)
+                self._aproximadas[registro.get("fuzzy_key", registro["key"])].append(registro)
+        self.logger.info("Fixtures de LLM cargadas: %d llamadas distintas.", len(self._exactas))
+
+
+def _chunks_de_respuesta(response):
+    contenido = response["choices"][0]["message"]["content"]
+    chunks = [{"choices": [{"delta": {"content": contenido[i:i + 16]}, "finish_reason": None}]} for i in range(0, len(contenido), 16)]
+    chunks.append({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+    return chunks
+
+
+def _respuesta_de_chunks(chunks):
+    contenido = "".join(c["choices"][0].get("delta", {}).get("content") or "" for c in chunks)
+    return {"choices": [{"message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}]}
+
+
+def backend_desde_entorno():
+    """
+    Construye el backend según las variables de entorno:
+
+    - LLM_BACKEND: "live" (por defecto), "record" o "replay".
+    - LLM_FIXTURES: archivo de fixtures (por defecto, llm_fixtures.jsonl en el directorio actual).
+    - LLM_REPLAY_LATENCY: modelo de latencia del replay (ver LatencyModel), p. ej. "recorded" o "lognormal:0.9,0.4".
+    - LLM_REPLAY_SEED: semilla de la latencia simulada.
+    """
+    modo = os.getenv("LLM_BACKEND", "live").strip().lower()
+    path = os.getenv("LLM_FIXTURES", "llm_fixtures.jsonl")
+    if modo == "record":
+        return RecordingBackend(path)
+    if modo == "replay":
+        seed = os.getenv("LLM_REPLAY_SEED")
+        latency = LatencyModel(os.getenv("LLM_REPLAY_LATENCY", "none"), seed=int(seed) if seed else None)
+        return ReplayBackend(path, latency=latency)
+    return OpenAIBackend()
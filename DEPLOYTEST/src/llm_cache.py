@@ -0,0 +1,177 @@
+# llm_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "deploytest", "llm_cache.sqlite")
+
+
+def _normalizar_mensajes(messages):
+    # Consultas casi idénticas (espacios o saltos de línea de más) comparten la misma entrada
+    return [
+        {**m, "content": " ".join(m["content"].split())} if isinstance(m.get("content"), str) else m
+        for m in messages
+    ]
+
+
+class LLMCache:
+    """
+    Caché persistente (archivo sqlite) de respuestas de OpenAI para llamadas deterministas (temperature=0).
+
+    - La llave es un hash SHA-256 del modelo, los mensajes y los demás parámetros de la llamada.
+    - Cada entrada vence tras `ttl` segundos.
+    - El tamaño del archivo se acota a `max_bytes` expulsando las entradas usadas hace más tiempo (LRU).
+    - Se desactiva con enabled=False o con la variable de entorno LLM_CACHE_DISABLED=1.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_bytes=64 * 1024 * 1024, enabled=None):
+        """
+        :param path: Ruta del archivo sqlite (por defecto, LLM_CACHE_PATH o ~/.cache/deploytest/llm_cache.sqlite).
+        :param ttl: Segundos de vida de cada respuesta.
+        :param max_bytes: Tamaño máximo aproximado de las respuestas guardadas.
+        :param enabled: Activa o desactiva la caché (por defecto, según LLM_CACHE_DISABLED).
+        """
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_PATH)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if enabled is None:
+            enabled = os.getenv("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        """
+        Construye la llave de una llamada a partir del modelo, los mensajes y los parámetros.
+        """
+        payload = json.dumps(
+            {"model": model, "messages": _normalizar_mensajes(messages), "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def es_cacheable(self, kwargs):
+        """
+        Indica si una llamada (los argumentos de ChatCompletion.create) puede responderse desde la caché:
+        la caché está activa y la llamada es determinista (temperature=0) y sin streaming.
+        """
+        return self.enabled and kwargs.get("temperature", 1) == 0 and not kwargs.get("stream")
+
+    def llave(self, kwargs):
+        """
+        Llave de una llamada a partir de los argumentos de ChatCompletion.create (sin la clave ni el plazo).
+        """
+        params = {k: v for k, v in kwargs.items() if k not in ("model", "messages", "api_key", "request_timeout")}
+        return self.make_key(kwargs.get("model"), kwargs.get("messages", []), **params)
+
+    def get(self, key):
+        """
+        Retorna la respuesta guardada para la llave (diccionario), o None si no existe o venció.
+        """
+        try:
+            with self._lock:
+                conn = self._conectar()
+                fila = conn.execute("SELECT response, created FROM entries WHERE key = ?", (key,)).fetchone()
+                if fila is None:
+                    self.stats["misses"] += 1
+                    return None
+                if time.time() - fila[1] >= self.ttl:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    conn.commit()
+                    self.stats["expirations"] += 1
+                    self.stats["misses"] += 1
+                    return None
+                conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                self.stats["hits"] += 1
+            return json.loads(fila[0])
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.logger.warning("No se pudo leer la caché de LLM: %s", e)
+            return None
+
+    def put(self, key, response):
+        """
+        Guarda una respuesta de OpenAI y expulsa las entradas menos usadas si se supera max_bytes.
+        """
+        try:
+            texto = json.dumps(response, ensure_ascii=False)
+            ahora = time.time()
+            with self._lock:
+                conn = self._conectar()
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, texto, len(texto), ahora, ahora),
+                )
+                self.stats["stores"] += 1
+                self._expulsar(conn)
+                conn.commit()
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.logger.warning("No se pudo guardar en la caché de LLM: %s", e)
+
+    def clear(self):
+        """
+        Elimina todas las respuestas guardadas.
+        """
+        with self._lock:
+            conn = self._conectar()
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+
+    def _conectar(self):
+        if self._conn is None:
+            directorio = os.path.dirname(self.path)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.commit()
+        return self._conn
+
+    def _expulsar(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expulsadas = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            expulsadas.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", expulsadas)
+        self.stats["evictions"] += len(expulsadas)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Retorna la caché de LLM compartida por el proceso.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
+
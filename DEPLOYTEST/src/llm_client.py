@@ -0,0 +1,459 @@
+# llm_client.py
+
+import asyncio
+import collections
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm_backend import backend_desde_entorno
+from llm_cache import get_llm_cache
+from llm_usage import registrar_estimado, registrar_respuesta
+
+
+# Errores de OpenAI que no mejoran al reintentar (por nombre, para no depender de openai.error)
+_NO_REINTENTABLES = {
+    "InvalidRequestError", "AuthenticationError", "PermissionError", "InvalidAPIType", "SignatureVerificationError",
+    "FixtureNotFound",
+}
+
+
+class LLMError(Exception):
+    """
+    Error de una llamada al LLM después de agotar los reintentos.
+    """
+
+
+class LLMTimeout(LLMError):
+    """
+    La llamada (o el intento) superó su plazo.
+    """
+
+
+class CircuitOpenError(LLMError):
+    """
+    El circuito está abierto: la llamada se rechaza sin contactar a OpenAI para usar de inmediato el respaldo.
+    """
+
+
+def _es_reintentable(error):
+    return isinstance(error, LLMTimeout) or type(error).__name__ not in _NO_REINTENTABLES
+
+
+class CircuitBreaker:
+    """
+    Circuito de tres estados (cerrado, abierto, semiabierto).
+
+    Tras `failure_threshold` fallos consecutivos se abre y rechaza las llamadas durante `reset_timeout`
+    segundos; después deja pasar una llamada de prueba que lo cierra si responde bien o lo vuelve a abrir.
+    """
+
+    CERRADO = "closed"
+    ABIERTO = "open"
+    SEMIABIERTO = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: Fallos consecutivos que abren el circuito.
+        :param reset_timeout: Segundos que el circuito permanece abierto antes de probar de nuevo.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.estado = self.CERRADO
+        self._fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def permitir(self):
+        """
+        Indica si una llamada puede hacerse ahora.
+        """
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return True
+            if self.estado == self.ABIERTO and time.monotonic() - self._abierto_desde >= self.reset_timeout:
+                self.estado = self.SEMIABIERTO
+                self._prueba_en_curso = False
+            if self.estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            if self.estado != self.CERRADO:
+                self.logger.info("Circuito de LLM cerrado nuevamente.")
+            self.estado = self.CERRADO
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self.estado == self.SEMIABIERTO or self._fallos >= self.failure_threshold:
+                if self.estado != self.ABIERTO:
+                    self.logger.warning(
+                        "Circuito de LLM abierto tras %d fallos; se usarán los respaldos durante %.0f s.",
+                        self._fallos, self.reset_timeout,
+                    )
+                self.estado = self.ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._prueba_en_curso = False
+
+
+class _MetricasLlamador:
+    def __init__(self, muestras=512):
+        self.latencias = collections.deque(maxlen=muestras)
+        self.contadores = {
+            "calls": 0, "errors": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0,
+            "cache_hits": 0, "rejected": 0,
+        }
+
+    def percentil(self, q):
+        if not self.latencias:
+            return None
+        ordenadas = sorted(self.latencias)
+        return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))]
+
+
+class LLMClient:
+    """
+    Cliente común para las llamadas a OpenAI (ChatCompletion).
+
+    - Plazo por intento (`timeout`, también enviado como request_timeout) y plazo total por llamada (`deadline`).
+    - Reintentos con espera exponencial y jitter completo ante errores transitorios (timeouts, 429, 5xx, red).
+    - Solicitudes duplicadas opcionales (hedging): si un intento tarda más que el p95 observado para ese
+      llamador, se lanza una copia y se usa la primera respuesta.
+    - Circuito compartido: con OpenAI caído se falla de inmediato (CircuitOpenError) y cada llamador usa su respaldo.
+    - Métricas de latencia y errores por llamador (stats()).
+    - La clave de API se pasa en cada llamada; no se modifica openai.api_key.
+    - Las llamadas deterministas (temperature=0) pasan por la caché persistente de llm_cache.
+    - Las solicitudes se envían a un backend intercambiable (llm_backend): OpenAI en vivo, grabación
+      de fixtures o reproducción sin red.
+    - El uso de tokens de cada respuesta se registra en llm_usage (pregunta en curso y contadores acumulados).
+    """
+
+    def __init__(self, timeout=20.0, deadline=45.0, max_retries=2, backoff_base=0.5, backoff_max=8.0,
+                 hedge=None, hedge_quantile=0.95, hedge_min_samples=20, breaker=None, max_workers=16, backend=None):
+        """
+        :param timeout: Segundos máximos de cada intento.
+        :param deadline: Segundos máximos de la llamada completa, incluidos reintentos y esperas.
+        :param max_retries: Reintentos ante errores transitorios.
+        :param backoff_base: Espera base (segundos) del primer reintento; se duplica en cada intento.
+        :param backoff_max: Espera máxima entre reintentos.
+        :param hedge: Activa las solicitudes duplicadas (por defecto, según LLM_HEDGE=1).
+        :param hedge_quantile: Percentil de latencia del llamador tras el cual se lanza la copia.
+        :param hedge_min_samples: Muestras mínimas del llamador antes de usar su percentil.
+        :param breaker: CircuitBreaker compartido (por defecto, uno nuevo).
+        :param max_workers: Hilos para los intentos síncronos (permiten el plazo y el hedging).
+        :param backend: Backend de las solicitudes (por defecto, según LLM_BACKEND; ver llm_backend).
+        """
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        if hedge is None:
+            hedge = os.getenv("LLM_HEDGE", "").lower() in ("1", "true", "yes")
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.backend = backend or backend_desde_entorno()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="LLMClient")
+        self._metricas = collections.defaultdict(_MetricasLlamador)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def chat_completion(self, caller="default", api_key=None, timeout=None, deadline=None, hedge=None,
+                        use_cache=True, **kwargs):
+        """
+        Igual que openai.ChatCompletion.create, con plazo, reintentos, hedging, circuito y caché.
+
+        :param caller: Nombre del llamador para las métricas (p. ej. "UserQueryAgent").
+        :param api_key: Clave de API de esta llamada (None usa la configuración global de openai).
+        :param timeout: Plazo por intento (por defecto, el del cliente).
+        :param deadline: Plazo total (por defecto, el del cliente).
+        :param hedge: Activa o desactiva el hedging en esta llamada (por defecto, el del cliente).
+        :param use_cache: False para saltarse la caché persistente.
+        :return: Respuesta de OpenAI; con stream=True, el iterador de fragmentos.
+        :raises CircuitOpenError: Si el circuito está abierto.
+        :raises LLMError: Si se agotan los reintentos o el plazo total.
+        """
+        cache = get_llm_cache()
+        key = cache.llave(kwargs) if use_cache and self.backend.cacheable and cache.es_cacheable(kwargs) else None
+        if key is not None:
+            response = cache.get(key)
+            if response is not None:
+                self._contar(caller, "cache_hits")
+                registrar_respuesta(caller, kwargs.get("model"), response, cacheada=True)
+                return response
+
+        timeout = timeout or self.timeout
+        limite = time.monotonic() + (deadline or self.deadline)
+        hedge = self.hedge if hedge is None else hedge
+        # En streaming no se duplica la solicitud: los fragmentos ya se están entregando al usuario
+        hedge = hedge and not kwargs.get("stream")
+        kwargs = self._con_credenciales(kwargs, api_key, timeout)
+
+        intento = 0
+        while True:
+            self._verificar_circuito(caller)
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                self._contar(caller, "errors")
+                raise LLMTimeout(f"Plazo total de la llamada agotado ({caller}).")
+            inicio = time.monotonic()
+            try:
+                response = self._intento(caller, kwargs, min(timeout, restante), hedge)
+            except Exception as e:
+                error = e
+            else:
+                self._registrar_exito(caller, time.monotonic() - inicio)
+                if key is not None:
+                    cache.put(key, response)
+                return self._registrar_uso(caller, kwargs, response)
+
+            espera = self._siguiente_espera(caller, error, intento, limite)
+            if espera is None:
+                self._elevar(error)
+            time.sleep(espera)
+            intento += 1
+
+    async def chat_completion_async(self, caller="default", api_key=None, timeout=None, deadline=None, hedge=None,
+                                    use_cache=True, **kwargs):
+        """
+        Versión asíncrona de chat_completion (usa openai.ChatCompletion.acreate).
+        """
+        cache = get_llm_cache()
+        key = cache.llave(kwargs) if use_cache and self.backend.cacheable and cache.es_cacheable(kwargs) else None
+        if key is not None:
+            response = cache.get(key)
+            if response is not None:
+                self._contar(caller, "cache_hits")
+                registrar_respuesta(caller, kwargs.get("model"), response, cacheada=True)
+                return response
+
+        timeout = timeout or self.timeout
+        limite = time.monotonic() + (deadline or self.deadline)
+        hedge = (self.hedge if hedge is None else hedge) and not kwargs.get("stream")
+        kwargs = self._con_credenciales(kwargs, api_key, timeout)
+
+        intento = 0
+        while True:
+            self._verificar_circuito(caller)
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                self._contar(caller, "errors")
+                raise LLMTimeout(f"Plazo total de la llamada agotado ({caller}).")
+            inicio = time.monotonic()
+            try:
+                response = await self._intento_async(caller, kwargs, min(timeout, restante), hedge)
+            except Exception as e:
+                error = e
+            else:
+                self._registrar_exito(caller, time.monotonic() - inicio)
+                if key is not None:
+                    cache.put(key, response)
+                return self._registrar_uso(caller, kwargs, response)
+
+            espera = self._siguiente_espera(caller, error, intento, limite)
+            if espera is None:
+                self._elevar(error)
+            await asyncio.sleep(espera)
+            intento += 1
+
+    def stats(self):
+        """
+        Retorna las métricas por llamador (llamadas, errores, reintentos, hedging, latencias p50/p95 en ms)
+        y el estado del circuito.
+        """
+        with self._lock:
+            llamadores = {}
+            for caller, metricas in self._metricas.items():
+                p50, p95 = metricas.percentil(0.5), metricas.percentil(0.95)
+                llamadores[caller] = {
+                    **metricas.contadores,
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                }
+        return {"circuit": self.breaker.estado, "callers": llamadores}
+
+    @staticmethod
+    def _registrar_uso(caller, kwargs, response):
+        if not kwargs.get("stream"):
+            registrar_respuesta(caller, kwargs.get("model"), response)
+            return response
+
+        # Los fragmentos no traen "usage": se estiman los tokens cuando termina el streaming
+        def contar_fragmentos():
+            textos = []
+            try:
+                for chunk in response:
+                    textos.append(chunk["choices"][0].get("delta", {}).get("content") or "")
+                    yield chunk
+            finally:
+                registrar_estimado(caller, kwargs.get("model"), kwargs.get("messages"), "".join(textos))
+        return contar_fragmentos()
+
+    @staticmethod
+    def _elevar(error):
+        if isinstance(error, LLMError):
+            raise error
+        raise LLMError(str(error)) from error
+
+    @staticmethod
+    def _con_credenciales(kwargs, api_key, timeout):
+        kwargs = dict(kwargs)
+        if api_key:
+            kwargs["api_key"] = api_key
+        kwargs["request_timeout"] = timeout
+        return kwargs
+
+    def _verificar_circuito(self, caller):
+        if not self.breaker.permitir():
+            self._contar(caller, "rejected")
+            raise CircuitOpenError("El servicio de LLM no está disponible (circuito abierto).")
+
+    def _retraso_hedge(self, caller, hedge):
+        if not hedge:
+            return None
+        with self._lock:
+            metricas = self._metricas[caller]
+            if len(metricas.latencias) < self.hedge_min_samples:
+                return None
+            return metricas.percentil(self.hedge_quantile)
+
+    def _intento(self, caller, kwargs, timeout, hedge):
+        """
+        Un intento síncrono con plazo; si hay hedging, lanza una copia tras el p95 del llamador.
+        """
+        futuros = [self._executor.submit(self.backend.create, **kwargs)]
+        limite = time.monotonic() + timeout
+        retraso = self._retraso_hedge(caller, hedge)
+        if retraso is not None and retraso < timeout:
+            hechos, _ = wait(futuros, timeout=retraso)
+            if not hechos:
+                self._contar(caller, "hedges")
+                futuros.append(self._executor.submit(self.backend.create, **kwargs))
+
+        pendientes = set(futuros)
+        error = None
+        while pendientes:
+            hechos, pendientes = wait(pendientes, timeout=max(0.0, limite - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not hechos:
+                break
+            for futuro in hechos:
+                if futuro.exception() is None:
+                    if futuro is not futuros[0]:
+                        self._contar(caller, "hedge_wins")
+                    # La solicitud perdedora termina sola (acotada por request_timeout) y se descarta
+                    return futuro.result()
+                error = futuro.exception()
+        if error is not None and not pendientes:
+            raise error
+        raise LLMTimeout(f"La llamada al LLM superó {timeout:.1f} s ({caller}).")
+
+    async def _intento_async(self, caller, kwargs, timeout, hedge):
+        tareas = [asyncio.ensure_future(self.backend.acreate(**kwargs))]
+        limite = time.monotonic() + timeout
+        retraso = self._retraso_hedge(caller, hedge)
+        try:
+            if retraso is not None and retraso < timeout:
+                hechos, _ = await asyncio.wait(tareas, timeout=retraso)
+                if not hechos:
+                    self._contar(caller, "hedges")
+                    tareas.append(asyncio.ensure_future(self.backend.acreate(**kwargs)))
+
+            pendientes = set(tareas)
+            error = None
+            while pendientes:
+                hechos, pendientes = await asyncio.wait(
+                    pendientes, timeout=max(0.0, limite - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not hechos:
+                    break
+                for tarea in hechos:
+                    if tarea.exception() is None:
+                        if tarea is not tareas[0]:
+                            self._contar(caller, "hedge_wins")
+                        return tarea.result()
+                    error = tarea.exception()
+            if error is not None and not pendientes:
+                raise error
+            raise LLMTimeout(f"La llamada al LLM superó {timeout:.1f} s ({caller}).")
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+
+    def _siguiente_espera(self, caller, error, intento, limite):
+        """
+        Registra el fallo y calcula la espera antes del siguiente intento (jitter completo), o None si no
+        corresponde reintentar.
+        """
+        reintentable = _es_reintentable(error)
+        if isinstance(error, LLMTimeout):
+            self._contar(caller, "timeouts")
+        if reintentable:
+            self.breaker.registrar_fallo()
+        else:
+            # Los errores del pedido (clave inválida, prompt demasiado largo) muestran que OpenAI sí responde
+            self.breaker.registrar_exito()
+        if not reintentable or intento >= self.max_retries:
+            self._contar(caller, "errors")
+            self.logger.warning("Llamada al LLM fallida (%s): %s", caller, error)
+            return None
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+        if time.monotonic() + espera >= limite:
+            self._contar(caller, "errors")
+            self.logger.warning("Llamada al LLM fallida (%s), sin plazo para reintentar: %s", caller, error)
+            return None
+        self._contar(caller, "retries")
+        self.logger.info("Reintentando llamada al LLM (%s) en %.2f s: %s", caller, espera, error)
+        return espera
+
+    def _registrar_exito(self, caller, segundos):
+        self.breaker.registrar_exito()
+        with self._lock:
+            metricas = self._metricas[caller]
+            metricas.contadores["calls"] += 1
+            metricas.latencias.append(segundos)
+
+    def _contar(self, caller, contador):
+        with self._lock:
+            self._metricas[caller].contadores[contador] += 1
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """
+    Retorna el cliente de LLM compartido por el proceso.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+def chat_completion(caller="default", **kwargs):
+    """
+    Llamada síncrona con el cliente compartido (ver LLMClient.chat_completion).
+    """
+    return get_llm_client().chat_completion(caller=caller, **kwargs)
+
+
+async def chat_completion_async(caller="default", **kwargs):
+    """
+    Llamada asíncrona con el cliente compartido (ver LLMClient.chat_completion_async).
+    """
+    return await get_llm_client().chat_completion_async(caller=caller, **kwargs)
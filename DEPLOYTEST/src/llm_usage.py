@@ -0,0 +1,186 @@
+# llm_usage.py
+
+import contextlib
+import contextvars
+import threading
+
+from text_utils import contar_tokens
+
+
+# Etapa del pipeline de cada llamador de llm_client
+ETAPAS = {
+    "UserQueryAgent": "interpretacion",
+    "SQLGenerationAgent": "generacion_sql",
+    "ResponseFormatter": "formateo",
+    "ComparativeChartAgent": "grafico",
+}
+
+# Precio en USD por 1.000 tokens (entrada, salida); los modelos no listados se contabilizan sin costo
+PRECIOS = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+}
+
+
+def etapa_de(caller):
+    return ETAPAS.get(caller, caller)
+
+
+def costo(model, prompt_tokens, completion_tokens):
+    """
+    Costo estimado en USD de una llamada según PRECIOS (se usa el prefijo de modelo más largo que coincida).
+    """
+    prefijo = max((p for p in PRECIOS if str(model or "").startswith(p)), key=len, default=None)
+    if prefijo is None:
+        return 0.0
+    entrada, salida = PRECIOS[prefijo]
+    return (prompt_tokens * entrada + completion_tokens * salida) / 1000
+
+
+def _vacio():
+    return {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+            "cached_tokens": 0, "cost_usd": 0.0}
+
+
+def _sumar(destino, prompt_tokens, completion_tokens, costo_usd, cacheada):
+    if cacheada:
+        # Respuesta servida por la caché: no consume tokens, pero se registra cuántos se ahorraron
+        destino["cached_calls"] += 1
+        destino["cached_tokens"] += prompt_tokens + completion_tokens
+        return
+    destino["calls"] += 1
+    destino["prompt_tokens"] += prompt_tokens
+    destino["completion_tokens"] += completion_tokens
+    destino["total_tokens"] += prompt_tokens + completion_tokens
+    destino["cost_usd"] += costo_usd
+
+
+class UsageAccumulator:
+    """
+    Acumula el uso de tokens en total, por etapa y por modelo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = _vacio()
+        self.por_etapa = {}
+        self.por_modelo = {}
+
+    def registrar(self, etapa, model, prompt_tokens, completion_tokens, cacheada=False, estimado=False):
+        costo_usd = costo(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            for destino in (self.total, self.por_etapa.setdefault(etapa, _vacio()), self.por_modelo.setdefault(model, _vacio())):
+                _sumar(destino, prompt_tokens, completion_tokens, costo_usd, cacheada)
+                if estimado:
+                    destino["estimated_calls"] = destino.get("estimated_calls", 0) + 1
+
+    def resumen(self):
+        """
+        :return: Diccionario {"total", "por_etapa", "por_modelo"} (costos redondeados a 6 decimales).
+        """
+        def redondear(d):
+            return {**d, "cost_usd": round(d["cost_usd"], 6)}
+
+        with self._lock:
+            return {
+                "total": redondear(self.total),
+                "por_etapa": {k: redondear(v) for k, v in self.por_etapa.items()},
+                "por_modelo": {k: redondear(v) for k, v in self.por_modelo.items()},
+            }
+
+
+class RequestUsage(UsageAccumulator):
+    """
+    Uso de tokens de una pregunta, con un presupuesto opcional.
+    """
+
+    def __init__(self, presupuesto=None):
+        """
+        :param presupuesto: Máximo de tokens (entrada + salida) de la pregunta; None para no limitar.
+        """
+        super().__init__()
+        self.presupuesto = presupuesto
+
+    def agotado(self):
+        """
+        Indica si la pregunta ya consumió su presupuesto de tokens.
+        """
+        return self.presupuesto is not None and self.total["total_tokens"] >= self.presupuesto
+
+    def resumen(self):
+        resumen = super().resumen()
+        if self.presupuesto is not None:
+            resumen["presupuesto"] = {"tokens": self.presupuesto, "agotado": self.agotado()}
+        return resumen
+
+
+_uso_actual = contextvars.ContextVar("uso_llm_actual", default=None)
+_acumulado = UsageAccumulator()
+
+
+@contextlib.contextmanager
+def contabilizar(uso):
+    """
+    Asocia `uso` (RequestUsage) a las llamadas al LLM hechas dentro del bloque, incluidas las tareas
+    asíncronas creadas en él y los hilos lanzados con propagar_contexto.
+    """
+    token = _uso_actual.set(uso)
+    try:
+        yield uso
+    finally:
+        _uso_actual.reset(token)
+
+
+def uso_actual():
+    """
+    Retorna el RequestUsage de la pregunta en curso, o None.
+    """
+    return _uso_actual.get()
+
+
+def propagar_contexto(funcion):
+    """
+    Envuelve `funcion` para ejecutarla en otro hilo (p. ej. un ThreadPoolExecutor) con una copia del
+    contexto actual, de modo que sus llamadas al LLM se sumen a la pregunta en curso.
+    """
+    contexto = contextvars.copy_context()
+
+    def envoltura(*args, **kwargs):
+        return contexto.copy().run(funcion, *args, **kwargs)
+    return envoltura
+
+
+def registrar_respuesta(caller, model, response, cacheada=False):
+    """
+    Registra el campo "usage" de una respuesta de OpenAI en la pregunta en curso y en los contadores acumulados.
+    """
+    usage = response.get("usage") if hasattr(response, "get") else None
+    if not usage:
+        return
+    _registrar(caller, model or response.get("model"), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cacheada)
+
+
+def registrar_estimado(caller, model, messages, texto):
+    """
+    Registra una llamada sin "usage" (streaming) estimando los tokens de los mensajes y del texto generado.
+    """
+    prompt = "\n".join(m.get("content") or "" for m in messages or [])
+    _registrar(caller, model, contar_tokens(prompt, model), contar_tokens(texto, model) if texto else 0, False, estimado=True)
+
+
+def _registrar(caller, model, prompt_tokens, completion_tokens, cacheada, estimado=False):
+    etapa = etapa_de(caller)
+    _acumulado.registrar(etapa, model, prompt_tokens, completion_tokens, cacheada, estimado)
+    uso = _uso_actual.get()
+    if uso is not None:
+        uso.registrar(etapa, model, prompt_tokens, completion_tokens, cacheada, estimado)
+
+
+def uso_acumulado():
+    """
+    Retorna los contadores acumulados del proceso (total, por etapa y por modelo).
+    """
+    return _acumulado.resumen()
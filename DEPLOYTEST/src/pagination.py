@@ -0,0 +1,131 @@
+# pagination.py
+
+import logging
+import re
+
+from columnar_result import ColumnarResult
+from text_utils import clausulas_sql, dividir_sql
+
+
+# Tablas que se paginan: tabla -> (columna de tiempo, llave primaria)
+TABLAS_PAGINABLES = {
+    "detections": ("init_time", "id"),
+}
+
+# Columnas auxiliares con la llave de cada fila (se quitan del resultado)
+_COLUMNA_TIEMPO = "_pagina_tiempo"
+_COLUMNA_LLAVE = "_pagina_llave"
+
+_ORDEN_CLAUSULAS = ("select", "from", "where", "order by", "limit")
+_AGREGADO_RE = re.compile(r"\b(count|sum|avg|min|max|group_concat|std|stddev|variance)\s*\(|\bover\s*\(", re.IGNORECASE)
+
+
+def _valor_python(valor):
+    # Los arreglos de ColumnarResult entregan escalares de NumPy
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+class KeysetPaginator:
+    """
+    Paginación por llave (keyset) de los listados: las consultas que listan filas de una tabla con columna de
+    tiempo se ordenan por (tiempo, llave primaria) y cada página continúa después de la última fila de la
+    anterior (WHERE tiempo <= t AND (tiempo < t OR id < k)), en vez de usar OFFSET. Así cada página cuesta
+    lo mismo sin importar cuán lejos se navegue, y se obtiene directamente con QueryExecutor, sin el LLM.
+    """
+
+    def __init__(self, query_executor, tamano=25, tablas=None):
+        """
+        :param query_executor: QueryExecutor con que se ejecutan las páginas.
+        :param tamano: Filas por página si la consulta no trae LIMIT.
+        :param tablas: {tabla: (columna de tiempo, llave primaria)} de las tablas que se paginan
+                       (por defecto, TABLAS_PAGINABLES).
+        """
+        self.query_executor = query_executor
+        self.tamano = tamano
+        self.tablas = TABLAS_PAGINABLES if tablas is None else tablas
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def preparar(self, sql, params=None, verificar=True):
+        """
+        Convierte un listado (SELECT sin agregados sobre una tabla paginable, ordenado por su columna de tiempo
+        o sin orden, con un LIMIT sin OFFSET) en la consulta de su primera página.
+
+        :param verificar: Si es False, las páginas no pasan por la guardia de SQL.
+        :return: Diccionario de la página {"sql", "sql_siguiente", "params", "tamano", "despues", "numero",
+                 "verificar"}, o None si la consulta no es un listado paginable.
+        """
+        if not isinstance(sql, str) or re.search(r"/\*|--|#", sql) or (params is None and "%" in sql):
+            return None
+        texto = " ".join(sql.replace(";", " ").split())
+        clausulas = clausulas_sql(texto)
+        if list(clausulas) != [c for c in _ORDEN_CLAUSULAS if c in clausulas] or "select" not in clausulas:
+            return None
+        select = clausulas["select"]
+        if re.match(r"^distinct\b", select, re.IGNORECASE) or _AGREGADO_RE.search(select):
+            return None
+        origen = re.match(r"^`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?$", clausulas.get("from", ""), re.IGNORECASE)
+        if origen is None or origen.group(1) not in self.tablas:
+            return None
+        tiempo, llave = self.tablas[origen.group(1)]
+        tabla = f"`{origen.group(2) or origen.group(1)}`"
+
+        # Orden: sin ORDER BY (lo más reciente primero), o por la columna de tiempo y opcionalmente la llave
+        sentido = "DESC"
+        orden = dividir_sql(clausulas.get("order by", ""), r",")
+        if len(orden) > 2:
+            return None
+        for i, item in enumerate(orden):
+            m = re.match(r"^(?:`?\w+`?\.)?`?(\w+)`?(?:\s+(asc|desc))?$", item, re.IGNORECASE)
+            if m is None or m.group(1) != (tiempo if i == 0 else llave):
+                return None
+            direccion = (m.group(2) or "ASC").upper()
+            if i == 1 and direccion != sentido:
+                return None
+            sentido = direccion
+        limite = clausulas.get("limit")
+        if limite is not None and not limite.isdigit():
+            return None  # OFFSET o LIMIT con parámetros
+        tamano = int(limite) if limite else self.tamano
+
+        base = f"SELECT {select}, {tabla}.`{tiempo}` AS {_COLUMNA_TIEMPO}, {tabla}.`{llave}` AS {_COLUMNA_LLAVE} " \
+               f"FROM {clausulas['from']}"
+        where = clausulas.get("where")
+        operador = "<" if sentido == "DESC" else ">"
+        despues = f"{tabla}.`{tiempo}` {operador}= %s AND ({tabla}.`{tiempo}` {operador} %s OR {tabla}.`{llave}` {operador} %s)"
+        orden_limite = f" ORDER BY {tabla}.`{tiempo}` {sentido}, {tabla}.`{llave}` {sentido} LIMIT {tamano}"
+        return {
+            "sql": base + (f" WHERE {where}" if where else "") + orden_limite,
+            "sql_siguiente": base + (f" WHERE ({where}) AND {despues}" if where else f" WHERE {despues}") + orden_limite,
+            "params": tuple(params or ()),
+            "tamano": tamano,
+            "despues": None,
+            "numero": 1,
+            "verificar": verificar,
+        }
+
+    def ejecutar(self, pagina):
+        """
+        Ejecuta una página preparada con `preparar` o tomada de la clave "pagina" del resultado anterior.
+
+        :return: ColumnarResult sin las columnas auxiliares y, si puede haber más filas, con la clave "pagina"
+                 para pedir la siguiente; o el resultado de QueryExecutor si la consulta falla o se rechaza.
+        """
+        if pagina["despues"] is None:
+            sql, params = pagina["sql"], pagina["params"]
+        else:
+            tiempo, llave = pagina["despues"]
+            sql, params = pagina["sql_siguiente"], tuple(pagina["params"]) + (tiempo, tiempo, llave)
+        resultado = self.query_executor.ejecutar_sql_acotado(sql, params=params or None, verificar=pagina["verificar"])
+        if not isinstance(resultado, ColumnarResult) or resultado.get("rechazo") \
+                or resultado.columns[-2:] != [_COLUMNA_TIEMPO, _COLUMNA_LLAVE]:
+            return resultado
+
+        # Se arma un resultado nuevo: el de la caché de resultados no se modifica
+        extras = dict(resultado.extras)
+        if resultado.num_rows and (resultado.num_rows >= pagina["tamano"] or resultado.get("truncated")):
+            extras["pagina"] = {
+                **pagina,
+                "despues": (_valor_python(resultado.arrays[-2][-1]), _valor_python(resultado.arrays[-1][-1])),
+                "numero": pagina["numero"] + 1,
+            }
+        return ColumnarResult(resultado.columns[:-2], resultado.arrays[:-2], **extras)
@@ -2,38 +2,232 @@
 
 
 import logging
+import time
+
+from columnar_result import ColumnarResult
+from sql_compiler import renderizar_sql
+from sql_guard import es_tiempo_excedido, rechazo_tiempo_excedido
+
+
+def _tamano_fila(row):
+    """
+    Estimación barata del tamaño en bytes de una fila (textos y binarios por su longitud, el resto 8 bytes).
+    """
+    return sum(len(v) if isinstance(v, (str, bytes, bytearray)) else 8 for v in row)
+
+
+class ResultStream:
+    """
+    Iterador de resultados por bloques sobre un cursor sin buffer (las filas se leen del servidor
+    a medida que se consumen). Corta la lectura al alcanzar el máximo de filas o de bytes y deja
+    constancia de ello en `truncated` y `truncation_reason`.
+    """
+
+    def __init__(self, conn, cursor, columns, chunk_size, max_rows, max_bytes, close_cursor=True):
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.truncated = False
+        self.truncation_reason = None
+        # Rechazo de la guardia de SQL (la consulta no se ejecutó)
+        self.rechazo = None
+        self._conn = conn
+        self._cursor = cursor
+        # Los cursores preparados quedan en la caché de la conexión y no se cierran
+        self._close_cursor = close_cursor
+        self._exhausted = cursor is None
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            while not self._exhausted:
+                chunk = self._cursor.fetchmany(self.chunk_size)
+                if not chunk:
+                    self._exhausted = True
+                    break
+                chunk = self._recortar(chunk)
+                if chunk:
+                    yield chunk
+                if self.truncated:
+                    break
+        finally:
+            self.close()
+
+    def _recortar(self, chunk):
+        if self.max_rows is not None and self.rows_read + len(chunk) > self.max_rows:
+            chunk = chunk[:self.max_rows - self.rows_read]
+            self.truncated, self.truncation_reason = True, "max_rows"
+
+        if self.max_bytes is not None:
+            for idx, row in enumerate(chunk):
+                size = _tamano_fila(row)
+                if self.bytes_read + size > self.max_bytes:
+                    chunk = chunk[:idx]
+                    self.truncated, self.truncation_reason = True, "max_bytes"
+                    break
+                self.bytes_read += size
+        self.rows_read += len(chunk)
+        return chunk
+
+    def close(self):
+        """
+        Libera el cursor y la conexión. Si quedaron filas sin leer en el servidor, la conexión se descarta
+        en lugar de reutilizarse, ya que no puede volver a usarse hasta leerlas todas.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._exhausted:
+            if self._cursor and self._close_cursor:
+                self._cursor.close()
+            self._conn.close()
+        else:
+            discard = getattr(self._conn, "discard", None)
+            (discard or self._conn.close)()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 class QueryExecutor:
-    def __init__(self, get_connection):
+    def __init__(self, get_connection, chunk_size=1000, max_rows=100000, max_bytes=64 * 1024 * 1024, result_cache=None,
+                 guard=None, workload=None, router=None):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param chunk_size: Filas leídas por cada fetchmany en el modo streaming.
+        :param max_rows: Máximo de filas que se leen en el modo streaming.
+        :param max_bytes: Máximo aproximado de bytes que se leen en el modo streaming.
+        :param result_cache: ResultCache opcional para reutilizar resultados de consultas repetidas.
+        :param guard: SQLGuard opcional que revisa las consultas antes de ejecutarlas (EXPLAIN, LIMIT y
+                      tiempo máximo). Las consultas rechazadas retornan un resultado vacío con la clave "rechazo".
+        :param workload: WorkloadRecorder opcional donde se registra cada consulta ejecutada con su tiempo
+                         (no las respondidas por la caché ni las rechazadas), para el asesor de índices.
+        :param router: AggregateRouter opcional que reescribe las consultas de conteo que se pueden responder
+                       con las tablas de resumen (rollups) antes de revisarlas y ejecutarlas.
+        """
         self.get_connection = get_connection
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.result_cache = result_cache
+        self.guard = guard
+        self.workload = workload
+        self.router = router
         self.logger = logging.getLogger(self.__class__.__name__)
+
+    def ejecutar_sql(self, sql, params=None, verificar=True):
+        """
+        Ejecuta una consulta (o una lista de consultas) y materializa el resultado completo.
+        Si hay caché de resultados, las consultas SELECT repetidas se responden desde ella.
+
+        :param sql: Consulta SQL (o lista de consultas); puede ser una plantilla con marcadores %s.
+        :param params: Parámetros de la plantilla (solo para una consulta).
+        :param verificar: Si es False, la consulta no pasa por la guardia (SQL compilado localmente, ya acotado).
+        :return: ColumnarResult (o lista de ColumnarResult), o None si la consulta falla.
+        """
+        if self.result_cache is None or not isinstance(sql, str):
+            return self._ejecutar_sql(sql, params, verificar)
+
+        llave = renderizar_sql(sql, params)
+        resultado, marca = self.result_cache.get(llave, self.get_connection)
+        if resultado is not None:
+            self.logger.info("Resultado obtenido de la caché: %s", llave)
+            return resultado
+        resultado = self._ejecutar_sql(sql, params, verificar)
+        if resultado is None or not resultado.get("rechazo"):
+            self.result_cache.put(llave, resultado, marca)
+        return resultado
+
+    def _enrutar(self, cursor, sql, params):
+        """
+        Reescribe la consulta sobre los rollups si hay un router y la consulta se puede responder con ellos.
+
+        :return: Tupla (sql, params).
+        """
+        if self.router is None:
+            return sql, params
+        return self.router.enrutar(cursor, sql, params)
+
+    def _revisar(self, cursor, sql, params, verificar):
+        """
+        Pasa la consulta por la guardia, si hay una y corresponde.
+
+        :return: Tupla (sql, rechazo) de SQLGuard.revisar.
+        """
+        if self.guard is None or not verificar:
+            return sql, None
+        return self.guard.revisar(cursor, sql, params)
+
+    def _cursor_preparado(self, conn, sql, params):
+        """
+        Cursor con la sentencia preparada de la plantilla en la conexión (solo para consultas con
+        parámetros y conexiones de un pool con sentencias preparadas). No debe cerrarse.
+
+        :return: Cursor preparado, o None para usar un cursor normal.
+        """
+        if not params:
+            return None
+        preparar = getattr(conn, "prepared_cursor", None)
+        return preparar(sql) if callable(preparar) else None
+
+    def _registrar_carga(self, sql, params, inicio, resultado):
+        if self.workload is not None and isinstance(resultado, ColumnarResult) and not resultado.get("rechazo"):
+            self.workload.registrar(sql, params, time.perf_counter() - inicio, resultado.num_rows)
+
+    def _rechazo_por_error(self, error, sql):
+        # Consulta cortada por el servidor al superar el MAX_EXECUTION_TIME de la guardia
+        if self.guard is not None and es_tiempo_excedido(error):
+            return rechazo_tiempo_excedido(sql, self.guard.max_execution_ms)
+        return None
     
-    def ejecutar_sql(self, sql):
+    def _ejecutar_sql(self, sql, params=None, verificar=True):
         conn = None
         cursor = None
+        preparado = None
         
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
             if isinstance(sql, str):
-                self.logger.info("Ejecutando SQL: %s", sql)
-                cursor.execute(sql)
+                sql, params = self._enrutar(cursor, sql, params)
+                sql, rechazo = self._revisar(cursor, sql, params, verificar)
+                if rechazo:
+                    return ColumnarResult.from_rows([], [], rechazo=rechazo)
+                self.logger.info("Ejecutando SQL: %s %s", sql, params or "")
+                preparado = self._cursor_preparado(conn, sql, params)
+                ejecutor = preparado or cursor
+                inicio = time.perf_counter()
+                ejecutor.execute(sql, params)
                 
                 # Solo fetch si es SELECT (tiene descripción)
-                if cursor.description:
-                    data = cursor.fetchall()
-                    columns = [desc[0] for desc in cursor.description]
+                if ejecutor.description:
+                    data = ejecutor.fetchall()
+                    columns = [desc[0] for desc in ejecutor.description]
                 else:
                     data = []
                     columns = []
                     conn.commit()  # Commit para DML
                 
-                return {"columns": columns, "data": data}
+                resultado = ColumnarResult.from_rows(columns, data)
+                self._registrar_carga(sql, params, inicio, resultado)
+                return resultado
             
             elif isinstance(sql, list):
                 results_list = []
                 for idx, single_query in enumerate(sql, start=1):
+                    single_query, rechazo = self._revisar(cursor, single_query, None, verificar)
+                    if rechazo:
+                        results_list.append(ColumnarResult.from_rows([], [], rechazo=rechazo))
+                        continue
                     self.logger.info("Ejecutando SQL %d: %s", idx, single_query)
+                    inicio = time.perf_counter()
                     cursor.execute(single_query)
                     
                     if cursor.description:
@@ -44,15 +238,140 @@ class QueryExecutor:
                         columns = []
                         conn.commit()  # Commit para DML
                     
-                    results_list.append({"columns": columns, "data": data})
+                    results_list.append(ColumnarResult.from_rows(columns, data))
+                    self._registrar_carga(single_query, None, inicio, results_list[-1])
                 return results_list
             
         except Exception as e:
             self.logger.error("Error al ejecutar la consulta SQL: %s", e)
-            conn.rollback()  # Rollback en caso de error
-            return None
+            if conn:
+                conn.rollback()  # Rollback en caso de error
+                if preparado is not None:
+                    # El cursor preparado pudo quedar en un estado inválido: se descarta la conexión con su caché
+                    discard = getattr(conn, "discard", None)
+                    (discard or conn.close)()
+            rechazo = self._rechazo_por_error(e, sql) if isinstance(sql, str) else None
+            return ColumnarResult.from_rows([], [], rechazo=rechazo) if rechazo else None
         finally:
             if cursor:
                 cursor.close()
             if conn:
-                conn.close()
\ No newline at end of file
+                conn.close()
+
+    def ejecutar_sql_stream(self, sql, chunk_size=None, max_rows=None, max_bytes=None, params=None, verificar=True):
+        """
+        Ejecuta una consulta con un cursor sin buffer y retorna un ResultStream que entrega las filas
+        en bloques de `chunk_size`, sin cargar el resultado completo en memoria.
+
+        :param sql: Consulta SQL (una sola sentencia); puede ser una plantilla con marcadores %s.
+        :param chunk_size: Filas por bloque (por defecto, self.chunk_size).
+        :param max_rows: Tope de filas (por defecto, self.max_rows).
+        :param max_bytes: Tope aproximado de bytes (por defecto, self.max_bytes).
+        :param params: Parámetros de la plantilla.
+        :param verificar: Si es False, la consulta no pasa por la guardia.
+        :return: ResultStream (sin filas y con `rechazo` si la guardia la rechazó), o None si la consulta falla.
+        """
+        conn = None
+        cursor = None
+
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor(buffered=False)
+            sql, params = self._enrutar(cursor, sql, params)
+            sql, rechazo = self._revisar(cursor, sql, params, verificar)
+            if rechazo:
+                cursor.close()
+                stream = ResultStream(conn, None, [], chunk_size or self.chunk_size, max_rows, max_bytes)
+                stream.rechazo = rechazo
+                return stream
+            self.logger.info("Ejecutando SQL (streaming): %s %s", sql, params or "")
+            preparado = self._cursor_preparado(conn, sql, params)
+            if preparado is not None:
+                cursor.close()
+                cursor = preparado
+            cursor.execute(sql, params)
+
+            if not cursor.description:
+                conn.commit()  # Commit para DML
+                if preparado is None:
+                    cursor.close()
+                return ResultStream(conn, None, [], chunk_size or self.chunk_size, max_rows, max_bytes)
+
+            columns = [desc[0] for desc in cursor.description]
+            return ResultStream(
+                conn,
+                cursor,
+                columns,
+                chunk_size or self.chunk_size,
+                self.max_rows if max_rows is None else max_rows,
+                self.max_bytes if max_bytes is None else max_bytes,
+                close_cursor=preparado is None,
+            )
+
+        except Exception as e:
+            self.logger.error("Error al ejecutar la consulta SQL: %s", e)
+            if cursor:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+            if conn:
+                discard = getattr(conn, "discard", None)
+                (discard or conn.close)()
+            rechazo = self._rechazo_por_error(e, sql)
+            if rechazo:
+                # La conexión ya se descartó; cerrar el stream no tiene efecto
+                stream = ResultStream(conn, None, [], chunk_size or self.chunk_size, max_rows, max_bytes)
+                stream.rechazo = rechazo
+                return stream
+            return None
+
+    def ejecutar_sql_acotado(self, sql, max_rows=None, max_bytes=None, params=None, verificar=True):
+        """
+        Ejecuta la consulta en modo streaming y materializa solo hasta los topes de filas y bytes.
+        `params` son los parámetros si `sql` es una plantilla con marcadores %s; con verificar=False la
+        consulta no pasa por la guardia.
+
+        :return: ColumnarResult con las claves adicionales "truncated" y "truncation_reason" (y "rechazo" si la
+                 guardia o el tiempo máximo la detuvieron), o None si la consulta falla.
+        """
+        if not isinstance(sql, str):
+            return self.ejecutar_sql(sql, verificar=verificar)
+
+        marca = None
+        llave = renderizar_sql(sql, params)
+        if self.result_cache is not None:
+            resultado, marca = self.result_cache.get(llave, self.get_connection)
+            tope = self.max_rows if max_rows is None else max_rows
+            if resultado is not None and (tope is None or resultado.num_rows <= tope):
+                self.logger.info("Resultado obtenido de la caché: %s", llave)
+                return resultado
+
+        inicio = time.perf_counter()
+        stream = self.ejecutar_sql_stream(sql, max_rows=max_rows, max_bytes=max_bytes, params=params, verificar=verificar)
+        if stream is None:
+            return None
+        if stream.rechazo:
+            stream.close()
+            return ColumnarResult.from_rows([], [], rechazo=stream.rechazo)
+
+        try:
+            with stream:
+                resultado = ColumnarResult.from_chunks(stream.columns, stream)
+        except Exception as e:
+            # Con un cursor sin buffer el error (p. ej. el tiempo máximo) puede llegar al leer las filas
+            self.logger.error("Error al leer el resultado de la consulta SQL: %s", e)
+            rechazo = self._rechazo_por_error(e, sql)
+            return ColumnarResult.from_rows([], [], rechazo=rechazo) if rechazo else None
+
+        if stream.truncated:
+            self.logger.warning(
+                "Resultado truncado (%s) tras %d filas / %d bytes.", stream.truncation_reason, stream.rows_read, stream.bytes_read
+            )
+        resultado.extras.update(truncated=stream.truncated, truncation_reason=stream.truncation_reason)
+        # El tiempo incluye la revisión de la guardia (un EXPLAIN), despreciable frente a las consultas lentas
+        self._registrar_carga(sql, params, inicio, resultado)
+        if self.result_cache is not None and not stream.truncated:
+            # Solo se guardan resultados completos, que sirven igual a ejecutar_sql
+            self.result_cache.put(llave, resultado, marca)
+        return resultado
@@ -1,5 +1,9 @@
+import datetime
 import json
 import logging
+import re
+
+from schema_retrieval import SchemaRetriever
 
 class UserQueryAgent:
     """
@@ -14,23 +18,29 @@ class UserQueryAgent:
     de la base de datos y del mapa semántico.
     """
     
-    def __init__(self, llm_api_key=None, model="gpt-3.5-turbo", temperature=0.0):
+    def __init__(self, llm_api_key=None, model="gpt-3.5-turbo", temperature=0.0, top_k_tables=None):
         """
         :param llm_api_key: Clave API para el modelo de lenguaje (por ejemplo, OpenAI).
         :param model: Modelo de lenguaje a utilizar.
         :param temperature: Controla la aleatoriedad en la respuesta del modelo.
+        :param top_k_tables: Si se indica, el prompt solo incluye (en formato compacto) las tablas y columnas
+                             más relevantes para la consulta, en lugar del esquema y el mapa semántico completos.
         """
         if llm_api_key:
             try:
-                import openai
-                openai.api_key = llm_api_key
+                import openai  # noqa: F401
             except ImportError:
                 raise ImportError("El paquete openai no está instalado. Instálalo para usar el LLM.")
+        # La clave se envía en cada llamada (sin modificar la configuración global de openai)
+        self.llm_api_key = llm_api_key
         self.model = model
         self.temperature = temperature
+        self.schema_retriever = SchemaRetriever(top_k_tables=top_k_tables, model=model) if top_k_tables else None
+        # Tokens del último prompt con el esquema completo y con el recortado (solo si hay schema_retriever)
+        self.ultimo_conteo_tokens = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
-    def interpretar_consulta(self, consulta, schema, semantic_map):
+    def interpretar_consulta(self, consulta, schema, semantic_map, ejemplos=None):
         """
         Interpreta una consulta en lenguaje natural y retorna una estructura de consulta (diccionario)
         con los campos 'accion', 'tabla' y 'filtros'.
@@ -38,11 +48,95 @@ class UserQueryAgent:
         :param consulta: Consulta en lenguaje natural.
         :param schema: Esquema de la base de datos (diccionario obtenido, por ejemplo, con DBSchemaAgent).
         :param semantic_map: Mapa semántico para traducir nombres técnicos a nombres legibles.
+        :param ejemplos: Preguntas parecidas ya resueltas ({"pregunta", "estructura", "sql"}) que reemplazan
+                         a los ejemplos genéricos del prompt.
         :return: Diccionario o lista de diccionarios con la estructura de consulta.
         """
-        prompt = self._crear_prompt(consulta, schema, semantic_map)
+        prompt = self._crear_prompt(consulta, schema, semantic_map, ejemplos=ejemplos)
         respuesta_llm = self._obtener_respuesta_llm(prompt)
-        
+        return self._decodificar_estructura(respuesta_llm)
+
+    async def interpretar_consulta_async(self, consulta, schema, semantic_map, ejemplos=None):
+        """
+        Versión asíncrona de interpretar_consulta: la llamada al LLM usa HTTP asíncrono.
+        """
+        prompt = self._crear_prompt(consulta, schema, semantic_map, ejemplos=ejemplos)
+        respuesta_llm = await self._obtener_respuesta_llm_async(prompt)
+        return self._decodificar_estructura(respuesta_llm)
+
+    def interpretar_y_generar_sql(self, consulta, schema, semantic_map, limit=25, ejemplos=None):
+        """
+        Modo combinado: obtiene en una sola llamada al LLM la estructura de consulta y su SQL.
+
+        :param consulta: Consulta en lenguaje natural.
+        :param schema: Esquema de la base de datos.
+        :param semantic_map: Mapa semántico.
+        :param limit: Límite de registros que debe aplicar el SQL.
+        :param ejemplos: Igual que en interpretar_consulta.
+        :return: Tupla (estructura_consulta, sql), donde sql es una consulta o una lista (una por estructura),
+                 o None si el SQL no pasó la validación. Retorna None si la estructura tampoco es válida;
+                 en ambos casos quien llama debe seguir con el camino de dos pasos.
+        """
+        prompt = self._crear_prompt(consulta, schema, semantic_map, limit_sql=limit, ejemplos=ejemplos)
+        respuesta_llm = self._obtener_respuesta_llm(prompt, max_tokens=600)
+        return self._validar_combinado(respuesta_llm, schema)
+
+    async def interpretar_y_generar_sql_async(self, consulta, schema, semantic_map, limit=25, ejemplos=None):
+        """
+        Versión asíncrona de interpretar_y_generar_sql.
+        """
+        prompt = self._crear_prompt(consulta, schema, semantic_map, limit_sql=limit, ejemplos=ejemplos)
+        respuesta_llm = await self._obtener_respuesta_llm_async(prompt, max_tokens=600)
+        return self._validar_combinado(respuesta_llm, schema)
+
+    def _validar_combinado(self, respuesta_llm, schema):
+        """
+        Valida la respuesta del modo combinado: un objeto JSON {"estructura": ..., "sql": ...} cuyas
+        estructuras usan tablas del esquema y cuyos SQL son una única sentencia SELECT sobre esa tabla.
+        """
+        try:
+            respuesta = json.loads(respuesta_llm)
+        except json.JSONDecodeError as e:
+            self.logger.warning("Respuesta combinada no es JSON válido: %s", e)
+            return None
+        if not isinstance(respuesta, dict):
+            self.logger.warning("Respuesta combinada sin el formato esperado.")
+            return None
+
+        estructura_consulta = respuesta.get("estructura")
+        estructuras = estructura_consulta if isinstance(estructura_consulta, list) else [estructura_consulta]
+        if not estructuras or not all(isinstance(e, dict) and e.get("tabla") in schema for e in estructuras):
+            self.logger.warning("Estructura combinada inválida: %s", estructura_consulta)
+            return None
+
+        sql = respuesta.get("sql")
+        sqls = sql if isinstance(sql, list) else [sql]
+        if len(sqls) != len(estructuras) or not all(
+            self._sql_valido(q, e["tabla"]) for q, e in zip(sqls, estructuras)
+        ):
+            self.logger.warning("SQL combinado inválido; se generará por separado: %s", sql)
+            return estructura_consulta, None
+
+        sqls = [q.strip().rstrip(";").strip() for q in sqls]
+        return estructura_consulta, sqls if isinstance(estructura_consulta, list) else sqls[0]
+
+    @staticmethod
+    def _sql_valido(sql, tabla):
+        if not isinstance(sql, str):
+            return False
+        sql = sql.strip().rstrip(";").strip()
+        # Una sola sentencia de lectura (sin ';' intermedios fuera de literales) que consulte la tabla indicada
+        sin_literales = re.sub(r"'(?:[^'\\]|\\.|'')*'", "''", sql)
+        return (
+            re.match(r"(?is)^(select|with)\b", sql) is not None
+            and ";" not in sin_literales
+            and re.search(rf"(?i)\b{re.escape(tabla)}\b", sin_literales) is not None
+        )
+
+    def _decodificar_estructura(self, respuesta_llm):
+        """
+        Convierte la respuesta del LLM en la estructura de consulta (diccionario vacío si no es JSON válido).
+        """
         try:
             estructura_consulta = json.loads(respuesta_llm)
         except json.JSONDecodeError as e:
@@ -51,7 +145,7 @@ class UserQueryAgent:
         
         return estructura_consulta
 
-    def _crear_prompt(self, consulta, schema, semantic_map):
+    def _crear_prompt(self, consulta, schema, semantic_map, limit_sql=None, ejemplos=None):
         """
         Crea el prompt para enviar al LLM, incluyendo el esquema de la base de datos, el mapa semántico,
         el contexto general de uso de las tablas y la consulta en lenguaje natural del usuario.
@@ -59,8 +153,25 @@ class UserQueryAgent:
         :param consulta: Consulta en lenguaje natural.
         :param schema: Esquema de la base de datos en formato diccionario.
         :param semantic_map: Mapa semántico en formato diccionario.
+        :param limit_sql: Si se indica, se pide también el SQL en la misma respuesta (modo combinado),
+                          limitado a este número de registros.
+        :param ejemplos: Preguntas parecidas ya resueltas; si hay, reemplazan a los ejemplos genéricos de SQL.
         :return: Prompt completo en forma de cadena de texto.
         """
+        if self.schema_retriever is None:
+            contexto = (
+                "Esquema de la base de datos (en formato JSON):\n"
+                f"{json.dumps(schema, indent=2)}\n\n"
+                "Mapa semántico (en formato JSON):\n"
+                f"{json.dumps(semantic_map, indent=2)}\n\n"
+            )
+        else:
+            contexto = (
+                "Esquema de la base de datos (solo las tablas relevantes; una línea por tabla con sus columnas y tipos, "
+                "PK indica la llave primaria y entre comillas va el nombre legible cuando difiere del técnico):\n"
+                f"{self.schema_retriever.contexto_compacto(consulta, schema, semantic_map)}\n\n"
+            )
+
         prompt = (
         "Eres un asistente experto en bases de datos de detección de objetos (vehículos). "
         "La base de datos que analizas registra detecciones de vehículos y sus atributos. "
@@ -84,40 +195,10 @@ class UserQueryAgent:
         "- Usar valores de marca de tiempo en milisegundos\n"
         "- Limitar los resultados a {self.limit} registros\n"
         "- Para consultas complejas con varias columnas de valores, hacer agregaciones y agrupar según sea necesario\n\n"
-        "Ejemplos:\n"
-        "-> Cantidad de detecciones por cámara:\n"
-        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, \n"
-        "       attribute_id,\n"
-        "       count(attribute_id) \n"
-        "FROM detections\n"
-        "GROUP BY 1, 2;\n\n"
-        "-> Cantidad de detecciones por cámara en un determinado período de tiempo:\n"
-        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, \n"
-        "       attribute_id,\n"
-        "       count(attribute_id) \n"
-        "FROM detections\n"
-        "WHERE init_time BETWEEN UNIX_TIMESTAMP('2025-02-27 00:00:00') * 1000 \n"
-        "                   AND UNIX_TIMESTAMP('2025-02-27 23:59:59') * 1000\n"
-        "GROUP BY 1, 2;\n\n"
-        "-> Colores disponibles en la base de datos:\n"
-        "SELECT DISTINCT description\n"
-        "FROM tabla\n"
-        "WHERE attribute_id = 2\n"
-        "  AND init_time BETWEEN UNIX_TIMESTAMP('2025-03-05 00:00:00') * 1000 \n"
-        "                   AND UNIX_TIMESTAMP('2025-03-05 23:59:59') * 1000;\n\n"
-        "-> Cantidad total por colores detectados:\n"
-        "SELECT description, COUNT(*) AS cantidad_detecciones\n"
-        "FROM detections\n"
-        "WHERE attribute_id = 2\n"
-        "  AND init_time BETWEEN UNIX_TIMESTAMP('2025-03-05 00:00:00') * 1000 \n"
-        "                   AND UNIX_TIMESTAMP('2025-03-05 23:59:59') * 1000\n"
-        "GROUP BY description;\n\n"
+        f"{self._ejemplos_prompt(ejemplos)}"
         "Con estos datos, puedes crear las consultas SQL de acuerdo a lo que se te pida.\n\n"
         "A continuación, se te proporciona el esquema de la base de datos y un mapa semántico que traduce nombres técnicos a nombres legibles:\n\n"
-        "Esquema de la base de datos (en formato JSON):\n"
-        f"{json.dumps(schema, indent=2)}\n\n"
-        "Mapa semántico (en formato JSON):\n"
-        f"{json.dumps(semantic_map, indent=2)}\n\n"
+        f"{contexto}"
         "Interpreta la siguiente consulta en lenguaje natural y genera una estructura de consulta en formato JSON. "
         "La estructura debe incluir los siguientes campos:\n"
         "- 'accion': La acción a realizar (por ejemplo, 'contar', 'listar', 'promedio').\n"
@@ -127,24 +208,111 @@ class UserQueryAgent:
         "Además, si la consulta en lenguaje natural implica comparar datos (por ejemplo, comparar ventas o métricas entre dos períodos), "
         "devuelve un arreglo JSON en el que cada elemento siga la estructura mostrada anteriormente.\n\n"
         f"Consulta: {consulta}\n\n"
-        "Estructura JSON:"
+        f"{self._cierre_prompt(limit_sql)}"
     )
+        if self.schema_retriever is not None:
+            self.ultimo_conteo_tokens = self.schema_retriever.registrar_ahorro(prompt, contexto, schema, semantic_map)
         return prompt
 
-    def _obtener_respuesta_llm(self, prompt):
+    @staticmethod
+    def _ejemplos_prompt(ejemplos):
+        """
+        Sección de ejemplos del prompt: las preguntas parecidas ya resueltas (más cortas y más útiles) o,
+        si no hay, los ejemplos genéricos de SQL.
+        """
+        if ejemplos:
+            texto = "Ejemplos de preguntas parecidas ya resueltas en esta base de datos:\n"
+            for ejemplo in ejemplos:
+                texto += (
+                    f"-> Pregunta: {ejemplo['pregunta']}\n"
+                    f"Estructura JSON: {json.dumps(ejemplo['estructura'], ensure_ascii=False)}\n"
+                    f"SQL: {ejemplo['sql']}\n\n"
+                )
+            return texto
+        return (
+            "Ejemplos:\n"
+            "-> Cantidad de detecciones por cámara:\n"
+            "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, \n"
+            "       attribute_id,\n"
+            "       count(attribute_id) \n"
+            "FROM detections\n"
+            "GROUP BY 1, 2;\n\n"
+            "-> Cantidad de detecciones por cámara en un determinado período de tiempo:\n"
+            "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS Camara_Id, \n"
+            "       attribute_id,\n"
+            "       count(attribute_id) \n"
+            "FROM detections\n"
+            "WHERE init_time BETWEEN UNIX_TIMESTAMP('2025-02-27 00:00:00') * 1000 \n"
+            "                   AND UNIX_TIMESTAMP('2025-02-27 23:59:59') * 1000\n"
+            "GROUP BY 1, 2;\n\n"
+            "-> Colores disponibles en la base de datos:\n"
+            "SELECT DISTINCT description\n"
+            "FROM tabla\n"
+            "WHERE attribute_id = 2\n"
+            "  AND init_time BETWEEN UNIX_TIMESTAMP('2025-03-05 00:00:00') * 1000 \n"
+            "                   AND UNIX_TIMESTAMP('2025-03-05 23:59:59') * 1000;\n\n"
+            "-> Cantidad total por colores detectados:\n"
+            "SELECT description, COUNT(*) AS cantidad_detecciones\n"
+            "FROM detections\n"
+            "WHERE attribute_id = 2\n"
+            "  AND init_time BETWEEN UNIX_TIMESTAMP('2025-03-05 00:00:00') * 1000 \n"
+            "                   AND UNIX_TIMESTAMP('2025-03-05 23:59:59') * 1000\n"
+            "GROUP BY description;\n\n"
+        )
+
+    def _cierre_prompt(self, limit_sql):
+        if limit_sql is None:
+            return "Estructura JSON:"
+        ahora = datetime.datetime.now()
+        return (
+            "En la misma respuesta genera también la consulta SQL (MySQL) de cada estructura, siguiendo las reglas y "
+            "ejemplos anteriores. Convierte las fechas a marcas de tiempo en milisegundos con "
+            "UNIX_TIMESTAMP('aaaa-mm-dd hh:mm:ss') * 1000; la fecha de hoy es "
+            f"{ahora:%Y-%m-%d} ({ahora:%A}). Limita los resultados a {limit_sql} registros.\n"
+            "Responde solo con un objeto JSON de la forma "
+            "{\"estructura\": <estructura o arreglo de estructuras>, "
+            "\"sql\": <consulta SQL, o arreglo de consultas en el mismo orden que las estructuras>}.\n\n"
+            "Respuesta JSON:"
+        )
+
+    def _obtener_respuesta_llm(self, prompt, max_tokens=150):
         """
         Utiliza el modelo de lenguaje (por ejemplo, OpenAI GPT) para obtener una respuesta a partir del prompt.
         
         :param prompt: El prompt a enviar al modelo.
+        :param max_tokens: Máximo de tokens de la respuesta.
         :return: La respuesta generada por el LLM en formato de texto.
         """
-        import openai
+        from llm_client import chat_completion
+        try:
+            response = chat_completion(
+                caller="UserQueryAgent",
+                api_key=self.llm_api_key,
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.temperature,
+                max_tokens=max_tokens
+            )
+            respuesta = response['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            self.logger.error("Error al obtener respuesta del LLM: %s", e)
+            respuesta = "{}"  # Retornamos un JSON vacío en caso de error.
+        
+        return respuesta
+
+    async def _obtener_respuesta_llm_async(self, prompt, max_tokens=150):
+        """
+        Versión asíncrona de _obtener_respuesta_llm.
+        """
+        from llm_client import chat_completion_async
         try:
-            response = openai.ChatCompletion.create(
+            response = await chat_completion_async(
+                caller="UserQueryAgent",
+                api_key=self.llm_api_key,
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=self.temperature,
-                max_tokens=150
+                max_tokens=max_tokens
             )
             respuesta = response['choices'][0]['message']['content'].strip()
         except Exception as e:
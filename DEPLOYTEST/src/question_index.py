@@ -0,0 +1,268 @@
+# question_index.py
+
+import collections
+import datetime
+import json
+import logging
+import math
+import re
+import threading
+
+from intent_templates import COLORES
+from text_utils import normalizar_pregunta
+
+
+_FECHA_RE = re.compile(r"\b(hoy|ayer|today|yesterday|\d{1,2}[/-]\d{1,2}[/-]\d{4})\b")
+
+# Palabras que no cambian el resultado; todas las demás deben coincidir para reutilizar el SQL
+_PALABRAS_VACIAS = {
+    "a", "al", "de", "del", "el", "en", "la", "las", "lo", "los", "que", "se", "un", "una", "y",
+    "hay", "sus", "su", "es", "son", "fue", "ha", "han", "hubo", "sido", "fecha", "the", "of", "in",
+    "detectado", "detectada", "detectaron", "registrado", "registrada", "registraron", "visto", "vista",
+}
+
+# Sinónimos (en singular) que se comparan como una misma palabra
+_SINONIMOS = {
+    "cuanto": "<conteo>", "cuanta": "<conteo>", "cantidad": "<conteo>", "numero": "<conteo>",
+    "vehiculo": "<vehiculo>", "auto": "<vehiculo>", "carro": "<vehiculo>", "coche": "<vehiculo>",
+    "deteccion": "<vehiculo>",
+}
+
+
+def _ngramas(texto, minimo, maximo):
+    conteo = collections.Counter()
+    for palabra in texto.split():
+        palabra = f" {palabra} "
+        for n in range(minimo, maximo + 1):
+            for i in range(len(palabra) - n + 1):
+                conteo[palabra[i:i + n]] += 1
+    return conteo
+
+
+def _dia(ms):
+    return datetime.datetime.fromtimestamp(ms / 1000)
+
+
+class QuestionIndex:
+    """
+    Índice local de preguntas ya resueltas (pregunta -> estructura_consulta -> SQL), registradas solo
+    cuando su SQL se ejecutó sin error.
+
+    La similitud es el coseno entre vectores TF-IDF de n-gramas de caracteres de la pregunta normalizada
+    (minúsculas, sin tildes ni puntuación, con las referencias de fecha reemplazadas por una marca), por lo
+    que "cuántos carros rojos hoy" y "cantidad de vehículos rojos detectados hoy" quedan cerca sin
+    servicios externos.
+
+    - Misma firma (las mismas palabras, sin contar palabras vacías, plurales ni sinónimos; ver _firma): se
+      reutiliza el SQL guardado, actualizando sus fechas a las de la nueva pregunta, sin importar la
+      similitud. Así "cuántos carros rojos hoy" reutiliza el SQL de "cantidad de vehículos rojos detectados
+      ayer", pero "por hora" no reutiliza el de "por cámara".
+    - Similitud >= umbral_ejemplos: las preguntas más parecidas se entregan como ejemplos (few-shot)
+      para el prompt de interpretación.
+    """
+
+    def __init__(self, parse_date_reference=None, umbral_ejemplos=0.45, max_ejemplos=2, max_entradas=2000,
+                 ngramas=(3, 5)):
+        """
+        :param parse_date_reference: Función que convierte 'hoy', 'ayer' o 'dd-mm-aaaa' en (inicio_ms, fin_ms).
+        :param umbral_ejemplos: Similitud mínima para usar una pregunta como ejemplo.
+        :param max_ejemplos: Máximo de ejemplos entregados.
+        :param max_entradas: Máximo de preguntas guardadas (se descartan las más antiguas).
+        :param ngramas: Tamaños mínimo y máximo de los n-gramas de caracteres.
+        """
+        self.parse_date_reference = parse_date_reference
+        self.umbral_ejemplos = umbral_ejemplos
+        self.max_ejemplos = max_ejemplos
+        self.max_entradas = max_entradas
+        self.ngramas = ngramas
+        self._entradas = collections.OrderedDict()
+        # Firma -> llave de la última pregunta registrada con esa firma
+        self._por_firma = {}
+        self._idf = {}
+        self._vectores = {}
+        self._sucio = False
+        self._lock = threading.Lock()
+        self._contadores = {"queries": 0, "reused": 0, "few_shot": 0, "misses": 0, "rejected_dates": 0, "stored": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def registrar(self, pregunta, estructura, sql):
+        """
+        Guarda una pregunta cuyo SQL se ejecutó correctamente. Solo se guardan las consultas de una estructura.
+        """
+        if not isinstance(estructura, dict) or not isinstance(sql, str) or not sql.strip():
+            return
+        texto, referencia = self._normalizar(pregunta)
+        entrada = {
+            "pregunta": pregunta,
+            "estructura": estructura,
+            "sql": sql,
+            "referencia": referencia,
+            "rango": self._rango(referencia),
+            "firma": self._firma(texto, referencia),
+        }
+        with self._lock:
+            self._entradas.pop(texto, None)
+            self._entradas[texto] = entrada
+            if entrada["firma"]:
+                self._por_firma[frozenset(entrada["firma"])] = texto
+            while len(self._entradas) > self.max_entradas:
+                llave, antigua = self._entradas.popitem(last=False)
+                if self._por_firma.get(frozenset(antigua["firma"])) == llave:
+                    del self._por_firma[frozenset(antigua["firma"])]
+            self._contadores["stored"] += 1
+            self._sucio = True
+
+    def buscar(self, pregunta, k=None):
+        """
+        :return: Lista de tuplas (similitud, entrada) ordenadas de mayor a menor similitud.
+        """
+        texto, _ = self._normalizar(pregunta)
+        with self._lock:
+            if self._sucio:
+                self._reconstruir()
+            consulta = self._vectorizar(_ngramas(texto, *self.ngramas))
+            puntajes = []
+            for llave, vector in self._vectores.items():
+                similitud = sum(peso * vector.get(ngrama, 0.0) for ngrama, peso in consulta.items())
+                if similitud > 0:
+                    puntajes.append((similitud, self._entradas[llave]))
+        puntajes.sort(key=lambda x: x[0], reverse=True)
+        return puntajes[:k] if k else puntajes
+
+    def resolver(self, pregunta):
+        """
+        Busca preguntas parecidas ya resueltas.
+
+        :return: Tupla (reuso, ejemplos): reuso es (estructura, sql) con las fechas actualizadas o None;
+                 ejemplos es una lista de diccionarios {"pregunta", "estructura", "sql"} (vacía si no hay).
+        """
+        texto, referencia = self._normalizar(pregunta)
+        firma = frozenset(self._firma(texto, referencia))
+        with self._lock:
+            self._contadores["queries"] += 1
+            llave = self._por_firma.get(firma) if firma else None
+            entrada = self._entradas.get(llave) if llave is not None else None
+
+        if entrada is not None:
+            reuso = self._adaptar(entrada, texto, referencia)
+            if reuso is not None:
+                with self._lock:
+                    self._contadores["reused"] += 1
+                self.logger.info("Pregunta resuelta con el SQL de '%s' (misma firma).", entrada["pregunta"])
+                return reuso, []
+            with self._lock:
+                self._contadores["rejected_dates"] += 1
+
+        candidatas = self.buscar(pregunta, k=max(self.max_ejemplos, 1))
+        ejemplos = [
+            {"pregunta": e["pregunta"], "estructura": e["estructura"], "sql": e["sql"]}
+            for similitud, e in candidatas[: self.max_ejemplos] if similitud >= self.umbral_ejemplos
+        ]
+        with self._lock:
+            self._contadores["few_shot" if ejemplos else "misses"] += 1
+        return None, ejemplos
+
+    def stats(self):
+        """
+        Retorna las métricas del índice: preguntas, reutilizaciones, respuestas con ejemplos y entradas guardadas.
+        """
+        with self._lock:
+            contadores = dict(self._contadores)
+            contadores["entries"] = len(self._entradas)
+        consultas = contadores["queries"]
+        contadores["reuse_rate"] = round(contadores["reused"] / consultas, 4) if consultas else 0.0
+        return contadores
+
+    def _normalizar(self, pregunta):
+        texto = normalizar_pregunta(pregunta)
+        coincidencia = _FECHA_RE.search(texto)
+        referencia = coincidencia.group(1) if coincidencia else None
+        return _FECHA_RE.sub("fecha", texto), referencia
+
+    def _rango(self, referencia):
+        if referencia is None or self.parse_date_reference is None:
+            return None
+        try:
+            return self.parse_date_reference(referencia)
+        except Exception as e:
+            self.logger.warning("No se pudo interpretar la fecha '%s': %s", referencia, e)
+            return None
+
+    @staticmethod
+    def _firma(texto, referencia):
+        """
+        Palabras de la pregunta que cambian el resultado: todas menos las vacías, en singular, con los
+        colores y los sinónimos llevados a una misma forma. Las palabras con dígitos se conservan tal cual.
+        """
+        firma = set()
+        for palabra in texto.split():
+            raiz = palabra
+            if len(palabra) > 4 and not any(c.isdigit() for c in palabra):
+                raiz = re.sub(r"(?:e?s)$", "", palabra)
+            if palabra in COLORES or raiz in COLORES:
+                firma.add(COLORES.get(palabra) or COLORES[raiz])
+            elif palabra in _SINONIMOS or raiz in _SINONIMOS:
+                firma.add(_SINONIMOS.get(palabra) or _SINONIMOS[raiz])
+            elif palabra not in _PALABRAS_VACIAS and raiz not in _PALABRAS_VACIAS:
+                firma.add(raiz)
+        if referencia is not None:
+            firma.add("<fecha>")
+        return firma
+
+    def _adaptar(self, entrada, texto, referencia):
+        """
+        Adapta la entrada a la nueva pregunta: exige las mismas palabras (ver _firma) y reemplaza las fechas de la
+        pregunta original por las de la nueva (en milisegundos, 'aaaa-mm-dd' y 'dd-mm-aaaa').
+
+        :return: Tupla (estructura, sql), o None si no se puede reutilizar con seguridad.
+        """
+        if self._firma(texto, referencia) != entrada["firma"]:
+            return None
+        estructura_json = json.dumps(entrada["estructura"], ensure_ascii=False)
+        sql = entrada["sql"]
+        if referencia is None or referencia == entrada["referencia"] and entrada["rango"] is None:
+            return json.loads(estructura_json), sql
+
+        rango_nuevo = self._rango(referencia)
+        rango_viejo = entrada["rango"]
+        if rango_nuevo is None or rango_viejo is None:
+            return None
+        if rango_nuevo == rango_viejo:
+            return json.loads(estructura_json), sql
+
+        reemplazos = [(str(viejo), str(nuevo)) for viejo, nuevo in zip(rango_viejo, rango_nuevo)]
+        dia_viejo, dia_nuevo = _dia(rango_viejo[0]), _dia(rango_nuevo[0])
+        for formato in ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y"):
+            reemplazos.append((dia_viejo.strftime(formato), dia_nuevo.strftime(formato)))
+        if entrada["referencia"]:
+            reemplazos.append((entrada["referencia"], referencia))
+
+        encontrado = False
+        for viejo, nuevo in reemplazos:
+            patron = re.compile(rf"(?<![\w-]){re.escape(viejo)}(?![\w-])")
+            if patron.search(sql):
+                encontrado = True
+                sql = patron.sub(nuevo, sql)
+            estructura_json = patron.sub(nuevo, estructura_json)
+        if not encontrado:
+            # El SQL no trae la fecha de forma reconocible (p. ej. CURDATE()); solo es seguro si es la misma referencia
+            if referencia != entrada["referencia"]:
+                return None
+        return json.loads(estructura_json), sql
+
+    def _reconstruir(self):
+        documentos = {llave: _ngramas(llave, *self.ngramas) for llave in self._entradas}
+        frecuencias = collections.Counter()
+        for conteo in documentos.values():
+            frecuencias.update(conteo.keys())
+        total = len(documentos)
+        self._idf = {ngrama: math.log((1 + total) / (1 + df)) + 1 for ngrama, df in frecuencias.items()}
+        self._vectores = {llave: self._vectorizar(conteo) for llave, conteo in documentos.items()}
+        self._sucio = False
+
+    def _vectorizar(self, conteo):
+        # N-gramas desconocidos pesan como los más raros del índice
+        idf_maximo = max(self._idf.values(), default=1.0)
+        vector = {ngrama: (1 + math.log(tf)) * self._idf.get(ngrama, idf_maximo) for ngrama, tf in conteo.items()}
+        norma = math.sqrt(sum(p * p for p in vector.values())) or 1.0
+        return {ngrama: p / norma for ngrama, p in vector.items()}
@@ -1,4 +1,43 @@
-import openai
+import asyncio
+import numbers
+import re
+
+from llm_client import chat_completion, chat_completion_async
+
+# Partes de una respuesta planificada: texto que debe reformular GPT o texto final.
+PARTE_GPT = "gpt"
+PARTE_TEXTO = "texto"
+
+SYSTEM_PROMPT = (
+    "Eres un asistente amigable y útil que explica información de bases de datos en términos sencillos "
+    "para personas sin conocimientos técnicos. Para consultas comparativas, ofrece análisis detallado de "
+    "las diferencias, proporciones y tendencias."
+)
+
+
+def formatear_numero(valor):
+    """
+    Formatea un número para el texto de la respuesta: separador de miles '.' para enteros
+    y hasta dos decimales (con coma) para el resto.
+    """
+    if isinstance(valor, bool) or valor is None:
+        return str(valor)
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return str(valor)
+    if numero.is_integer():
+        return f"{int(numero):,}".replace(",", ".")
+    return f"{numero:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def _emoji_para(texto):
+    """
+    Emoji de las categorías de un resumen: 🚗 si el texto (resultados, estructura o categorías) menciona
+    autos o vehículos, 📊 en otro caso.
+    """
+    texto = str(texto).lower()
+    return "🚗" if "car" in texto or "vehic" in texto else "📊"
 
 class ResponseFormatter:
     """
@@ -12,12 +51,18 @@ class ResponseFormatter:
         
         :param api_key: Clave de API para usar OpenAI.
         """
-        openai.api_key = api_key
+        self.api_key = api_key
         # Almacenar resultados de consultas para combinar comparativas
         self.cache_resultados = []
         self.cache_estructura = []
         self.cache_sql = []
 
+    def _mensajes_gpt(self, prompt):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
     def _generar_respuesta_con_gpt(self, prompt):
         """
         Envía un prompt a OpenAI para obtener una respuesta en lenguaje natural.
@@ -26,18 +71,104 @@ class ResponseFormatter:
         :return: Respuesta generada por GPT.
         """
         try:
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
+                caller="ResponseFormatter",
+                api_key=self.api_key,
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Eres un asistente amigable y útil que explica información de bases de datos en términos sencillos para personas sin conocimientos técnicos. Para consultas comparativas, ofrece análisis detallado de las diferencias, proporciones y tendencias."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._mensajes_gpt(prompt),
                 temperature=0.2,
             )
             return response["choices"][0]["message"]["content"].strip()
         except Exception as e:
             return f"Error al generar respuesta con GPT: {str(e)}"
 
+    async def _generar_respuesta_con_gpt_async(self, prompt):
+        """
+        Versión asíncrona de _generar_respuesta_con_gpt (HTTP asíncrono, no bloquea el event loop).
+        """
+        try:
+            response = await chat_completion_async(
+                caller="ResponseFormatter",
+                api_key=self.api_key,
+                model="gpt-3.5-turbo",
+                messages=self._mensajes_gpt(prompt),
+                temperature=0.2,
+            )
+            return response["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            return f"Error al generar respuesta con GPT: {str(e)}"
+
+    def _generar_respuesta_con_gpt_stream(self, prompt):
+        """
+        Versión en streaming de _generar_respuesta_con_gpt: genera los fragmentos de texto a medida
+        que llegan (stream=True), de modo que la interfaz puede mostrarlos desde el primer token.
+
+        :param prompt: Texto a enviar como prompt.
+        :return: Generador de fragmentos de texto.
+        """
+        try:
+            response = chat_completion(
+                caller="ResponseFormatter",
+                api_key=self.api_key,
+                model="gpt-3.5-turbo",
+                messages=self._mensajes_gpt(prompt),
+                temperature=0.2,
+                stream=True,
+            )
+            inicio = True
+            for chunk in response:
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                if inicio:
+                    # Igual que strip() en la versión sin streaming
+                    delta = delta.lstrip()
+                    inicio = not delta
+                if delta:
+                    yield delta
+        except Exception as e:
+            yield f"Error al generar respuesta con GPT: {str(e)}"
+
+    def resolver_parte(self, parte):
+        """
+        Convierte una parte planificada en texto final (llamando a GPT si corresponde).
+        """
+        tipo, contenido = parte
+        if tipo == PARTE_GPT:
+            return self._generar_respuesta_con_gpt(contenido)
+        return contenido
+
+    def resolver_parte_stream(self, parte):
+        """
+        Versión en streaming de resolver_parte: genera fragmentos de texto.
+        """
+        tipo, contenido = parte
+        if tipo == PARTE_GPT:
+            yield from self._generar_respuesta_con_gpt_stream(contenido)
+        else:
+            yield contenido
+
+    def parte_sin_gpt(self, parte):
+        """
+        Convierte una parte PARTE_GPT en texto final sin llamar a GPT (por ejemplo, al agotar el presupuesto
+        de tokens): conserva el texto armado localmente y quita la consulta SQL y las instrucciones para GPT.
+        """
+        tipo, contenido = parte
+        if tipo != PARTE_GPT:
+            return parte
+        texto = re.sub(r"^La consulta SQL usada fue: '.*?'\.\n", "", contenido, flags=re.S)
+        texto = texto.split("\n\nPor favor")[0]
+        return (PARTE_TEXTO, texto.replace("Aquí están los datos obtenidos:", "Estos son los datos obtenidos:").strip())
+
+    async def resolver_parte_async(self, parte):
+        """
+        Versión asíncrona de resolver_parte.
+        """
+        tipo, contenido = parte
+        if tipo == PARTE_GPT:
+            return await self._generar_respuesta_con_gpt_async(contenido)
+        return contenido
+
     def detectar_consulta_comparativa(self, estructura_consulta, consulta_sql):
         """
         Detecta si una consulta es parte de una serie comparativa.
@@ -56,15 +187,51 @@ class ResponseFormatter:
                         return True
         return False
 
-    def formatear_respuesta(self, resultados, estructura_consulta=None, consulta_sql=None):
+    def formatear_respuesta(self, resultados, estructura_consulta=None, consulta_sql=None, rapido=False):
         """
         Recibe los resultados obtenidos y genera una respuesta legible en lenguaje natural usando GPT.
         Detecta consultas comparativas y las combina apropiadamente.
+
+        :param rapido: Si es True, los conteos y resultados agrupados se responden con el resumen armado
+                       localmente, sin llamar a GPT (los listados siguen pasando por GPT).
+        """
+        partes = self.planificar_respuesta(resultados, estructura_consulta, consulta_sql, rapido=rapido)
+        return "\n\n".join(self.resolver_parte(parte) for parte in partes)
+
+    async def formatear_respuesta_async(self, resultados, estructura_consulta=None, consulta_sql=None, rapido=False):
+        """
+        Versión asíncrona de formatear_respuesta. Las llamadas a GPT de una misma respuesta se hacen en paralelo.
+        """
+        partes = self.planificar_respuesta(resultados, estructura_consulta, consulta_sql, rapido=rapido)
+        textos = await asyncio.gather(*(self.resolver_parte_async(parte) for parte in partes))
+        return "\n\n".join(textos)
+
+    def formatear_respuesta_stream(self, resultados, estructura_consulta=None, consulta_sql=None, rapido=False):
+        """
+        Versión en streaming de formatear_respuesta: genera los fragmentos de la respuesta a medida que
+        GPT los produce, con el mismo separador entre partes.
+        """
+        partes = self.planificar_respuesta(resultados, estructura_consulta, consulta_sql, rapido=rapido)
+        for idx, parte in enumerate(partes):
+            if idx:
+                yield "\n\n"
+            yield from self.resolver_parte_stream(parte)
+
+    def planificar_respuesta(self, resultados, estructura_consulta=None, consulta_sql=None, rapido=False):
+        """
+        Decide cómo responder sin llamar todavía a GPT.
+
+        :param rapido: Si es True, los conteos, agrupados y comparativas quedan como texto final (PARTE_TEXTO).
+        :return: Lista de partes (PARTE_GPT, prompt) o (PARTE_TEXTO, texto) que forman la respuesta.
         """
         # Manejar el caso de resultados múltiples (lista)
         if isinstance(resultados, list):
             # Combinamos los resultados y generamos una única respuesta
-            return self._formatear_resultados_multiples(resultados, estructura_consulta, consulta_sql)
+            return self._preparar_resultados_multiples(resultados, estructura_consulta, consulta_sql, rapido)
+
+        # Una consulta rechazada no se combina con otras
+        if resultados and resultados.get("rechazo"):
+            return [self._preparar_resultado_individual(resultados, estructura_consulta, consulta_sql, rapido)]
 
         # Si la consulta es potencialmente parte de una serie comparativa
         es_comparativa = self.detectar_consulta_comparativa(estructura_consulta, consulta_sql)
@@ -78,7 +245,7 @@ class ResponseFormatter:
             # Si tenemos varias consultas comparativas acumuladas
             if len(self.cache_resultados) >= 2:
                 # Combinar los resultados para análisis comparativo
-                return self._formatear_resultados_comparativos()
+                return [self._preparar_resultados_comparativos(rapido)]
         else:
             # Si no es comparativa, limpiar caché
             self.cache_resultados = []
@@ -86,29 +253,77 @@ class ResponseFormatter:
             self.cache_sql = []
 
         # Si la consulta SQL ya está optimizada para comparación (GROUP BY)
-        if "description" in resultados.get("columns", []) and "count" in resultados.get("columns", []):
-            return self._formatear_resultados_agrupados(resultados)
+        if resultados and "description" in resultados.get("columns", []) and "count" in resultados.get("columns", []):
+            return [self._preparar_resultados_agrupados(resultados, rapido)]
 
         # Procesamiento normal para consultas individuales
-        return self._formatear_resultado_individual(resultados, estructura_consulta, consulta_sql)
+        return [self._preparar_resultado_individual(resultados, estructura_consulta, consulta_sql, rapido)]
+
+    def _resumen_categorias(self, titulo, conteos, emoji):
+        """
+        Resumen local de conteos por categoría, de mayor a menor, con porcentajes y total.
+
+        :param conteos: Lista de tuplas (categoria, cantidad).
+        :return: Texto del resumen.
+        """
+        conteos = sorted(conteos, key=lambda x: x[1] or 0, reverse=True)
+        total = sum(valor or 0 for _, valor in conteos)
+        mensaje = f"{titulo}:\n\n"
+        for categoria, valor in conteos:
+            porcentaje = round(((valor or 0) / total) * 100, 2) if total else 0
+            mensaje += f"{emoji} {str(categoria).capitalize()}: {formatear_numero(valor)} ({porcentaje}%)\n"
+        mensaje += f"\nEn total se contabilizaron {formatear_numero(total)} elementos."
+        if len(conteos) > 1 and total:
+            mayor, valor_mayor = conteos[0]
+            mensaje += (
+                f" La categoría más frecuente es {str(mayor).capitalize()}, "
+                f"con el {round((valor_mayor or 0) / total * 100, 2)}% del total."
+            )
+        return mensaje
+
+    def _mensaje_rechazo(self, rechazo):
+        """
+        Texto para el usuario de una consulta rechazada por la guardia de SQL.
 
-    def _formatear_resultado_individual(self, resultados, estructura_consulta=None, consulta_sql=None):
+        :param rechazo: Diccionario con "motivo" y "sugerencia" (ver SQLGuard).
         """
-        Formatea un único resultado a lenguaje natural.
+        mensaje = f"⚠️ No ejecuté la consulta porque {rechazo.get('motivo', 'superaba los límites permitidos')}."
+        if rechazo.get("sugerencia"):
+            mensaje += f"\n\n{rechazo['sugerencia']}"
+        return mensaje
+
+    def _preparar_resultado_individual(self, resultados, estructura_consulta=None, consulta_sql=None, rapido=False):
+        """
+        Prepara la respuesta de un único resultado.
+
+        :return: Parte (PARTE_GPT, prompt) o (PARTE_TEXTO, texto).
         """
+        # Si la guardia de SQL no permitió ejecutar la consulta
+        if resultados and resultados.get("rechazo"):
+            return (PARTE_TEXTO, self._mensaje_rechazo(resultados["rechazo"]))
+
         # Si los resultados son inválidos
         if not resultados or "columns" not in resultados or "data" not in resultados:
-            return "No se encontraron resultados o hubo un problema con la consulta."
+            return (PARTE_TEXTO, "No se encontraron resultados o hubo un problema con la consulta.")
 
         # Si es una consulta de conteo
         accion = estructura_consulta.get("accion", "").lower() if isinstance(estructura_consulta, dict) else ""
 
         if accion == "contar":
-            valor = resultados["data"][0][0]
-            mensaje = f"La consulta SQL usada fue: '{consulta_sql}'.\n"
-            mensaje += f"En resumen, tenemos un total de {valor} registros que coinciden con tu búsqueda."
-            mensaje += "\n\n¿Hay algo más en lo que pueda ayudarte? 😊"
-            return self._generar_respuesta_con_gpt(mensaje)
+            if not resultados["data"]:
+                return (PARTE_TEXTO, "No se encontraron registros que coincidan con tu búsqueda.")
+            if len(resultados["columns"]) == 1:
+                valor = resultados["data"][0][0]
+                if rapido:
+                    return (PARTE_TEXTO, f"En total hay {formatear_numero(valor)} registros que coinciden con tu búsqueda.")
+                mensaje = f"La consulta SQL usada fue: '{consulta_sql}'.\n"
+                mensaje += f"En resumen, tenemos un total de {valor} registros que coinciden con tu búsqueda."
+                mensaje += "\n\n¿Hay algo más en lo que pueda ayudarte? 😊"
+                return (PARTE_GPT, mensaje)
+            # Conteo agrupado (p. ej. por color o por cámara): una fila por categoría con la cantidad al final.
+            # Si la última columna no es una cantidad, se muestra como tabla.
+            if all(isinstance(fila[-1], numbers.Number) for fila in resultados["data"]):
+                return self._preparar_resultados_agrupados(resultados, rapido)
 
         # Generar tabla si es una consulta de lista
         columnas = resultados["columns"]
@@ -135,35 +350,43 @@ class ResponseFormatter:
             f"como si estuvieras explicándolo a un amigo. Hazlo en un tono accesible y amigable."
         )
 
-        return self._generar_respuesta_con_gpt(prompt)
+        return (PARTE_GPT, prompt)
 
-    def _formatear_resultados_agrupados(self, resultados):
+    def _preparar_resultados_agrupados(self, resultados, rapido=False):
         """
-        Formatea resultados de una consulta agrupada (ej: GROUP BY color).
+        Prepara la respuesta de una consulta agrupada (ej: GROUP BY color).
+
+        Si el resultado trae las columnas 'description' y 'count' se usan esas; si no, la última columna es
+        la cantidad y las demás forman la categoría (p. ej. 'CAM01 / 2' para Camara_Id, attribute_id, cantidad).
         """
-        idx_desc = resultados["columns"].index("description")
-        idx_count = resultados["columns"].index("count")
-        
-        conteos = {row[idx_desc]: row[idx_count] for row in resultados["data"]}
-        total = sum(conteos.values())
+        columnas = list(resultados["columns"])
+        if "description" in columnas and "count" in columnas:
+            idx_desc, idx_count = columnas.index("description"), columnas.index("count")
+            conteos = {row[idx_desc]: row[idx_count] for row in resultados["data"]}
+        else:
+            conteos = {" / ".join(str(v) for v in row[:-1]): row[-1] for row in resultados["data"]}
+        if rapido:
+            emoji = _emoji_para(resultados)
+            return (PARTE_TEXTO, self._resumen_categorias("Comparación de elementos por categoría", list(conteos.items()), emoji))
+        total = sum(count or 0 for count in conteos.values())
 
         # Construir una comparación en lenguaje natural
         mensaje = "Aquí tienes la comparación de elementos por categoría:\n\n"
         
         # Ordenar de mayor a menor
-        conteos_ordenados = sorted(conteos.items(), key=lambda x: x[1], reverse=True)
+        conteos_ordenados = sorted(conteos.items(), key=lambda x: x[1] or 0, reverse=True)
         
         for categoria, count in conteos_ordenados:
-            porcentaje = round((count/total)*100, 2)
-            emoji = "🚗" if "car" in str(resultados).lower() or "vehic" in str(resultados).lower() else "📊"
-            mensaje += f"{emoji} {categoria.capitalize()}: {count} ({porcentaje}%)\n"
+            porcentaje = round(((count or 0)/total)*100, 2) if total else 0
+            emoji = _emoji_para(resultados)
+            mensaje += f"{emoji} {str(categoria).capitalize()}: {count} ({porcentaje}%)\n"
         
         mensaje += f"\nEn total se contabilizaron {total} elementos en la base de datos."
         mensaje += "\n\nPor favor, analiza estos datos comparativamente, destacando patrones, proporciones y posibles conclusiones."
 
-        return self._generar_respuesta_con_gpt(mensaje)
+        return (PARTE_GPT, mensaje)
 
-    def _formatear_resultados_comparativos(self):
+    def _preparar_resultados_comparativos(self, rapido=False):
         """
         Combina varias consultas de conteo en un análisis comparativo.
         """
@@ -190,6 +413,9 @@ class ResponseFormatter:
         self.cache_sql = []
         
         # Si tenemos datos comparativos
+        if datos_comparativos and rapido:
+            emoji = _emoji_para(" ".join(str(cat) for cat, _ in datos_comparativos))
+            return (PARTE_TEXTO, self._resumen_categorias("Análisis comparativo de categorías", datos_comparativos, emoji))
         if datos_comparativos:
             total = sum(valor for _, valor in datos_comparativos)
             
@@ -200,27 +426,28 @@ class ResponseFormatter:
             
             for categoria, valor in datos_comparativos:
                 porcentaje = round((valor/total)*100, 2)
-                emoji = "🚗" if any("car" in cat.lower() or "vehic" in cat.lower() for cat, _ in datos_comparativos) else "📊"
+                emoji = _emoji_para(" ".join(str(cat) for cat, _ in datos_comparativos))
                 mensaje += f"{emoji} {categoria.capitalize()}: {valor} ({porcentaje}%)\n"
             
             mensaje += f"\nEn total se contabilizaron {total} elementos en la base de datos."
             mensaje += "\n\nPor favor, analiza estos datos comparativamente, destacando patrones, proporciones y posibles conclusiones entre las diferentes categorías."
             
-            return self._generar_respuesta_con_gpt(mensaje)
+            return (PARTE_GPT, mensaje)
         
-        return "No se pudieron procesar los datos comparativos."
+        return (PARTE_TEXTO, "No se pudieron procesar los datos comparativos.")
 
-    def _formatear_resultados_multiples(self, resultados_lista, estructura_consulta, consulta_sql):
+    def _preparar_resultados_multiples(self, resultados_lista, estructura_consulta, consulta_sql, rapido=False):
         """
         Maneja el caso de recibir múltiples resultados como lista.
+
+        :return: Lista de partes de la respuesta.
         """
         # Si es una lista de resultados pero no tenemos estructuras o consultas como lista
         if not isinstance(estructura_consulta, list) or not isinstance(consulta_sql, list):
-            respuestas = []
-            for res in resultados_lista:
-                respuesta = self._formatear_resultado_individual(res, estructura_consulta, consulta_sql)
-                respuestas.append(respuesta)
-            return "\n\n".join(respuestas)
+            return [
+                self._preparar_resultado_individual(res, estructura_consulta, consulta_sql, rapido)
+                for res in resultados_lista
+            ]
         
         # Tenemos listas completas de resultados, estructuras y consultas
         datos_comparativos = []
@@ -248,6 +475,9 @@ class ResponseFormatter:
                 datos_comparativos.append((categoria, valor))
         
         # Si tenemos datos comparativos
+        if datos_comparativos and len(datos_comparativos) > 1 and rapido:
+            emoji = _emoji_para(estructura_consulta)
+            return [(PARTE_TEXTO, self._resumen_categorias("Análisis comparativo de categorías", datos_comparativos, emoji))]
         if datos_comparativos and len(datos_comparativos) > 1:
             total = sum(valor for _, valor in datos_comparativos)
             
@@ -258,20 +488,19 @@ class ResponseFormatter:
             
             for categoria, valor in datos_comparativos:
                 porcentaje = round((valor/total)*100, 2)
-                emoji = "🚗" if "car" in str(estructura_consulta).lower() or "vehic" in str(estructura_consulta).lower() else "📊"
+                emoji = _emoji_para(estructura_consulta)
                 mensaje += f"{emoji} {categoria.capitalize()}: {valor} ({porcentaje}%)\n"
             
             mensaje += f"\nEn total se contabilizaron {total} elementos en la base de datos."
             mensaje += "\n\nPor favor, analiza estos datos comparativamente, destacando patrones, proporciones y posibles conclusiones entre las diferentes categorías."
             
-            return self._generar_respuesta_con_gpt(mensaje)
+            return [(PARTE_GPT, mensaje)]
         
         # Si no podemos hacer análisis comparativo, procesamos cada resultado individualmente
-        respuestas = []
+        partes = []
         for i, res in enumerate(resultados_lista):
             est = estructura_consulta[i] if i < len(estructura_consulta) else None
             sql = consulta_sql[i] if i < len(consulta_sql) else None
-            respuesta = self._formatear_resultado_individual(res, est, sql)
-            respuestas.append(respuesta)
+            partes.append(self._preparar_resultado_individual(res, est, sql, rapido))
         
-        return "\n\n".join(respuestas)
\ No newline at end of file
+        return partes
\ No newline at end of file
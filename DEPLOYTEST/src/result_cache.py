@@ -0,0 +1,277 @@
+# result_cache.py
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from columnar_result import ColumnarResult
+
+
+# Tablas leídas por la consulta (FROM / JOIN seguidos de un identificador, no de una subconsulta)
+_TABLAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s*\.\s*`?(\w+)`?)?", re.IGNORECASE)
+# Funciones cuyo resultado cambia en cada ejecución (incluida la fecha y hora actual, con o sin
+# paréntesis, y UNIX_TIMESTAMP() sin argumentos): esas consultas no se cachean
+_NO_DETERMINISTA_RE = re.compile(
+    r"\b(?:RAND|UUID|UUID_SHORT|SYSDATE|CONNECTION_ID|NOW|CURDATE|CURTIME|UTC_DATE|UTC_TIME|UTC_TIMESTAMP)\s*\("
+    r"|\bUNIX_TIMESTAMP\s*\(\s*\)"
+    r"|\b(?:CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP)\b",
+    re.IGNORECASE,
+)
+_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+
+
+def normalizar_sql(sql):
+    """
+    Normaliza el texto SQL para usarlo como llave: colapsa los espacios, quita el punto y coma final
+    y pasa a minúsculas todo lo que no está entre comillas (los literales se conservan tal cual).
+    """
+    partes = _LITERAL_RE.split(sql.strip().rstrip(";").strip())
+    return "".join(
+        parte if idx % 2 else re.sub(r"\s+", " ", parte).lower()
+        for idx, parte in enumerate(partes)
+    )
+
+
+def tablas_de_consulta(sql):
+    """
+    Retorna las tablas (sin repetir, en orden de aparición) que la consulta lee en FROM y JOIN.
+    """
+    tablas = []
+    for esquema_o_tabla, tabla in _TABLAS_RE.findall(sql):
+        nombre = tabla or esquema_o_tabla
+        if nombre.lower() not in ("select", "dual") and nombre not in tablas:
+            tablas.append(nombre)
+    return tablas
+
+
+class _CacheEntry:
+    def __init__(self, resultado, tablas, marca, expira, nbytes):
+        self.resultado = resultado
+        self.tablas = tablas
+        self.marca = marca
+        self.expira = expira
+        self.nbytes = nbytes
+
+
+class ResultCache:
+    """
+    Caché de resultados de consultas SELECT, indexada por el texto SQL normalizado.
+
+    - Cada entrada vence tras su TTL.
+    - La memoria se acota por bytes (ColumnarResult.nbytes) con expulsión LRU.
+    - Antes de entregar una entrada se compara la marca de agua de las tablas que lee
+      (MAX(id) o MAX(init_time)); si alguna cambió, la entrada se invalida.
+      La marca detecta inserciones; las actualizaciones y borrados se reflejan al vencer el TTL.
+    """
+
+    def __init__(self, ttl=60, max_bytes=128 * 1024 * 1024, watermark_columns=("id", "init_time"), probe_interval=1.0):
+        """
+        :param ttl: Segundos de vida por defecto de cada entrada.
+        :param max_bytes: Tamaño máximo aproximado de todos los resultados guardados.
+        :param watermark_columns: Columnas candidatas para la marca de agua, en orden de preferencia.
+        :param probe_interval: Segundos durante los que se reutiliza la marca de agua leída de una tabla,
+                               para no consultarla en cada acierto cuando llegan muchas preguntas seguidas.
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.watermark_columns = tuple(watermark_columns)
+        self.probe_interval = probe_interval
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._columnas_marca = {}
+        self._marcas = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "probes": 0,
+            "probe_errors": 0,
+        }
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def es_cacheable(sql):
+        """
+        Solo se cachean sentencias SELECT sin funciones no deterministas.
+        """
+        texto = sql.lstrip().lower()
+        return (texto.startswith("select") or texto.startswith("with")) and not _NO_DETERMINISTA_RE.search(sql)
+
+    def get(self, sql, get_connection):
+        """
+        Busca el resultado de una consulta.
+
+        :param sql: Consulta SQL.
+        :param get_connection: Función que retorna una conexión (para leer las marcas de agua).
+        :return: Tupla (resultado, marca). resultado es None si no hay entrada válida; en ese caso
+                 marca es la marca de agua actual, que debe pasarse a put() tras ejecutar la consulta.
+        """
+        if not self.es_cacheable(sql):
+            return None, None
+
+        key = normalizar_sql(sql)
+        tablas = tablas_de_consulta(sql)
+        marca = self._leer_marcas(tablas, get_connection)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() >= entry.expira:
+                    self._quitar(key)
+                    self._counters["expirations"] += 1
+                elif marca is None or entry.marca != marca:
+                    self._quitar(key)
+                    self._counters["invalidations"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry.resultado, marca
+            self._counters["misses"] += 1
+        return None, marca
+
+    def put(self, sql, resultado, marca, ttl=None):
+        """
+        Guarda el resultado de una consulta.
+
+        :param sql: Consulta SQL.
+        :param resultado: ColumnarResult obtenido (otros tipos no se guardan).
+        :param marca: Marca de agua retornada por get() antes de ejecutar la consulta.
+        :param ttl: Segundos de vida de esta entrada (por defecto, self.ttl).
+        """
+        if not isinstance(resultado, ColumnarResult) or marca is None or not self.es_cacheable(sql):
+            return
+        nbytes = resultado.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        key = normalizar_sql(sql)
+        entry = _CacheEntry(
+            resultado, tablas_de_consulta(sql), marca, time.monotonic() + (self.ttl if ttl is None else ttl), nbytes
+        )
+        with self._lock:
+            self._quitar(key)
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            self._counters["stores"] += 1
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._quitar(oldest)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, table=None):
+        """
+        Descarta las entradas que leen `table` (o todas si no se indica tabla).
+        """
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if table is None or table in e.tablas]
+            for key in keys:
+                self._quitar(key)
+            self._counters["invalidations"] += len(keys)
+            if table is None:
+                self._marcas.clear()
+            else:
+                self._marcas.pop(table, None)
+
+    def stats(self):
+        """
+        Retorna una copia de los contadores de la caché.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            current_bytes = self.current_bytes
+        consultas = counters["hits"] + counters["misses"]
+        counters.update(
+            entries=entries,
+            bytes=current_bytes,
+            max_bytes=self.max_bytes,
+            hit_rate=round(counters["hits"] / consultas, 4) if consultas else 0.0,
+        )
+        return counters
+
+    def _quitar(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.nbytes
+
+    def _leer_marcas(self, tablas, get_connection):
+        """
+        Lee la marca de agua de cada tabla. Retorna una tupla (tabla, valor) por tabla, o None si alguna
+        tabla no se pudo leer (en ese caso la consulta no se cachea).
+        """
+        if not tablas:
+            return None
+
+        ahora = time.monotonic()
+        marcas = {}
+        pendientes = []
+        with self._lock:
+            for tabla in tablas:
+                guardada = self._marcas.get(tabla)
+                if guardada is not None and ahora - guardada[1] < self.probe_interval:
+                    marcas[tabla] = guardada[0]
+                else:
+                    pendientes.append(tabla)
+
+        if pendientes:
+            conn = None
+            cursor = None
+            try:
+                conn = get_connection()
+                cursor = conn.cursor()
+                for tabla in pendientes:
+                    valor = self._sondear(cursor, tabla)
+                    if valor is None:
+                        return None
+                    marcas[tabla] = valor
+                    with self._lock:
+                        self._marcas[tabla] = (valor, ahora)
+            except Exception as e:
+                self._count(probe_errors=1)
+                self.logger.warning("No se pudo leer la marca de agua: %s", e)
+                return None
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn:
+                    conn.close()
+
+        return tuple((tabla, marcas[tabla]) for tabla in tablas)
+
+    def _sondear(self, cursor, tabla):
+        """
+        Ejecuta SELECT MAX(columna) sobre la tabla con la primera columna candidata que exista.
+        La columna elegida se recuerda por tabla. Retorna None si ninguna sirve.
+        """
+        if tabla in self._columnas_marca:
+            if self._columnas_marca[tabla] is None:
+                return None
+            columnas = (self._columnas_marca[tabla],)
+        else:
+            columnas = self.watermark_columns
+
+        for columna in columnas:
+            try:
+                cursor.execute(f"SELECT MAX(`{columna}`) FROM `{tabla}`")
+                valor = cursor.fetchone()[0]
+            except Exception:
+                self._count(probe_errors=1)
+                continue
+            self._count(probes=1)
+            self._columnas_marca[tabla] = columna
+            return (columna, valor)
+
+        self.logger.info("La tabla '%s' no tiene columna de marca de agua; sus consultas no se cachean.", tabla)
+        self._columnas_marca[tabla] = None
+        return None
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
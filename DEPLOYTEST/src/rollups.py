@@ -0,0 +1,684 @@
+# rollups.py
+
+import decimal
+import logging
+import math
+import re
+import threading
+import time
+
+from sql_compiler import parametrizar_sql
+from text_utils import clausulas_sql, condiciones_sql, dividir_sql, normalizar_expresion, separar_alias
+
+
+HORA_MS = 3600000
+DIA_MS = 86400000
+
+# Dimensiones de los rollups (llave: expresión normalizada en la tabla de detalle). Los NULL se guardan
+# como -1 y '' porque las columnas forman parte de la llave primaria (una cámara '' se lee como NULL).
+DIMENSIONES = {
+    "left(object_id,length(object_id)-27)": {
+        "detalle": "LEFT(object_id, LENGTH(object_id) - 27)",
+        "agrupado": "COALESCE(LEFT(object_id, LENGTH(object_id) - 27), '')",
+        "rollup": "camera_id",
+        "salida": "NULLIF({}, '')",
+        "nulo": "",
+    },
+    "attribute_id": {
+        "detalle": "attribute_id",
+        "agrupado": "COALESCE(attribute_id, -1)",
+        "rollup": "attribute_id",
+        "salida": "NULLIF({}, -1)",
+        "nulo": -1,
+    },
+    "description": {
+        "detalle": "description",
+        "agrupado": "COALESCE(description, '')",
+        "rollup": "description",
+        "salida": "NULLIF({}, '')",
+        "nulo": "",
+    },
+}
+# Columna generada propuesta por IndexAdvisor para la cámara
+DIMENSIONES["camera_id"] = DIMENSIONES["left(object_id,length(object_id)-27)"]
+
+# Argumento de COUNT -> (conteo en la tabla de detalle, conteo en el rollup)
+CONTEOS = {
+    "*": ("COUNT(*)", "cnt"),
+    "1": ("COUNT(*)", "cnt"),
+    "attribute_id": ("COUNT(attribute_id)", "IF(attribute_id = -1, 0, cnt)"),
+}
+
+# Funciones de fecha cuyo valor es constante dentro de una hora (se pueden calcular sobre bucket_start)
+_FUNCIONES_HORA = {
+    "date", "hour", "day", "dayofmonth", "dayofweek", "weekday", "dayname", "month", "monthname", "year",
+    "week", "yearweek", "date_format",
+}
+# Especificadores de DATE_FORMAT con minutos o segundos
+_FORMATO_SUBHORA_RE = re.compile(r"%[iSsfTrX]")
+_UNIDADES_INTERVALO = {"interval", "microsecond", "second", "minute", "hour", "day", "week", "month", "quarter", "year"}
+_ORDEN_CLAUSULAS = ("select", "from", "where", "group by", "order by", "limit")
+_COMPARACION_RE = re.compile(r"^(?P<lhs>.+?)\s*(?P<op>>=|<=|=|>|<)\s*(?P<rhs>.+)$", re.DOTALL)
+
+
+def _piso(t, tamano, offset=0):
+    return t - (t + offset) % tamano
+
+
+def _techo(t, tamano, offset=0):
+    return _piso(t + tamano - 1, tamano, offset)
+
+
+def _repartir(partes, valores):
+    """
+    Asocia a cada parte de una plantilla los valores de sus marcadores %s, en orden.
+
+    :return: Lista de tuplas (parte, valores).
+    """
+    resultado, i = [], 0
+    for parte in partes:
+        n = parte.count("%s")
+        resultado.append((parte, list(valores[i:i + n])))
+        i += n
+    return resultado
+
+
+def _nombre_columna(expresion, alias, valores):
+    """
+    Nombre de la columna en el resultado de MySQL: el alias, o el texto de la expresión tal como se escribió.
+    """
+    if alias:
+        return alias
+    m = re.match(r"^(?:`?\w+`?\.)?`?(\w+)`?$", expresion)
+    if m:
+        return m.group(1)
+    partes = expresion.split("%s")
+    texto = partes[0]
+    for valor, parte in zip(valores, partes[1:]):
+        texto += (f"'{valor}'" if isinstance(valor, str) else str(valor)) + parte
+    return texto
+
+
+def _citar(nombre):
+    return "`" + nombre.replace("`", "``") + "`"
+
+
+def segmentos(desde, hasta, watermark, offset_ms, usar_dia=True):
+    """
+    Divide el rango [desde, hasta) de init_time (None: sin límite) en tramos que se leen del rollup diario,
+    del horario o de la tabla de detalle: los días y horas completos anteriores al watermark salen de los
+    rollups; los bordes que no calzan con una hora y lo posterior al watermark, del detalle.
+
+    :return: Lista de tuplas (origen, desde, hasta) con origen "dia", "hora" o "detalle".
+    """
+    tramos = []
+    fin_rollup = watermark if hasta is None else min(hasta, watermark)
+    if desde is None or desde < fin_rollup:
+        h_ini = None if desde is None else _techo(desde, HORA_MS)
+        h_fin = _piso(fin_rollup, HORA_MS)
+        if h_ini is not None and h_ini >= h_fin:
+            tramos.append(("detalle", desde, fin_rollup))
+        else:
+            if desde is not None and desde < h_ini:
+                tramos.append(("detalle", desde, h_ini))
+            medio = [("hora", h_ini, h_fin)]
+            if usar_dia:
+                d_ini = None if h_ini is None else _techo(h_ini, DIA_MS, offset_ms)
+                d_fin = _piso(h_fin, DIA_MS, offset_ms)
+                if d_ini is None or d_ini < d_fin:
+                    medio = [("hora", h_ini, d_ini)] if h_ini is not None and h_ini < d_ini else []
+                    medio.append(("dia", d_ini, d_fin))
+                    if d_fin < h_fin:
+                        medio.append(("hora", d_fin, h_fin))
+            tramos += medio
+            if h_fin < fin_rollup:
+                tramos.append(("detalle", h_fin, fin_rollup))
+    if hasta is None or hasta > watermark:
+        tramos.append(("detalle", watermark if desde is None else max(desde, watermark), hasta))
+    return tramos
+
+
+class RollupMaintainer:
+    """
+    Mantiene las tablas de resumen de detections por hora y por día (conteos por cámara, attribute_id y
+    description) en un hilo en segundo plano.
+
+    La actualización es incremental: la tabla rollup_watermark guarda hasta qué init_time (exclusivo, al
+    inicio de una hora) están resumidos los datos, y cada ciclo agrega solo las horas completas posteriores,
+    dejando un margen `lag_ms` para las detecciones que llegan con retraso. La fila del watermark se bloquea
+    durante la actualización, de modo que varios procesos pueden mantener las mismas tablas.
+    Las detecciones insertadas con un init_time anterior al watermark no quedan en los rollups.
+    """
+
+    def __init__(self, get_connection, tabla="detections", intervalo=60, lag_ms=2 * 60 * 1000, lote_ms=DIA_MS,
+                 offset_ms=None):
+        """
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param tabla: Tabla de detalle que se resume.
+        :param intervalo: Segundos entre actualizaciones.
+        :param lag_ms: Margen, en milisegundos, que se deja sin resumir al final de los datos.
+        :param lote_ms: Máximo de init_time que se resume por transacción (se redondea a horas).
+        :param offset_ms: Desfase respecto de UTC del inicio de los días; por defecto, el de la zona horaria
+                          de la sesión de MySQL (el mismo que usa FROM_UNIXTIME).
+        """
+        self.get_connection = get_connection
+        self.tabla = tabla
+        self.tabla_hora = f"{tabla}_rollup_hora"
+        self.tabla_dia = f"{tabla}_rollup_dia"
+        self.intervalo = intervalo
+        self.lag_ms = lag_ms
+        self.lote_ms = max(HORA_MS, lote_ms - lote_ms % HORA_MS)
+        self.offset_ms = offset_ms
+        self.watermark = None
+        self._stop_event = threading.Event()
+        self._hilo = None
+        self.stats = {"actualizaciones": 0, "horas": 0, "filas": 0, "errores": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def listo(self):
+        return self.watermark is not None
+
+    def preparar(self):
+        """
+        Crea las tablas de resumen y el watermark si no existen y lee el watermark.
+
+        :return: True si los rollups quedaron listos para actualizarse.
+        """
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SHOW TABLES LIKE %s", (self.tabla,))
+            if not cursor.fetchall():
+                self.logger.info("No existe la tabla '%s'; no se mantienen sus rollups.", self.tabla)
+                return False
+
+            for nombre in (self.tabla_hora, self.tabla_dia):
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS `{nombre}` (
+                        bucket_start BIGINT NOT NULL,
+                        camera_id VARCHAR(255) NOT NULL,
+                        attribute_id INT NOT NULL,
+                        description VARCHAR(255) NOT NULL,
+                        cnt BIGINT NOT NULL,
+                        PRIMARY KEY (bucket_start, camera_id, attribute_id, description),
+                        KEY idx_{nombre}_attribute (attribute_id, description, bucket_start),
+                        KEY idx_{nombre}_camera (camera_id, bucket_start)
+                    )
+                """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_watermark (
+                    tabla VARCHAR(64) PRIMARY KEY,
+                    watermark BIGINT NOT NULL,
+                    offset_ms BIGINT NOT NULL
+                )
+            """)
+
+            cursor.execute("SELECT watermark, offset_ms FROM rollup_watermark WHERE tabla = %s", (self.tabla,))
+            fila = cursor.fetchone()
+            if fila is None:
+                offset_ms = self.offset_ms
+                if offset_ms is None:
+                    cursor.execute("SELECT TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW())")
+                    offset_ms = int(cursor.fetchone()[0]) * 1000
+                cursor.execute(f"SELECT MIN(init_time) FROM `{self.tabla}`")
+                minimo = cursor.fetchone()[0]
+                inicio = _piso(int(minimo) if minimo is not None else self._limite(), HORA_MS)
+                cursor.execute(
+                    "INSERT IGNORE INTO rollup_watermark (tabla, watermark, offset_ms) VALUES (%s, %s, %s)",
+                    (self.tabla, inicio, offset_ms),
+                )
+                conn.commit()
+                cursor.execute("SELECT watermark, offset_ms FROM rollup_watermark WHERE tabla = %s", (self.tabla,))
+                fila = cursor.fetchone()
+            # Los días de la tabla diaria quedan definidos por el desfase con que se crearon
+            self.offset_ms = int(fila[1])
+            self.watermark = int(fila[0])
+            return True
+        except Exception as e:
+            self.stats["errores"] += 1
+            self.logger.warning("No se pudieron preparar los rollups de '%s': %s", self.tabla, e)
+            if conn:
+                conn.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def actualizar(self):
+        """
+        Resume las horas completas posteriores al watermark, en lotes de `lote_ms`.
+
+        :return: Filas agregadas o actualizadas en el rollup horario.
+        """
+        if not self.listo and not self.preparar():
+            return 0
+        total = 0
+        while not self._stop_event.is_set():
+            filas = self._actualizar_lote()
+            if filas is None:
+                break
+            total += filas
+        return total
+
+    def _limite(self):
+        # Fin (exclusivo) de lo que se puede resumir: la última hora completa antes del margen
+        return _piso(int(time.time() * 1000) - self.lag_ms, HORA_MS)
+
+    def _actualizar_lote(self):
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT watermark FROM rollup_watermark WHERE tabla = %s FOR UPDATE", (self.tabla,))
+            desde = int(cursor.fetchone()[0])
+            hasta = min(self._limite(), desde + self.lote_ms)
+            if hasta <= desde:
+                conn.rollback()
+                self.watermark = desde
+                return None
+
+            inicio = time.perf_counter()
+            cursor.execute(f"""
+                INSERT INTO `{self.tabla_hora}` (bucket_start, camera_id, attribute_id, description, cnt)
+                SELECT init_time - MOD(init_time, {HORA_MS}), COALESCE(LEFT(object_id, LENGTH(object_id) - 27), ''),
+                       COALESCE(attribute_id, -1), COALESCE(description, ''), COUNT(*)
+                FROM `{self.tabla}`
+                WHERE init_time >= %s AND init_time < %s
+                GROUP BY 1, 2, 3, 4
+                ON DUPLICATE KEY UPDATE cnt = `{self.tabla_hora}`.cnt + VALUES(cnt)
+            """, (desde, hasta))
+            filas = max(cursor.rowcount, 0)
+            if self.offset_ms % HORA_MS == 0:
+                # Las horas caben enteras en los días: el rollup diario se arma desde el horario
+                origen = f"""
+                    SELECT bucket_start - MOD(bucket_start + {self.offset_ms}, {DIA_MS}), camera_id, attribute_id,
+                           description, SUM(cnt)
+                    FROM `{self.tabla_hora}`
+                    WHERE bucket_start >= %s AND bucket_start < %s
+                """
+            else:
+                origen = f"""
+                    SELECT init_time - MOD(init_time + {self.offset_ms}, {DIA_MS}),
+                           COALESCE(LEFT(object_id, LENGTH(object_id) - 27), ''), COALESCE(attribute_id, -1),
+                           COALESCE(description, ''), COUNT(*)
+                    FROM `{self.tabla}`
+                    WHERE init_time >= %s AND init_time < %s
+                """
+            cursor.execute(f"""
+                INSERT INTO `{self.tabla_dia}` (bucket_start, camera_id, attribute_id, description, cnt)
+                {origen}
+                GROUP BY 1, 2, 3, 4
+                ON DUPLICATE KEY UPDATE cnt = `{self.tabla_dia}`.cnt + VALUES(cnt)
+            """, (desde, hasta))
+            cursor.execute("UPDATE rollup_watermark SET watermark = %s WHERE tabla = %s", (hasta, self.tabla))
+            conn.commit()
+
+            self.watermark = hasta
+            self.stats["actualizaciones"] += 1
+            self.stats["horas"] += (hasta - desde) // HORA_MS
+            self.stats["filas"] += filas
+            self.logger.info(
+                "Rollups de '%s' actualizados hasta %d (%d horas, %d filas) en %.2f s.",
+                self.tabla, hasta, (hasta - desde) // HORA_MS, filas, time.perf_counter() - inicio,
+            )
+            return filas
+        except Exception as e:
+            # Se reintentará en el siguiente ciclo
+            self.stats["errores"] += 1
+            self.logger.warning("No se pudieron actualizar los rollups de '%s': %s", self.tabla, e)
+            if conn:
+                conn.rollback()
+            return None
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def start(self):
+        """
+        Inicia el hilo que prepara y actualiza los rollups cada `intervalo` segundos.
+        """
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._stop_event.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="RollupMaintainer", daemon=True)
+        self._hilo.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+
+    def _bucle(self):
+        while not self._stop_event.is_set():
+            self.actualizar()
+            if self._stop_event.wait(self.intervalo):
+                break
+
+
+class AggregateRouter:
+    """
+    Reescribe las consultas de conteo sobre detections que se pueden responder con los rollups de
+    RollupMaintainer, para que lean cientos de filas resumidas en vez de millones de detecciones.
+
+    Se reconocen los SELECT sobre la tabla de detalle con COUNT(*) (o COUNT(attribute_id)), agrupados o
+    filtrados por igualdad o IN por cámara (LEFT(object_id, LENGTH(object_id) - 27)), attribute_id y
+    description, agrupados opcionalmente por funciones de fecha de FROM_UNIXTIME(init_time / 1000) que no
+    bajan de la hora, y con un rango de init_time. El rango se reparte entre el rollup diario, el horario y
+    la tabla de detalle (bordes que no calzan con una hora y datos posteriores al watermark), de modo que
+    el resultado es el mismo que el de la consulta original. Las demás consultas no se modifican.
+    """
+
+    def __init__(self, maintainer):
+        """
+        :param maintainer: RollupMaintainer que mantiene los rollups de la tabla.
+        """
+        self.maintainer = maintainer
+        self.stats = {"reescritas": 0, "directas": 0, "errores": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def enrutar(self, cursor, sql, params=None):
+        """
+        :param cursor: Cursor para evaluar los extremos del rango que no son literales (p. ej. UNIX_TIMESTAMP(...)).
+        :return: Tupla (sql, params): la consulta reescrita sobre los rollups, o la original.
+        """
+        if not isinstance(sql, str) or not self.maintainer.listo \
+                or not re.search(rf"\b{re.escape(self.maintainer.tabla)}\b", sql) \
+                or not re.search(r"\bcount\s*\(", sql, re.IGNORECASE):
+            return sql, params
+        try:
+            reescrita = self._reescribir(cursor, sql, params)
+        except Exception as e:
+            self.stats["errores"] += 1
+            self.logger.warning("No se pudo reescribir la consulta sobre los rollups: %s", e)
+            reescrita = None
+        if reescrita is None:
+            self.stats["directas"] += 1
+            return sql, params
+        self.stats["reescritas"] += 1
+        self.logger.info("Consulta respondida con los rollups: %s", sql)
+        return reescrita
+
+    def _reescribir(self, cursor, sql, params):
+        watermark, offset_ms = self.maintainer.watermark, self.maintainer.offset_ms
+        if params is None:
+            plantilla, params = parametrizar_sql(sql)
+            if params is None:
+                if "%" in sql:
+                    return None
+                params = ()
+        else:
+            plantilla = sql
+        if re.search(r"/\*|--|#", plantilla):
+            return None
+        texto = " ".join(plantilla.replace(";", " ").split())
+        clausulas = clausulas_sql(texto)
+        if list(clausulas) != [c for c in _ORDEN_CLAUSULAS if c in clausulas] or "select" not in clausulas:
+            return None
+        origen = re.match(r"^`?(\w+)`?(?:\s+(?:as\s+)?`?\w+`?)?$", clausulas.get("from", ""), re.IGNORECASE)
+        if origen is None or origen.group(1) != self.maintainer.tabla:
+            return None
+        valores = dict(zip(clausulas, (v for _, v in _repartir(list(clausulas.values()), list(params)))))
+
+        # SELECT: dimensiones y conteos
+        select = clausulas["select"]
+        if re.match(r"^distinct\b", select, re.IGNORECASE):
+            return None
+        elementos = []
+        for elemento, vals in _repartir(dividir_sql(select, r","), valores["select"]):
+            expresion, alias = separar_alias(elemento)
+            normalizada = normalizar_expresion(expresion)
+            item = {"expresion": expresion, "normalizada": normalizada, "valores": vals,
+                    "nombre": _nombre_columna(expresion, alias, vals), "alias": alias}
+            conteo = re.match(r"^count\((.+)\)$", normalizada)
+            if conteo and conteo.group(1) in CONTEOS and not vals:
+                item["conteo"] = CONTEOS[conteo.group(1)]
+            elif normalizada in DIMENSIONES and not vals:
+                item["dimension"] = DIMENSIONES[normalizada]
+            elif self._es_tiempo_por_hora(normalizada, vals, offset_ms):
+                detalle = re.sub(r"(?:`?\w+`?\.)?`?\binit_time\b`?", "init_time", expresion)
+                item["dimension"] = {"agrupado": detalle, "rollup": re.sub(r"\binit_time\b", "bucket_start", detalle),
+                                     "salida": "{}", "tiempo": True}
+            else:
+                return None
+            elementos.append(item)
+        dimensiones = [e for e in elementos if "dimension" in e]
+        conteos = [e for e in elementos if "conteo" in e]
+        if not conteos:
+            return None
+
+        # GROUP BY: exactamente las dimensiones del SELECT
+        agrupadas = set()
+        for item in dividir_sql(clausulas.get("group by", ""), r","):
+            indice = self._resolver(item, elementos)
+            if indice is None or "dimension" not in elementos[indice]:
+                return None
+            agrupadas.add(indice)
+        if agrupadas != {i for i, e in enumerate(elementos) if "dimension" in e}:
+            return None
+
+        # WHERE: rango de init_time y filtros por dimensión
+        desde, hasta, filtros, extremos = None, None, [], []
+        for condicion, vals in _repartir(condiciones_sql(clausulas.get("where", "")), valores.get("where", [])):
+            if len(dividir_sql(condicion, r"\bor\b")) > 1:
+                return None
+            m = re.match(r"^(?P<lhs>.+?)\s+(?P<op>between|in)\s*(?P<rhs>.+)$", condicion, re.IGNORECASE | re.DOTALL)
+            if m and m.group("lhs").count("(") == m.group("lhs").count(")"):
+                lhs, op, rhs = m.group("lhs"), m.group("op").lower(), m.group("rhs")
+            else:
+                m = _COMPARACION_RE.match(condicion)
+                if m is None:
+                    return None
+                lhs, op, rhs = m.group("lhs"), m.group("op"), m.group("rhs")
+            lhs_vals, rhs_vals = vals[:lhs.count("%s")], vals[lhs.count("%s"):]
+            normalizada = normalizar_expresion(lhs)
+            if lhs_vals:
+                return None
+            if normalizada == "init_time":
+                if op == "in":
+                    return None
+                partes = dividir_sql(rhs, r"\band\b") if op == "between" else [rhs]
+                if len(partes) != (2 if op == "between" else 1):
+                    return None
+                operadores = (">=", "<=") if op == "between" else (op,)
+                for (parte, pvals), operador in zip(_repartir(partes, rhs_vals), operadores):
+                    extremos.append((operador, parte, pvals))
+            elif normalizada in DIMENSIONES:
+                dimension = DIMENSIONES[normalizada]
+                if op == "in":
+                    lista = re.match(r"^\((.*)\)$", rhs.strip(), re.DOTALL)
+                    items = dividir_sql(lista.group(1), r",") if lista else []
+                elif op == "=":
+                    items = [rhs.strip()]
+                else:
+                    return None
+                valores_filtro = []
+                for item, ivals in _repartir(items, rhs_vals):
+                    if item == "%s":
+                        valores_filtro.append(ivals[0])
+                    elif re.fullmatch(r"-?\d+", item):
+                        valores_filtro.append(int(item))
+                    else:
+                        return None
+                if not valores_filtro or dimension["nulo"] in valores_filtro:
+                    return None
+                filtros.append((dimension, valores_filtro))
+            else:
+                return None
+
+        rango = self._evaluar_extremos(cursor, extremos)
+        if rango is None:
+            return None
+        desde, hasta = rango
+        if desde is not None and hasta is not None and desde >= hasta:
+            return None
+        usar_dia = not any(d["dimension"].get("tiempo") for d in dimensiones)
+        tramos = segmentos(desde, hasta, watermark, offset_ms, usar_dia)
+        if all(origen == "detalle" for origen, _, _ in tramos):
+            return None
+
+        # ORDER BY y LIMIT de la consulta externa (por posición)
+        orden = []
+        for item in dividir_sql(clausulas.get("order by", ""), r","):
+            sentido = re.search(r"\s+(asc|desc)$", item, re.IGNORECASE)
+            indice = self._resolver(item[:sentido.start()] if sentido else item, elementos)
+            if indice is None:
+                return None
+            orden.append(f"{indice + 1}{' ' + sentido.group(1).upper() if sentido else ''}")
+
+        return self._construir(elementos, dimensiones, conteos, filtros, tramos, orden,
+                               clausulas.get("limit"), valores.get("limit", []))
+
+    def _resolver(self, item, elementos):
+        """
+        Índice del elemento del SELECT al que se refiere un elemento de GROUP BY / ORDER BY (posición,
+        alias o la misma expresión), o None.
+        """
+        item = item.strip()
+        if "%s" in item:
+            return None
+        if item.isdigit():
+            indice = int(item) - 1
+            return indice if 0 <= indice < len(elementos) else None
+        nombre = item.strip("`")
+        normalizada = normalizar_expresion(item)
+        for i, elemento in enumerate(elementos):
+            if (elemento["alias"] and elemento["alias"].lower() == nombre.lower()) or elemento["normalizada"] == normalizada:
+                return i
+        return None
+
+    @staticmethod
+    def _es_tiempo_por_hora(normalizada, valores, offset_ms):
+        """
+        Indica si la expresión es una función de fecha de FROM_UNIXTIME(init_time / 1000) constante dentro de
+        cada hora (p. ej. DATE(...), HOUR(...) o DATE_FORMAT(..., '%Y-%m-%d %H')).
+        """
+        if offset_ms % HORA_MS or "from_unixtime(init_time/1000)" not in normalizada:
+            return False
+        resto = normalizada.replace("from_unixtime(init_time/1000)", "\x00").replace("%s", "\x01")
+        funciones = re.findall(r"(\w+)\(", resto)
+        if not funciones or any(f not in _FUNCIONES_HORA for f in funciones):
+            return False
+        # Solo funciones anidadas sobre la marca de tiempo y, en DATE_FORMAT, un formato sin minutos ni segundos
+        if not re.fullmatch("[(),\x00\x01]*", re.sub(r"\w+\(", "(", resto)):
+            return False
+        return all(isinstance(v, str) and not _FORMATO_SUBHORA_RE.search(v) for v in valores) \
+            and (not valores or "date_format" in funciones)
+
+    def _evaluar_extremos(self, cursor, extremos):
+        """
+        Convierte las cotas de init_time en un rango [desde, hasta) de enteros (None: sin límite). Las cotas
+        que no son literales se evalúan en MySQL, con la zona horaria de la sesión.
+
+        :return: Tupla (desde, hasta), o None si alguna cota no se puede evaluar.
+        """
+        numeros, pendientes = [], []
+        for operador, parte, vals in extremos:
+            parte = parte.strip()
+            if parte == "%s" and isinstance(vals[0], (int, decimal.Decimal, float)) and not isinstance(vals[0], bool):
+                numeros.append((operador, vals[0]))
+            elif parte == "%s" and isinstance(vals[0], str) and re.fullmatch(r"-?\d+(\.\d+)?", vals[0]):
+                numeros.append((operador, decimal.Decimal(vals[0])))
+            elif re.fullmatch(r"-?\d+(\.\d+)?", parte):
+                numeros.append((operador, decimal.Decimal(parte)))
+            else:
+                palabras = re.findall(r"[a-z_]\w*(?!\w*\s*\()", parte.lower().replace("%s", " "))
+                if any(p not in _UNIDADES_INTERVALO for p in palabras):
+                    return None  # Referencias a columnas
+                pendientes.append((operador, parte, vals))
+        if pendientes:
+            cursor.execute(
+                "SELECT " + ", ".join(parte for _, parte, _ in pendientes),
+                tuple(v for _, _, vals in pendientes for v in vals),
+            )
+            fila = cursor.fetchall()[0]
+            for (operador, _, _), valor in zip(pendientes, fila):
+                if valor is None:
+                    return None
+                numeros.append((operador, decimal.Decimal(str(valor))))
+
+        desde, hasta = None, None
+        for operador, valor in numeros:
+            valor = decimal.Decimal(str(valor))
+            if operador == ">=":
+                cota_desde, cota_hasta = math.ceil(valor), None
+            elif operador == ">":
+                cota_desde, cota_hasta = math.floor(valor) + 1, None
+            elif operador == "<=":
+                cota_desde, cota_hasta = None, math.floor(valor) + 1
+            elif operador == "<":
+                cota_desde, cota_hasta = None, math.ceil(valor)
+            else:
+                if valor != valor.to_integral_value():
+                    return None
+                cota_desde, cota_hasta = int(valor), int(valor) + 1
+            if cota_desde is not None:
+                desde = cota_desde if desde is None else max(desde, cota_desde)
+            if cota_hasta is not None:
+                hasta = cota_hasta if hasta is None else min(hasta, cota_hasta)
+        return desde, hasta
+
+    def _construir(self, elementos, dimensiones, conteos, filtros, tramos, orden, limite, valores_limite):
+        """
+        Arma la consulta sobre los rollups: la unión de los tramos, sumada por las dimensiones.
+
+        :return: Tupla (sql, params).
+        """
+        maintainer = self.maintainer
+        partes, params = [], []
+        for origen, desde, hasta in tramos:
+            columnas, columnas_params = [], []
+            for i, d in enumerate(dimensiones):
+                clave = "agrupado" if origen == "detalle" else "rollup"
+                columnas.append(f"{d['dimension'][clave]} AS d{i}")
+                columnas_params += d["valores"]
+            columna_tiempo = "init_time" if origen == "detalle" else "bucket_start"
+            columnas += [f"{c['conteo'][0 if origen == 'detalle' else 1]} AS c{j}" for j, c in enumerate(conteos)]
+            condiciones, condiciones_params = [], []
+            if desde is not None:
+                condiciones.append(f"{columna_tiempo} >= %s")
+                condiciones_params.append(desde)
+            if hasta is not None:
+                condiciones.append(f"{columna_tiempo} < %s")
+                condiciones_params.append(hasta)
+            for dimension, valores_filtro in filtros:
+                columna = dimension["detalle" if origen == "detalle" else "rollup"]
+                if len(valores_filtro) == 1:
+                    condiciones.append(f"{columna} = %s")
+                else:
+                    condiciones.append(f"{columna} IN ({', '.join(['%s'] * len(valores_filtro))})")
+                condiciones_params += valores_filtro
+            tabla = {"detalle": maintainer.tabla, "hora": maintainer.tabla_hora, "dia": maintainer.tabla_dia}[origen]
+            parte = f"SELECT {', '.join(columnas)} FROM `{tabla}`"
+            if condiciones:
+                parte += f" WHERE {' AND '.join(condiciones)}"
+            if origen == "detalle" and dimensiones:
+                parte += f" GROUP BY {', '.join(str(i + 1) for i in range(len(dimensiones)))}"
+            partes.append(parte)
+            params += columnas_params + condiciones_params
+
+        salida = []
+        for elemento in elementos:
+            if "dimension" in elemento:
+                columna = elemento["dimension"]["salida"].format(f"d{dimensiones.index(elemento)}")
+            else:
+                columna = f"CAST(SUM(c{conteos.index(elemento)}) AS SIGNED)"
+                if not dimensiones:
+                    columna = f"COALESCE({columna}, 0)"
+            salida.append(f"{columna} AS {_citar(elemento['nombre'])}")
+        sql = f"SELECT {', '.join(salida)} FROM ({' UNION ALL '.join(partes)}) AS resumen"
+        if dimensiones:
+            sql += f" GROUP BY {', '.join(f'd{i}' for i in range(len(dimensiones)))}"
+        if orden:
+            sql += f" ORDER BY {', '.join(orden)}"
+        if limite:
+            sql += f" LIMIT {limite}"
+            params += valores_limite
+        return sql, tuple(params)
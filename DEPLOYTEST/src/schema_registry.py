@@ -0,0 +1,183 @@
+# schema_registry.py
+
+import logging
+import threading
+import time
+
+from db_schema import DBSchemaAgent
+
+
+class _SchemaEntry:
+    """
+    Estado cacheado de un esquema concreto dentro del registro.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.schema = None
+        self.fingerprint = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+
+class SchemaRegistry:
+    """
+    Registro de esquemas compartido por todo el proceso.
+
+    Evita que cada consulta del usuario vuelva a leer information_schema:
+      - Los esquemas se indexan por (host, puerto, base de datos, tablas principales).
+      - Un hilo en segundo plano revalida cada esquema cuando vence su TTL.
+      - La revalidación solo compara una huella barata (ver DBSchemaAgent.get_schema_fingerprint)
+        y vuelve a extraer el esquema completo únicamente si la huella cambió.
+    """
+
+    def __init__(self, ttl=300, background_refresh=True):
+        """
+        :param ttl: Segundos tras los cuales un esquema se revalida contra la base de datos.
+        :param background_refresh: Si es True, la revalidación se hace en un hilo en segundo plano.
+                                   Si es False, se hace de forma síncrona al pedir un esquema vencido.
+        """
+        self.ttl = ttl
+        self.background_refresh = background_refresh
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher = None
+        self.stats = {"hits": 0, "loads": 0, "checks": 0, "invalidations": 0, "errors": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def make_key(db_config, main_tables=None):
+        """
+        Construye la llave del registro a partir de la configuración de la base de datos.
+
+        :param db_config: Diccionario con host, port y database.
+        :param main_tables: Lista opcional de tablas principales.
+        :return: Tupla (host, port, database, main_tables).
+        """
+        return (
+            db_config.get("host", "localhost"),
+            int(db_config.get("port", 3306)),
+            db_config.get("database", ""),
+            tuple(sorted(main_tables)) if main_tables else None,
+        )
+
+    def get_schema(self, db_config, get_connection, main_tables=None, include_sample_data=False):
+        """
+        Retorna el esquema de la base de datos, extrayéndolo solo si no está en el registro.
+
+        :param db_config: Diccionario de configuración de la base de datos.
+        :param get_connection: Función que retorna una conexión a la base de datos.
+        :param main_tables: Lista opcional de tablas principales.
+        :param include_sample_data: Si es True, el esquema incluye filas de muestra.
+        :return: Diccionario del esquema (mismo formato que DBSchemaAgent.get_schema_dict).
+        """
+        key = self.make_key(db_config, main_tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                agent = DBSchemaAgent(
+                    get_connection,
+                    db_config.get("database", ""),
+                    main_tables=list(main_tables) if main_tables else None,
+                    include_sample_data=include_sample_data,
+                    bulk_introspection=True
+                )
+                entry = _SchemaEntry(agent)
+                self._entries[key] = entry
+
+        with entry.lock:
+            # Las credenciales no forman parte de la llave; usamos siempre el proveedor más reciente.
+            entry.agent.get_connection = get_connection
+            if entry.schema is None:
+                self._load(entry)
+            elif not self.background_refresh and time.monotonic() - entry.checked_at >= self.ttl:
+                self._revalidate(entry)
+            else:
+                self.stats["hits"] += 1
+            schema = entry.schema
+
+        if self.background_refresh:
+            self._ensure_refresher()
+        return schema
+
+    def invalidate(self, db_config=None, main_tables=None):
+        """
+        Descarta un esquema del registro (o todos si no se indica configuración).
+        """
+        with self._lock:
+            if db_config is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self.make_key(db_config, main_tables), None)
+
+    def stop(self):
+        """
+        Detiene el hilo de revalidación en segundo plano.
+        """
+        self._stop_event.set()
+        if self._refresher:
+            self._refresher.join(timeout=5)
+            self._refresher = None
+
+    def _load(self, entry):
+        fingerprint = entry.agent.get_schema_fingerprint()
+        entry.agent.cached_schema = None
+        entry.schema = entry.agent.get_schema_dict()
+        entry.fingerprint = fingerprint
+        entry.checked_at = time.monotonic()
+        self.stats["loads"] += 1
+        self.logger.info("Esquema '%s' cargado (%d tablas).", entry.agent.db_name, len(entry.schema))
+
+    def _revalidate(self, entry):
+        self.stats["checks"] += 1
+        try:
+            fingerprint = entry.agent.get_schema_fingerprint()
+            if fingerprint != entry.fingerprint:
+                self.stats["invalidations"] += 1
+                self.logger.info("El esquema '%s' cambió; se vuelve a extraer.", entry.agent.db_name)
+                self._load(entry)
+            else:
+                entry.checked_at = time.monotonic()
+        except Exception as e:
+            # Mantenemos el esquema anterior; se reintentará en el siguiente ciclo.
+            self.stats["errors"] += 1
+            self.logger.warning("No se pudo revalidar el esquema '%s': %s", entry.agent.db_name, e)
+
+    def _ensure_refresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stop_event.clear()
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="SchemaRegistryRefresher", daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.ttl):
+            with self._lock:
+                entries = list(self._entries.values())
+            for entry in entries:
+                if time.monotonic() - entry.checked_at < self.ttl:
+                    continue
+                with entry.lock:
+                    self._revalidate(entry)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_schema_registry():
+    """
+    Retorna el registro de esquemas compartido por el proceso.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SchemaRegistry()
+    return _registry
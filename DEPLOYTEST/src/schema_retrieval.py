@@ -0,0 +1,223 @@
+# schema_retrieval.py
+
+import json
+import logging
+import re
+import unicodedata
+
+from text_utils import contar_tokens
+
+
+# Palabras frecuentes en las preguntas que no coinciden con los nombres técnicos (en inglés) del esquema.
+# Cada palabra normalizada apunta a tablas ("tabla") o columnas ("tabla.columna"; "*.columna" para cualquier tabla).
+SINONIMOS_DOMINIO = {
+    "vehiculo": ["detections"],
+    "auto": ["detections"],
+    "carro": ["detections"],
+    "coche": ["detections"],
+    "deteccion": ["detections"],
+    "detectado": ["detections"],
+    "placa": ["detections.description", "detections.attribute_id"],
+    "patente": ["detections.description", "detections.attribute_id"],
+    "color": ["detections.description", "detections.attribute_id"],
+    "camara": ["detections.object_id"],
+    "precision": ["detections.acurrancy"],
+    "objeto": ["object"],
+    "sistema": ["object"],
+    "hoy": ["*.init_time"],
+    "ayer": ["*.init_time"],
+    "fecha": ["*.init_time"],
+    "dia": ["*.init_time"],
+    "hora": ["*.init_time"],
+    "semana": ["*.init_time"],
+    "mes": ["*.init_time"],
+}
+
+_PALABRAS_VACIAS = {
+    "the", "and", "con", "del", "las", "los", "por", "para", "que", "una", "uno", "cuantos", "cuantas",
+    "como", "cual", "cuales", "muestra", "mostrar", "dame", "hay", "entre", "sus", "mas", "menos",
+}
+
+
+def normalizar_texto(texto):
+    """
+    Pasa a minúsculas, quita tildes y reemplaza todo lo que no sea letra o número por espacios.
+    """
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", texto).strip()
+
+
+def _raiz(palabra):
+    # Singular aproximado para que "vehículos" coincida con "vehiculo" y "detections" con "detection"
+    for sufijo in ("es", "s"):
+        if len(palabra) > 4 and palabra.endswith(sufijo):
+            return palabra[: -len(sufijo)]
+    return palabra
+
+
+def _palabras(texto):
+    return {
+        _raiz(p) for p in normalizar_texto(texto).split()
+        if len(p) > 2 and p not in _PALABRAS_VACIAS
+    }
+
+
+def _humanizar(nombre):
+    return " ".join(p.capitalize() for p in nombre.split("_"))
+
+
+class SchemaRetriever:
+    """
+    Selecciona la parte del esquema relevante para una pregunta.
+
+    Puntúa cada tabla y columna comparando las palabras de la pregunta (sin tildes ni plurales)
+    con sus nombres técnicos, los nombres legibles del mapa semántico y SINONIMOS_DOMINIO.
+    Conserva las `top_k_tables` tablas con mayor puntaje y las entrega en formato compacto,
+    una línea por tabla, en lugar del JSON indentado del esquema completo.
+    """
+
+    def __init__(self, top_k_tables=3, max_columns=12, synonyms=None, model="gpt-3.5-turbo"):
+        """
+        :param top_k_tables: Número máximo de tablas que se incluyen.
+        :param max_columns: Si una tabla tiene más columnas, solo se incluyen las relevantes, las llaves
+                            y las de mayor puntaje hasta completar este número.
+        :param synonyms: Diccionario de sinónimos (por defecto, SINONIMOS_DOMINIO).
+        :param model: Modelo usado para contar tokens.
+        """
+        self.top_k_tables = top_k_tables
+        self.max_columns = max_columns
+        self.synonyms = {_raiz(normalizar_texto(k)): v for k, v in (synonyms or SINONIMOS_DOMINIO).items()}
+        self.model = model
+        self.stats = {"requests": 0, "tokens_full": 0, "tokens_pruned": 0}
+        self._tokens_completo = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def puntuar(self, consulta, schema, semantic_map):
+        """
+        Puntúa tablas y columnas contra la pregunta.
+
+        :return: Tupla (puntajes_tablas, puntajes_columnas) con {tabla: puntaje} y {tabla: {columna: puntaje}}.
+        """
+        palabras = _palabras(consulta)
+        pistas = [d for p in palabras for d in self.synonyms.get(p, [])]
+        semantic_map = semantic_map or {}
+
+        puntajes_tablas = {}
+        puntajes_columnas = {}
+        for table, details in schema.items():
+            info_mapa = semantic_map.get(table, {})
+            puntaje_tabla = 3 * len(palabras & (_palabras(table) | _palabras(info_mapa.get("human_name", ""))))
+            puntaje_tabla += 3 * pistas.count(table)
+
+            columnas = {}
+            for col in details.get("columns", {}):
+                nombre_legible = info_mapa.get("columns", {}).get(col, "")
+                puntaje = len(palabras & (_palabras(col) | _palabras(nombre_legible)))
+                puntaje += pistas.count(f"{table}.{col}") + pistas.count(f"*.{col}")
+                columnas[col] = puntaje
+            puntajes_columnas[table] = columnas
+            puntajes_tablas[table] = puntaje_tabla + sum(columnas.values())
+        return puntajes_tablas, puntajes_columnas
+
+    def seleccionar(self, consulta, schema, semantic_map):
+        """
+        Retorna las tablas relevantes y, para cada una, las columnas a incluir.
+        Si ninguna tabla coincide con la pregunta, se conservan todas (mejor un prompt largo que uno sin la tabla correcta).
+
+        :return: Diccionario {tabla: [columnas]} en el orden del esquema.
+        """
+        puntajes_tablas, puntajes_columnas = self.puntuar(consulta, schema, semantic_map)
+        candidatas = [t for t, p in puntajes_tablas.items() if p > 0]
+        if candidatas:
+            candidatas.sort(key=lambda t: puntajes_tablas[t], reverse=True)
+            elegidas = set(candidatas[: self.top_k_tables])
+        else:
+            elegidas = set(schema)
+
+        seleccion = {}
+        for table, details in schema.items():
+            if table not in elegidas:
+                continue
+            columnas = details.get("columns", {})
+            if len(columnas) <= self.max_columns:
+                seleccion[table] = list(columnas)
+                continue
+            relaciones = {rel["column"] for rel in details.get("relations", [])}
+            obligatorias = [
+                c for c, info in columnas.items()
+                if puntajes_columnas[table][c] > 0 or info.get("key") == "PRI" or c in relaciones
+            ]
+            resto = sorted(
+                (c for c in columnas if c not in obligatorias),
+                key=lambda c: puntajes_columnas[table][c],
+                reverse=True,
+            )
+            incluidas = set(obligatorias + resto[: max(0, self.max_columns - len(obligatorias))])
+            seleccion[table] = [c for c in columnas if c in incluidas]
+        return seleccion
+
+    def contexto_compacto(self, consulta, schema, semantic_map):
+        """
+        Construye el texto compacto del esquema relevante para la pregunta:
+            tabla "Nombre legible": columna tipo [PK] "Nombre legible", ...
+            FK tabla.columna -> tabla.columna
+
+        :return: Texto para incluir en el prompt.
+        """
+        semantic_map = semantic_map or {}
+        lineas = []
+        for table, columnas in self.seleccionar(consulta, schema, semantic_map).items():
+            details = schema[table]
+            info_mapa = semantic_map.get(table, {})
+            partes = []
+            for col in columnas:
+                info = details["columns"][col]
+                parte = f"{col} {info.get('type', '')}".strip()
+                if info.get("key") == "PRI":
+                    parte += " PK"
+                nombre_legible = info_mapa.get("columns", {}).get(col)
+                if nombre_legible and nombre_legible != _humanizar(col):
+                    parte += f' "{nombre_legible}"'
+                partes.append(parte)
+            encabezado = table
+            if info_mapa.get("human_name") and info_mapa["human_name"] != _humanizar(table):
+                encabezado += f' "{info_mapa["human_name"]}"'
+            lineas.append(f"{encabezado}: {', '.join(partes)}")
+            for rel in details.get("relations", []):
+                if rel["column"] in columnas:
+                    lineas.append(f"FK {table}.{rel['column']} -> {rel['referenced_table']}.{rel['referenced_column']}")
+        return "\n".join(lineas)
+
+    def registrar_ahorro(self, prompt, contexto, schema, semantic_map):
+        """
+        Registra los tokens del prompt enviado y los que habría tenido con el esquema y el mapa
+        semántico completos en JSON. El conteo del esquema completo se reutiliza mientras no cambie.
+
+        :param prompt: Prompt enviado (con el contexto recortado).
+        :param contexto: Texto del contexto recortado incluido en el prompt.
+        :return: Diccionario {"tokens_full": ..., "tokens_pruned": ...}.
+        """
+        if self._tokens_completo.get("schema") is not schema or self._tokens_completo.get("semantic_map") is not semantic_map:
+            texto_completo = (
+                "Esquema de la base de datos (en formato JSON):\n"
+                f"{json.dumps(schema, indent=2, default=str)}\n\n"
+                "Mapa semántico (en formato JSON):\n"
+                f"{json.dumps(semantic_map, indent=2, default=str)}\n\n"
+            )
+            self._tokens_completo = {
+                "schema": schema,
+                "semantic_map": semantic_map,
+                "tokens": contar_tokens(texto_completo, self.model),
+            }
+        tokens_pruned = contar_tokens(prompt, self.model)
+        tokens_full = tokens_pruned - contar_tokens(contexto, self.model) + self._tokens_completo["tokens"]
+
+        self.stats["requests"] += 1
+        self.stats["tokens_full"] += tokens_full
+        self.stats["tokens_pruned"] += tokens_pruned
+        self.logger.info(
+            "Tokens del prompt: %d con el esquema completo, %d con el esquema recortado (%.0f%% menos).",
+            tokens_full, tokens_pruned, 100 * (1 - tokens_pruned / tokens_full) if tokens_full else 0,
+        )
+        return {"tokens_full": tokens_full, "tokens_pruned": tokens_pruned}
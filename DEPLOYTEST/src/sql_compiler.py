@@ -0,0 +1,351 @@
+# sql_compiler.py
+
+import datetime
+import decimal
+import logging
+import re
+import threading
+
+
+ACCIONES = {
+    "contar": "contar", "count": "contar", "conteo": "contar", "cantidad": "contar",
+    "listar": "listar", "list": "listar", "mostrar": "listar", "buscar": "listar", "obtener": "listar", "select": "listar",
+    "promedio": "promedio", "average": "promedio", "avg": "promedio", "media": "promedio",
+    "agrupar": "agrupar", "group_by": "agrupar", "distribucion": "agrupar",
+}
+
+OPERADORES = {
+    "=": "=", "$eq": "=",
+    "!=": "<>", "<>": "<>", "$ne": "<>",
+    ">": ">", "$gt": ">",
+    ">=": ">=", "$gte": ">=",
+    "<": "<", "$lt": "<",
+    "<=": "<=", "$lte": "<=",
+}
+
+# Referencias de fecha que se resuelven localmente (el resto queda para el LLM)
+_FECHA_RE = re.compile(
+    r"^(hoy|ayer|today|yesterday|\d{1,2}[/-]\d{1,2}[/-]\d{4}|\d{4}-\d{1,2}-\d{1,2})$", re.IGNORECASE
+)
+
+
+class NoCompilable(Exception):
+    """
+    La estructura tiene una forma que el compilador no soporta; el mensaje indica el motivo.
+    """
+
+
+def renderizar_sql(template, params=None):
+    """
+    Sustituye los parámetros %s de una plantilla por sus literales SQL, para mostrar la consulta
+    al usuario o usarla como llave de caché. Para ejecutar se usa siempre la plantilla con sus parámetros.
+    """
+    if not params:
+        return template
+    literales = []
+    for valor in params:
+        if valor is None:
+            literales.append("NULL")
+        elif isinstance(valor, bool):
+            literales.append("1" if valor else "0")
+        elif isinstance(valor, (int, float, decimal.Decimal)):
+            literales.append(str(valor))
+        else:
+            texto = str(valor).replace("\\", "\\\\").replace("'", "\\'")
+            literales.append(f"'{texto}'")
+    partes = template.split("%s")
+    return "".join(p + (literales[i] if i < len(literales) else "") for i, p in enumerate(partes))
+
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<cadena>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    | (?P<comentario>/\*.*?\*/|--[^\n]*|\#[^\n]*)
+    | (?P<identificador>`[^`]*`)
+    | (?P<numero>(?<![\w.])\d+(?:\.\d+)?(?![\w.]))
+    | (?P<palabra>\w+)
+    | (?P<operador><=|>=|<>|!=|=|<|>)
+    | (?P<espacio>\s+)
+    | (?P<otro>.)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+# Escapes de MySQL en literales de texto (\% y \_ conservan la barra, ya que son escapes de LIKE)
+_ESCAPES = {"0": "\0", "n": "\n", "t": "\t", "r": "\r", "b": "\b", "Z": "\x1a"}
+
+# Posiciones de un valor: tras un operador de comparación, LIKE, BETWEEN ... AND o dentro de IN (...)
+_POSICION_VALOR = {"operador", "like", "between", "between_and", "en_lista"}
+
+
+def _valor_cadena(literal):
+    cuerpo = literal[1:-1].replace(literal[0] * 2, literal[0])
+    return re.sub(
+        r"\\(.)", lambda m: m.group(0) if m.group(1) in "%_" else _ESCAPES.get(m.group(1), m.group(1)), cuerpo
+    )
+
+
+def parametrizar_sql(sql):
+    """
+    Convierte el SQL generado por el LLM en una plantilla con marcadores %s y sus parámetros, para que
+    las preguntas con la misma forma compartan la sentencia preparada y su plan.
+
+    Se extraen los textos entre comillas y los números comparados con =, <>, <, >, <=, >=, LIKE, BETWEEN
+    o IN (p. ej. las marcas de tiempo en milisegundos); los demás (alias entre comillas, LIMIT,
+    GROUP BY 1...) se conservan.
+    Si el SQL tiene '%' o '?' fuera de los textos, se deja tal cual.
+
+    :return: Tupla (plantilla, parámetros); los parámetros son None si no hubo nada que extraer.
+    """
+    if not isinstance(sql, str):
+        return sql, None
+    partes = []
+    params = []
+    anterior = None
+    en_between = False
+    en_lista = False
+    for token in _TOKEN_RE.finditer(sql):
+        tipo, texto = token.lastgroup, token.group()
+        if tipo == "otro" and texto in "%?":
+            return sql, None
+        if tipo == "cadena" and anterior in _POSICION_VALOR:
+            partes.append("%s")
+            params.append(_valor_cadena(texto))
+        elif tipo == "numero" and anterior in _POSICION_VALOR:
+            partes.append("%s")
+            params.append(decimal.Decimal(texto) if "." in texto else int(texto))
+        else:
+            partes.append(texto)
+
+        if tipo in ("espacio", "comentario"):
+            continue
+        if tipo == "otro" and (texto == "(" and anterior == "in" or texto == "," and en_lista):
+            anterior, en_lista = "en_lista", True
+        elif tipo != "palabra":
+            # La lista de IN sigue mientras solo tenga valores separados por comas
+            anterior, en_lista = tipo, en_lista and tipo in ("cadena", "numero")
+        elif texto.lower() == "and" and en_between:
+            # Segundo extremo de BETWEEN ... AND ...
+            anterior, en_between = "between_and", False
+        else:
+            anterior, en_lista = texto.lower(), False
+            en_between = en_between or anterior == "between"
+    if not params:
+        return sql, None
+    return "".join(partes), tuple(params)
+
+
+class SQLCompiler:
+    """
+    Compila localmente, sin LLM, las estructuras de consulta simples a SQL parametrizado para MySQL.
+
+    Soporta las acciones contar, listar, promedio (con 'columna') y agrupar (por 'agrupar_por' o 'columna',
+    por ejemplo por description), con filtros de igualdad, listas (IN) y operadores de rango
+    (>=, <=, >, <, !=, y sus variantes $gte, $lte, ...). Las fechas ('dd-mm-yyyy', 'hoy', 'ayer')
+    sobre la columna de tiempo se convierten al rango del día en milisegundos.
+    Cualquier otra forma se rechaza para que la resuelva el LLM.
+    """
+
+    def __init__(self, limit=25, parse_date_reference=None, time_columns_ms=("init_time",)):
+        """
+        :param limit: Límite de registros de las consultas que listan o agrupan.
+        :param parse_date_reference: Función que convierte una referencia de fecha en (inicio_ms, fin_ms)
+                                     (por ejemplo, SQLGenerationAgent._parse_date_reference).
+        :param time_columns_ms: Columnas numéricas que guardan marcas de tiempo en milisegundos.
+        """
+        self.limit = limit
+        self.parse_date_reference = parse_date_reference
+        self.time_columns_ms = tuple(time_columns_ms)
+        self._lock = threading.Lock()
+        self._counters = {"total": 0, "compiled": 0, "fallback": 0}
+        self._motivos = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def compilar(self, estructura, schema, rango_tiempo=None):
+        """
+        Compila una estructura de consulta.
+
+        :param estructura: Diccionario con 'accion', 'tabla' y 'filtros' (y opcionalmente 'columna' o 'agrupar_por').
+        :param schema: Esquema de la base de datos.
+        :param rango_tiempo: Tupla opcional (inicio_ms, fin_ms) que se aplica a la columna de tiempo de la tabla.
+        :return: Tupla (plantilla, parámetros), o None si la estructura no es compilable.
+        """
+        try:
+            resultado = self._compilar(estructura, schema, rango_tiempo)
+        except NoCompilable as e:
+            self._registrar(str(e))
+            self.logger.info("Estructura no compilable localmente (%s); se usará el LLM.", e)
+            return None
+        self._registrar(None)
+        return resultado
+
+    def stats(self):
+        """
+        Retorna la cobertura del compilador: cuántas estructuras se compilaron sin LLM y
+        los motivos por los que el resto se derivó al LLM.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["fallback_reasons"] = dict(self._motivos)
+        counters["coverage"] = round(counters["compiled"] / counters["total"], 4) if counters["total"] else 0.0
+        return counters
+
+    def _registrar(self, motivo):
+        with self._lock:
+            self._counters["total"] += 1
+            if motivo is None:
+                self._counters["compiled"] += 1
+            else:
+                self._counters["fallback"] += 1
+                self._motivos[motivo] = self._motivos.get(motivo, 0) + 1
+
+    def _compilar(self, estructura, schema, rango_tiempo):
+        if not isinstance(estructura, dict):
+            raise NoCompilable("estructura no es un objeto")
+        tabla = estructura.get("tabla")
+        if tabla not in schema:
+            raise NoCompilable("tabla desconocida")
+        columnas = schema[tabla]["columns"]
+
+        extras = set(estructura) - {"accion", "tabla", "filtros", "columna", "agrupar_por"}
+        if extras:
+            raise NoCompilable(f"claves no soportadas: {', '.join(sorted(extras))}")
+
+        accion = ACCIONES.get(str(estructura.get("accion", "")).strip().lower())
+        agrupar_por = estructura.get("agrupar_por")
+        if accion is None:
+            raise NoCompilable(f"accion no soportada: {estructura.get('accion')}")
+        if accion == "agrupar":
+            agrupar_por = agrupar_por or estructura.get("columna")
+
+        condiciones = []
+        params = []
+        filtros = estructura.get("filtros") or {}
+        if not isinstance(filtros, dict):
+            raise NoCompilable("filtros no son un objeto")
+        for columna, valor in filtros.items():
+            if columna not in columnas:
+                raise NoCompilable("columna desconocida")
+            self._compilar_filtro(columna, columnas[columna], valor, condiciones, params)
+
+        if rango_tiempo is not None:
+            columna_tiempo = self._columna_tiempo(columnas)
+            if columna_tiempo and columna_tiempo not in filtros:
+                inicio, fin = rango_tiempo
+                condiciones.append(f"`{columna_tiempo}` BETWEEN %s AND %s")
+                params.extend(self._valores_tiempo(columnas[columna_tiempo], (inicio, fin)))
+
+        where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        limit = int(self.limit)
+
+        if agrupar_por:
+            if agrupar_por not in columnas:
+                raise NoCompilable("columna de agrupación desconocida")
+            if accion not in ("contar", "agrupar"):
+                raise NoCompilable(f"accion no soportada con agrupación: {accion}")
+            return (
+                f"SELECT `{agrupar_por}`, COUNT(*) AS cantidad FROM `{tabla}`{where} "
+                f"GROUP BY `{agrupar_por}` ORDER BY cantidad DESC LIMIT {limit}",
+                tuple(params),
+            )
+        if accion == "contar":
+            return f"SELECT COUNT(*) AS total FROM `{tabla}`{where}", tuple(params)
+        if accion == "promedio":
+            columna = estructura.get("columna")
+            if columna not in columnas:
+                raise NoCompilable("columna de promedio desconocida")
+            return f"SELECT AVG(`{columna}`) AS promedio FROM `{tabla}`{where}", tuple(params)
+        if accion == "listar":
+            orden = self._columna_tiempo(columnas)
+            order_by = f" ORDER BY `{orden}` DESC" if orden else ""
+            return f"SELECT * FROM `{tabla}`{where}{order_by} LIMIT {limit}", tuple(params)
+        raise NoCompilable(f"accion no soportada: {accion}")
+
+    def _compilar_filtro(self, columna, info, valor, condiciones, params):
+        es_tiempo = self._es_columna_tiempo(columna, info)
+
+        if isinstance(valor, list):
+            if not valor or not all(self._es_escalar(v) for v in valor):
+                raise NoCompilable("lista de valores no soportada")
+            if es_tiempo and not all(isinstance(v, int) for v in valor):
+                raise NoCompilable("valor de tiempo no soportado")
+            condiciones.append(f"`{columna}` IN ({', '.join(['%s'] * len(valor))})")
+            params.extend(valor)
+            return
+
+        if isinstance(valor, dict):
+            if not valor:
+                raise NoCompilable("filtro vacío")
+            for op, operando in valor.items():
+                if op == "$in" and isinstance(operando, list):
+                    self._compilar_filtro(columna, info, operando, condiciones, params)
+                    continue
+                sql_op = OPERADORES.get(op)
+                if sql_op is None:
+                    raise NoCompilable("operador no soportado")
+                if es_tiempo and self._es_fecha(operando):
+                    inicio, fin = self._valores_tiempo(info, self._rango_fecha(operando))
+                    # Las cotas inferiores usan el inicio del día y las superiores el final
+                    operando = {">=": inicio, "<": inicio, ">": fin, "<=": fin}.get(sql_op)
+                    if operando is None:
+                        raise NoCompilable("operador no soportado para fechas")
+                elif not self._es_escalar(operando):
+                    raise NoCompilable("valor no soportado")
+                elif es_tiempo and not isinstance(operando, int):
+                    raise NoCompilable("valor de tiempo no soportado")
+                condiciones.append(f"`{columna}` {sql_op} %s")
+                params.append(operando)
+            return
+
+        if not self._es_escalar(valor):
+            raise NoCompilable("valor no soportado")
+        if es_tiempo and self._es_fecha(valor):
+            condiciones.append(f"`{columna}` BETWEEN %s AND %s")
+            params.extend(self._valores_tiempo(info, self._rango_fecha(valor)))
+            return
+        if valor is None:
+            condiciones.append(f"`{columna}` IS NULL")
+            return
+        if es_tiempo and not isinstance(valor, int):
+            # Solo los enteros se toman como milisegundos; otras referencias ('última semana',
+            # '2025-03-01 10:00') se comparan mal como texto y quedan para el LLM
+            raise NoCompilable("valor de tiempo no soportado")
+        condiciones.append(f"`{columna}` = %s")
+        params.append(valor)
+
+    @staticmethod
+    def _es_escalar(valor):
+        # bool es subclase de int, pero True no debe compilarse como 1
+        return valor is None or (isinstance(valor, (str, int, float)) and not isinstance(valor, bool))
+
+    @staticmethod
+    def _es_fecha(valor):
+        return isinstance(valor, str) and _FECHA_RE.match(valor.strip()) is not None
+
+    def _rango_fecha(self, valor):
+        if self.parse_date_reference is None:
+            raise NoCompilable("sin intérprete de fechas")
+        return self.parse_date_reference(valor.strip())
+
+    def _es_columna_tiempo(self, columna, info):
+        tipo = str(info.get("type", "")).lower()
+        return columna in self.time_columns_ms or "timestamp" in tipo or "datetime" in tipo or tipo == "date"
+
+    def _columna_tiempo(self, columnas):
+        for columna in self.time_columns_ms:
+            if columna in columnas:
+                return columna
+        for columna, info in columnas.items():
+            if self._es_columna_tiempo(columna, info):
+                return columna
+        return None
+
+    def _valores_tiempo(self, info, rango):
+        """
+        Convierte un rango (inicio_ms, fin_ms) al tipo de la columna: milisegundos para columnas numéricas
+        y 'aaaa-mm-dd hh:mm:ss' para columnas de fecha.
+        """
+        tipo = str(info.get("type", "")).lower()
+        if "timestamp" in tipo or "datetime" in tipo or tipo == "date":
+            return [datetime.datetime.fromtimestamp(ms / 1000).strftime("%Y-%m-%d %H:%M:%S") for ms in rango]
+        return list(rango)
@@ -1,15 +1,18 @@
 import logging
 import datetime
-import openai
 import json
 import re
 
+from llm_client import chat_completion, chat_completion_async
+from sql_compiler import SQLCompiler, renderizar_sql
+
 class SQLGenerationAgent:
     def __init__(self, limit=15, openai_api_key=None):
         self.limit = limit
         self.logger = logging.getLogger(self.__class__.__name__)
-        if openai_api_key:
-            openai.api_key = openai_api_key
+        # Las estructuras simples se compilan localmente; solo el resto se envía al LLM
+        self.compiler = SQLCompiler(limit=limit, parse_date_reference=self._parse_date_reference)
+        self.openai_api_key = openai_api_key
 
     def _parse_date_reference(self, date_reference):
         today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -80,10 +83,108 @@ class SQLGenerationAgent:
         return None
 
     def generar_sql(self, estructura_consulta, schema, query_text=None):
+        estructuras = estructura_consulta if isinstance(estructura_consulta, list) else [estructura_consulta]
+        sql_queries = []
+        for estructura in estructuras:
+            compilado = self.compilar(estructura, schema, query_text)
+            if compilado is not None:
+                sql_queries.append(renderizar_sql(*compilado))
+                continue
+            prompt = self.preparar_prompt(estructura, schema, query_text)
+            if prompt is not None:
+                sql_queries.append(self.solicitar_sql(prompt))
+        return self._unir_consultas(sql_queries)
+
+    async def generar_sql_async(self, estructura_consulta, schema, query_text=None):
+        """
+        Versión asíncrona de generar_sql: las llamadas a OpenAI usan HTTP asíncrono.
+        """
+        estructuras = estructura_consulta if isinstance(estructura_consulta, list) else [estructura_consulta]
+        sql_queries = []
+        for estructura in estructuras:
+            compilado = self.compilar(estructura, schema, query_text)
+            if compilado is not None:
+                sql_queries.append(renderizar_sql(*compilado))
+                continue
+            prompt = self.preparar_prompt(estructura, schema, query_text)
+            if prompt is not None:
+                sql_queries.append(await self.solicitar_sql_async(prompt))
+        return self._unir_consultas(sql_queries)
+
+    def compilar(self, estructura, schema, query_text=None):
+        """
+        Compila la estructura localmente a SQL parametrizado, sin llamar al LLM.
+        Si query_text menciona una fecha (hoy, ayer, un rango...), se aplica a la columna de tiempo.
+
+        :return: Tupla (plantilla, parámetros), o None si la estructura requiere el LLM.
+        """
+        rango_tiempo = None
+        if query_text:
+            date_ref = self._extract_date_references(query_text)
+            if isinstance(date_ref, tuple):
+                rango_tiempo = (self._parse_date_reference(date_ref[0])[0], self._parse_date_reference(date_ref[1])[1])
+            elif date_ref:
+                rango_tiempo = self._parse_date_reference(date_ref)
+        return self.compiler.compilar(estructura, schema, rango_tiempo=rango_tiempo)
+
+    def preparar_prompt(self, estructura, schema, query_text=None):
+        """
+        Construye el prompt de una sola estructura de consulta.
+
+        :return: Prompt para el LLM, o None si la tabla de la estructura no es válida.
+        """
+        prompts = self._preparar_prompts([estructura], schema, query_text)
+        return prompts[0] if prompts else None
+
+    def _unir_consultas(self, sql_queries):
+        return sql_queries if len(sql_queries) > 1 else (sql_queries[0] if sql_queries else None)
+
+    def solicitar_sql(self, prompt):
+        """
+        Envía a OpenAI el prompt de una estructura y retorna el SQL generado (None si falla).
+        """
+        try:
+            # Llamada a OpenAI para generar la consulta SQL
+            response = chat_completion(
+                caller="SQLGenerationAgent",
+                api_key=self.openai_api_key,
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+            )
+            return response["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            self.logger.error(f"Error generating SQL with OpenAI: {e}")
+            return None
+
+    async def solicitar_sql_async(self, prompt):
+        """
+        Versión asíncrona de solicitar_sql.
+        """
+        try:
+            response = await chat_completion_async(
+                caller="SQLGenerationAgent",
+                api_key=self.openai_api_key,
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+            )
+            return response["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            self.logger.error(f"Error generating SQL with OpenAI: {e}")
+            return None
+
+    def _preparar_prompts(self, estructura_consulta, schema, query_text=None):
+        """
+        Normaliza los filtros de cada estructura de consulta y construye el prompt para generar su SQL.
+        Las estructuras con una tabla inválida se omiten.
+
+        :return: Lista de prompts, uno por estructura válida.
+        """
         if isinstance(estructura_consulta, dict):
             estructura_consulta = [estructura_consulta]
 
-        sql_queries = []
+        prompts = []
 
         for estructura in estructura_consulta:
             table = estructura.get("tabla", "")
@@ -262,17 +363,6 @@ class SQLGenerationAgent:
 
     Respond only with the generated SQL query.
     """
-            try:
-                # Llamada a OpenAI para generar la consulta SQL
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.0,
-                )
-                sql_query = response["choices"][0]["message"]["content"].strip()
-                sql_queries.append(sql_query)
-            except Exception as e:
-                self.logger.error(f"Error generating SQL with OpenAI: {e}")
-                sql_queries.append(None)
+            prompts.append(prompt)
 
-        return sql_queries if len(sql_queries) > 1 else (sql_queries[0] if sql_queries else None)
\ No newline at end of file
+        return prompts
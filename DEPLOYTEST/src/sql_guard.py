@@ -0,0 +1,315 @@
+# sql_guard.py
+
+import json
+import logging
+import re
+import threading
+
+
+# Código de error de MySQL al superar MAX_EXECUTION_TIME
+ER_QUERY_TIMEOUT = 3024
+
+# Sentencias de solo lectura que no se revisan (no recorren tablas de datos)
+_SIN_REVISION = {"show", "describe", "desc", "explain"}
+
+# Operaciones del plan que necesitan leer todas las filas antes de entregar la primera
+_BLOQUEANTES = ("grouping_operation", "duplicates_removal", "windowing", "union_result")
+
+_AGREGADO_RE = re.compile(r"\b(count|sum|avg|min|max|group_concat|std|stddev|variance)\s*\(", re.IGNORECASE)
+
+
+def _enmascarar(sql):
+    """
+    Reemplaza por espacios los literales, los identificadores entre comillas, los comentarios y el
+    contenido entre paréntesis (conservando los paréntesis externos y las posiciones), de modo que
+    las búsquedas de palabras clave solo vean el nivel superior de la consulta.
+    """
+    salida = []
+    nivel = 0
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if c in "'\"`":
+            fin = i + 1
+            while fin < n and sql[fin] != c:
+                fin += 2 if sql[fin] == "\\" else 1
+            fin = min(fin + 1, n)
+        elif sql.startswith("/*", i):
+            fin = sql.find("*/", i + 2)
+            fin = n if fin < 0 else fin + 2
+        elif sql.startswith("--", i) or c == "#":
+            fin = sql.find("\n", i)
+            fin = n if fin < 0 else fin
+        else:
+            if c == "(":
+                nivel += 1
+                salida.append("(" if nivel == 1 else " ")
+            elif c == ")" and nivel:
+                nivel -= 1
+                salida.append(")" if nivel == 0 else " ")
+            else:
+                salida.append(c if nivel == 0 else " ")
+            i += 1
+            continue
+        salida.append(" " * (fin - i))
+        i = fin
+    return "".join(salida)
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _recorrer(nodo, previas=1.0):
+    """
+    Estima las filas examinadas de un nodo del plan de EXPLAIN FORMAT=JSON.
+
+    :param previas: Filas producidas por las tablas anteriores del nested loop (cada una repite el recorrido).
+    :return: Tupla (filas_examinadas, filas_producidas, tablas_sin_indice, bloqueante).
+    """
+    examinadas, producidas, sin_indice, bloqueante = 0.0, None, [], False
+    if isinstance(nodo, list):
+        for elemento in nodo:
+            e, p, s, b = _recorrer(elemento, previas)
+            examinadas += e
+            sin_indice += s
+            bloqueante = bloqueante or b
+            producidas = p if p is not None else producidas
+        return examinadas, producidas, sin_indice, bloqueante
+    if not isinstance(nodo, dict):
+        return examinadas, producidas, sin_indice, bloqueante
+
+    if nodo.get("using_temporary_table") or nodo.get("using_filesort") or any(k in nodo for k in _BLOQUEANTES):
+        bloqueante = True
+
+    if "nested_loop" in nodo:
+        # Cada tabla se recorre una vez por cada fila producida por las anteriores
+        acumuladas = previas
+        for elemento in nodo["nested_loop"]:
+            e, p, s, b = _recorrer(elemento, acumuladas)
+            examinadas += e
+            sin_indice += s
+            bloqueante = bloqueante or b
+            if p is not None:
+                acumuladas = producidas = p
+    elif isinstance(nodo.get("table"), dict) and "table_name" in nodo["table"]:
+        tabla = nodo["table"]
+        # MySQL informa rows_examined_per_scan; MariaDB, rows
+        por_recorrido = _numero(tabla.get("rows_examined_per_scan", tabla.get("rows")))
+        examinadas += previas * por_recorrido
+        producidas = _numero(tabla.get("rows_produced_per_join", por_recorrido * _numero(tabla.get("filtered", 100)) / 100))
+        if tabla.get("access_type") == "ALL":
+            sin_indice.append(tabla["table_name"])
+        for clave, valor in tabla.items():
+            if isinstance(valor, (dict, list)):
+                e, _, s, b = _recorrer(valor)
+                examinadas += e
+                sin_indice += s
+                bloqueante = bloqueante or b or clave == "materialized_from_subquery"
+
+    for clave, valor in nodo.items():
+        if clave in ("nested_loop", "table") or not isinstance(valor, (dict, list)):
+            continue
+        e, p, s, b = _recorrer(valor, previas)
+        examinadas += e
+        sin_indice += s
+        bloqueante = bloqueante or b
+        if producidas is None:
+            producidas = p
+    return examinadas, producidas, sin_indice, bloqueante
+
+
+def estimar_plan(plan, limite=None):
+    """
+    Estima el trabajo de una consulta a partir de su plan (EXPLAIN FORMAT=JSON ya decodificado).
+
+    Con un LIMIT y sin operaciones que necesiten leer todo antes de responder (agrupación, orden sin
+    índice, tablas temporales, uniones), la lectura se corta al completar el límite, por lo que se
+    estima proporcional a las filas pedidas.
+
+    :param plan: Diccionario con la clave "query_block".
+    :param limite: Filas del LIMIT del nivel superior, o None si no tiene (o hay agregados).
+    :return: Diccionario {"filas_examinadas", "costo", "tablas_sin_indice", "bloqueante"}.
+    """
+    bloque = plan.get("query_block", plan)
+    examinadas, producidas, sin_indice, bloqueante = _recorrer(bloque)
+    if limite is not None and not bloqueante and producidas:
+        examinadas = min(examinadas, limite * examinadas / producidas)
+    return {
+        "filas_examinadas": int(examinadas),
+        "costo": _numero(bloque.get("cost_info", {}).get("query_cost")),
+        "tablas_sin_indice": sorted(set(sin_indice)),
+        "bloqueante": bloqueante,
+    }
+
+
+def es_tiempo_excedido(error):
+    """
+    Indica si el error de MySQL corresponde a una consulta cortada por MAX_EXECUTION_TIME.
+    """
+    return getattr(error, "errno", None) == ER_QUERY_TIMEOUT
+
+
+def rechazo_tiempo_excedido(sql, max_execution_ms):
+    """
+    Rechazo estructurado de una consulta que el servidor interrumpió por superar su tiempo máximo.
+    """
+    return {
+        "codigo": "tiempo_excedido",
+        "motivo": f"tardaba más de {max_execution_ms / 1000:g} segundos y el servidor la interrumpió",
+        "sugerencia": "Prueba acotando la pregunta a un rango de fechas más corto, una cámara o un color.",
+        "max_execution_ms": max_execution_ms,
+        "sql": sql,
+    }
+
+
+class SQLGuard:
+    """
+    Revisión previa a la ejecución del SQL generado por el LLM.
+
+    - Solo se ejecutan sentencias de lectura (SELECT / WITH); el resto se rechaza.
+    - Si la consulta no tiene LIMIT en el nivel superior, se le agrega uno.
+    - Se estima con EXPLAIN FORMAT=JSON cuántas filas recorrerá; si superan `max_rows_examined`,
+      la consulta se rechaza (accion="rechazar") o se ejecuta con el tiempo máximo reducido
+      `max_execution_ms_excedida` (accion="acotar").
+    - Cada SELECT lleva el hint MAX_EXECUTION_TIME, de modo que el servidor la corta si se extiende.
+
+    Los rechazos son diccionarios {"codigo", "motivo", "sugerencia", ...} que el formateador muestra al usuario.
+    """
+
+    def __init__(self, max_rows_examined=1000000, max_execution_ms=15000, default_limit=1000, accion="rechazar",
+                 max_execution_ms_excedida=3000):
+        """
+        :param max_rows_examined: Máximo de filas examinadas estimadas por consulta.
+        :param max_execution_ms: Tiempo máximo de ejecución de cada SELECT en milisegundos (None para no limitar).
+        :param default_limit: LIMIT que se agrega a las consultas que no lo tienen (None para no agregarlo).
+        :param accion: "rechazar" o "acotar" para las consultas que superan el máximo de filas.
+        :param max_execution_ms_excedida: Tiempo máximo de las consultas acotadas (accion="acotar").
+        """
+        if accion not in ("rechazar", "acotar"):
+            raise ValueError(f"Acción no soportada: {accion}")
+        self.max_rows_examined = max_rows_examined
+        self.max_execution_ms = max_execution_ms
+        self.default_limit = default_limit
+        self.accion = accion
+        self.max_execution_ms_excedida = max_execution_ms_excedida
+        self._lock = threading.Lock()
+        self._contadores = {"checked": 0, "rejected": 0, "throttled": 0, "limited": 0, "explain_errors": 0}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def revisar(self, cursor, sql, params=None):
+        """
+        Revisa una consulta antes de ejecutarla, usando el cursor para el EXPLAIN.
+
+        :param cursor: Cursor de la conexión en la que se ejecutará la consulta.
+        :param sql: Consulta SQL (una sentencia); puede ser una plantilla con marcadores %s.
+        :param params: Parámetros de la plantilla.
+        :return: Tupla (sql, rechazo): el SQL a ejecutar (con LIMIT y hint agregados) y None,
+                 o el SQL original y el diccionario del rechazo.
+        """
+        self._contar("checked")
+        sql = sql.strip().rstrip(";").rstrip()
+        enmascarado = _enmascarar(sql)
+        palabras = enmascarado.split(None, 1)
+        tipo = palabras[0].lower() if palabras else ""
+        if tipo in _SIN_REVISION:
+            return sql, None
+        if tipo not in ("select", "with"):
+            self._contar("rejected")
+            return sql, {
+                "codigo": "sentencia_no_permitida",
+                "motivo": f"solo se pueden ejecutar consultas de lectura y la generada es un {tipo.upper() or 'texto vacío'}",
+                "sugerencia": "Reformula la pregunta como una consulta sobre los datos existentes.",
+                "sql": sql,
+            }
+
+        limite = self._limite(enmascarado)
+        if limite is None and self.default_limit is not None:
+            sql = f"{sql} LIMIT {int(self.default_limit)}"
+            limite = int(self.default_limit)
+            self._contar("limited")
+        if _AGREGADO_RE.search(enmascarado):
+            # Con agregados el LIMIT se aplica al resultado, no a las filas leídas
+            limite = None
+
+        max_execution_ms = self.max_execution_ms
+        estimacion = self._estimar(cursor, sql, params, limite)
+        if estimacion is not None and self.max_rows_examined is not None \
+                and estimacion["filas_examinadas"] > self.max_rows_examined:
+            if self.accion == "rechazar":
+                self._contar("rejected")
+                self.logger.warning("Consulta rechazada (%d filas estimadas): %s", estimacion["filas_examinadas"], sql)
+                return sql, self._rechazo_filas(sql, estimacion)
+            self._contar("throttled")
+            self.logger.warning("Consulta acotada a %d ms (%d filas estimadas): %s",
+                                self.max_execution_ms_excedida, estimacion["filas_examinadas"], sql)
+            max_execution_ms = self.max_execution_ms_excedida
+        return self._con_tiempo_maximo(sql, max_execution_ms), None
+
+    def stats(self):
+        """
+        Retorna los contadores de consultas revisadas, rechazadas, acotadas, con LIMIT agregado y EXPLAIN fallidos.
+        """
+        with self._lock:
+            return dict(self._contadores)
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1
+
+    def _limite(self, enmascarado):
+        coincidencias = re.findall(r"\blimit\s+(\d+)(?:\s*,\s*(\d+))?", enmascarado, re.IGNORECASE)
+        if not coincidencias:
+            return None
+        # En "LIMIT desplazamiento, filas" el segundo número es el de filas
+        primero, segundo = coincidencias[-1]
+        return int(segundo or primero)
+
+    def _estimar(self, cursor, sql, params, limite):
+        try:
+            cursor.execute(f"EXPLAIN FORMAT=JSON {sql}", params)
+            fila = cursor.fetchone()
+            # Se descartan filas sobrantes para dejar el cursor listo para la consulta
+            cursor.fetchall()
+            if not fila:
+                return None
+            return estimar_plan(json.loads(fila[0]), limite)
+        except Exception as e:
+            # Si el EXPLAIN falla la consulta se ejecuta igual (con LIMIT y tiempo máximo); su error, si lo tiene,
+            # se informa en la ejecución
+            self._contar("explain_errors")
+            self.logger.warning("No se pudo estimar el costo de la consulta: %s", e)
+            return None
+
+    def _con_tiempo_maximo(self, sql, max_execution_ms):
+        if not max_execution_ms or re.search(r"MAX_EXECUTION_TIME", sql, re.IGNORECASE):
+            return sql
+        # El hint va después del SELECT del nivel superior (en un WITH, el de la consulta principal)
+        select = re.search(r"\bselect\b", _enmascarar(sql), re.IGNORECASE)
+        if select is None:
+            return sql
+        return f"{sql[:select.end()]} /*+ MAX_EXECUTION_TIME({int(max_execution_ms)}) */{sql[select.end():]}"
+
+    def _rechazo_filas(self, sql, estimacion):
+        sugerencia = "Prueba acotando la pregunta a un rango de fechas, una cámara o un color."
+        if estimacion["tablas_sin_indice"]:
+            sugerencia += (
+                " La consulta recorre completa la tabla " + ", ".join(estimacion["tablas_sin_indice"])
+                + "; los filtros sobre expresiones (p. ej. LEFT(object_id, ...)) no pueden usar índices."
+            )
+        return {
+            "codigo": "filas_estimadas",
+            "motivo": (
+                f"recorrería unas {estimacion['filas_examinadas']:,} filas".replace(",", ".")
+                + f" y el máximo permitido es {self.max_rows_examined:,}".replace(",", ".")
+            ),
+            "sugerencia": sugerencia,
+            "filas_estimadas": estimacion["filas_examinadas"],
+            "max_rows_examined": self.max_rows_examined,
+            "costo_estimado": estimacion["costo"],
+            "tablas_sin_indice": estimacion["tablas_sin_indice"],
+            "sql": sql,
+        }
@@ -0,0 +1,111 @@
+# text_utils.py
+
+import re
+import unicodedata
+
+try:
+    import tiktoken
+except ImportError:  # El conteo se aproxima por caracteres si tiktoken no está instalado
+    tiktoken = None
+
+
+_CLAUSULAS_RE = re.compile(r"\b(select|from|where|group\s+by|having|order\s+by|limit)\b", re.IGNORECASE)
+
+
+def contar_tokens(texto, model="gpt-3.5-turbo"):
+    """
+    Cuenta los tokens de un texto con tiktoken; sin tiktoken, estima un token cada 4 caracteres.
+    """
+    if tiktoken is not None:
+        try:
+            return len(tiktoken.encoding_for_model(model).encode(texto))
+        except Exception:
+            pass
+    return max(1, len(texto) // 4)
+
+
+def normalizar_pregunta(pregunta):
+    """
+    Minúsculas, sin tildes ni signos de puntuación, conservando '/' y '-' de las fechas.
+    """
+    texto = unicodedata.normalize("NFKD", pregunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9/-]+", " ", texto).split())
+
+
+def profundidad_sql(texto, posicion):
+    """
+    Nivel de paréntesis de `texto` en `posicion` (0 = nivel superior).
+    """
+    return texto.count("(", 0, posicion) - texto.count(")", 0, posicion)
+
+
+def dividir_sql(texto, separador):
+    """
+    Divide `texto` por el patrón `separador` solo en el nivel superior (fuera de paréntesis).
+    """
+    partes, inicio = [], 0
+    for m in re.finditer(separador, texto, re.IGNORECASE):
+        if profundidad_sql(texto, m.start()) == 0:
+            partes.append(texto[inicio:m.start()].strip())
+            inicio = m.end()
+    partes.append(texto[inicio:].strip())
+    return [p for p in partes if p]
+
+
+def clausulas_sql(texto):
+    """
+    :return: {cláusula: texto} de las cláusulas del nivel superior (select, from, where, group by, ...),
+             en el orden en que aparecen.
+    """
+    clausulas, actual, inicio = {}, None, 0
+    for m in _CLAUSULAS_RE.finditer(texto):
+        if profundidad_sql(texto, m.start()) != 0:
+            continue
+        if actual:
+            clausulas[actual] = texto[inicio:m.start()].strip()
+        actual, inicio = " ".join(m.group(1).lower().split()), m.end()
+    if actual:
+        clausulas[actual] = texto[inicio:].strip()
+    return clausulas
+
+
+def separar_alias(elemento):
+    """
+    Separa un elemento del SELECT en su expresión y su alias (None si no tiene).
+    """
+    m = re.match(r"^(?P<expr>.+?)(?:\s+as)?\s+`?(?P<alias>\w+)`?$", elemento, re.IGNORECASE | re.DOTALL)
+    if m and not re.search(r"[-+*/%,(=<>]$", m.group("expr").rstrip()) \
+            and profundidad_sql(m.group("expr"), len(m.group("expr"))) == 0:
+        return m.group("expr"), m.group("alias")
+    return elemento, None
+
+
+def condiciones_sql(where):
+    """
+    Divide un WHERE en sus condiciones unidas por AND (sin separar BETWEEN x AND y), sin los paréntesis
+    que las envuelven.
+    """
+    condiciones, pendiente = [], False
+    for condicion in dividir_sql(where, r"\band\b"):
+        if pendiente:
+            # BETWEEN x AND y queda partido por el AND: se vuelve a unir
+            condiciones[-1], pendiente = f"{condiciones[-1]} AND {condicion}", False
+            continue
+        condiciones.append(condicion)
+        pendiente = any(profundidad_sql(condicion, m.start()) == 0 for m in re.finditer(r"\bbetween\b", condicion, re.IGNORECASE))
+    resultado = []
+    for condicion in condiciones:
+        condicion = condicion.strip()
+        while condicion.startswith("(") and condicion.endswith(")") and profundidad_sql(condicion[1:-1], len(condicion) - 2) == 0:
+            condicion = condicion[1:-1].strip()
+        resultado.append(condicion)
+    return resultado
+
+
+def normalizar_expresion(expresion):
+    """
+    Forma canónica de una columna o expresión: sin comillas invertidas, sin prefijo de tabla y en minúsculas.
+    """
+    expresion = re.sub(r"\b[a-zA-Z_]\w*\.(?=[a-zA-Z_])", "", expresion.replace("`", ""))
+    return re.sub(r"\s+", "", expresion.lower())
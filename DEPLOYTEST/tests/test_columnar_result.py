@@ -0,0 +1,99 @@
+# tests/test_columnar_result.py
+
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar_result import ColumnarResult
+
+COLUMNAS = ["id", "description", "acurrancy", "fecha"]
+FILAS = [
+    (1, "red", decimal.Decimal("0.95"), datetime.datetime(2025, 3, 1, 10, 30)),
+    (2, b"blue", None, datetime.datetime(2025, 3, 1, 11, 0)),
+    (3, None, 0.5, None),
+]
+
+
+def test_from_rows_infiere_tipos_por_columna():
+    resultado = ColumnarResult.from_rows(COLUMNAS, FILAS, truncated=False)
+    assert resultado.num_rows == 3
+    assert resultado.column("id").dtype == np.int64
+    assert resultado.column("description").dtype == object
+    assert resultado.column("acurrancy").dtype == np.float64
+    assert np.isnan(resultado.column("acurrancy")[1])
+    assert resultado.column("fecha").dtype == np.dtype("datetime64[us]")
+    assert np.isnat(resultado.column("fecha")[2])
+    # Los binarios se decodifican
+    assert resultado.column("description").tolist() == ["red", "blue", None]
+
+
+def test_from_rows_sin_filas():
+    resultado = ColumnarResult.from_rows(["total"], [])
+    assert resultado.num_rows == 0
+    assert resultado["columns"] == ["total"]
+    assert list(resultado["data"]) == []
+
+
+def test_from_chunks_equivale_a_from_rows():
+    filas = [(i, f"cam{i % 3}") for i in range(10)]
+    por_bloques = ColumnarResult.from_chunks(["id", "camara"], [filas[:4], filas[4:8], filas[8:]])
+    assert por_bloques["data"] == ColumnarResult.from_rows(["id", "camara"], filas)["data"]
+    assert por_bloques.column("id").dtype == np.int64
+
+
+def test_from_chunks_con_tipos_distintos_entre_bloques():
+    # El segundo bloque tiene un nulo: la columna ya no puede ser int64
+    resultado = ColumnarResult.from_chunks(["attribute_id"], [[(1,), (2,)], [(None,), (4,)]])
+    assert resultado.column("attribute_id").dtype == object
+    assert resultado["data"] == [(1,), (2,), (None,), (4,)]
+
+
+def test_from_chunks_sin_bloques():
+    resultado = ColumnarResult.from_chunks(["id", "description"], iter([]))
+    assert resultado.num_rows == 0
+    assert [len(arr) for arr in resultado.arrays] == [0, 0]
+
+
+def test_compatible_con_el_diccionario_de_resultados():
+    resultados = ColumnarResult.from_rows(["count"], [(42,)], truncated=True, truncation_reason="filas")
+    assert resultados["columns"] == ["count"]
+    assert resultados["data"][0][0] == 42
+    assert type(resultados["data"][0][0]) is int
+    assert resultados.get("truncated") is True
+    assert resultados.get("rechazo") is None
+    assert set(resultados) == {"columns", "data", "truncated", "truncation_reason"}
+    assert len(resultados) == 4
+    assert dict(resultados)["truncation_reason"] == "filas"
+
+
+def test_vista_de_filas():
+    filas = ColumnarResult.from_rows(["id", "description"], [(1, "red"), (2, "blue"), (3, "white")])["data"]
+    assert len(filas) == 3
+    assert filas[-1] == (3, "white")
+    assert filas[1:] == [(2, "blue"), (3, "white")]
+    assert list(filas) == [(1, "red"), (2, "blue"), (3, "white")]
+    assert [fila[0] for fila in filas] == [1, 2, 3]
+    with pytest.raises(IndexError):
+        filas[3]
+
+
+def test_to_pandas():
+    resultado = ColumnarResult.from_rows(COLUMNAS, FILAS)
+    df = resultado.to_pandas()
+    assert isinstance(df, pd.DataFrame)
+    assert list(df.columns) == COLUMNAS
+    assert df["id"].tolist() == [1, 2, 3]
+    assert df["acurrancy"].iloc[0] == 0.95
+    assert pd.isna(df["fecha"].iloc[2])
+    # Se construye una sola vez
+    assert resultado.to_pandas() is df
+
+
+def test_to_pandas_con_columnas_repetidas_y_sin_columnas():
+    df = ColumnarResult.from_rows(["n", "n"], [(1, 2)]).to_pandas()
+    assert list(df.columns) == ["n", "n"]
+    assert df.iloc[0].tolist() == [1, 2]
+    assert ColumnarResult([], []).to_pandas().empty
@@ -0,0 +1,188 @@
+# tests/test_connection_pool.py
+
+import pytest
+
+import connection_pool
+from connection_pool import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conexion, prepared=False):
+        self.conexion = conexion
+        self.prepared = prepared
+        self.closed = False
+        self.description = None
+
+    def execute(self, operation, params=None):
+        self.conexion.ejecutadas.append(operation)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.ejecutadas = []
+        self.conectada = True
+        self.closed = False
+        self.resets = 0
+        self.rollbacks = 0
+
+    def cursor(self, prepared=False, **kwargs):
+        return FakeCursor(self, prepared)
+
+    def is_connected(self):
+        return self.conectada
+
+    def reset_session(self):
+        self.resets += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def conexiones(monkeypatch):
+    creadas = []
+
+    def connect(**kwargs):
+        creadas.append(FakeConnection())
+        return creadas[-1]
+
+    monkeypatch.setattr(connection_pool.mysql.connector, "connect", connect)
+    return creadas
+
+
+def test_consultas_preparadas_conservan_la_sesion_y_sus_sentencias(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=1, prepared_statements=4)
+    conn = pool.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM detections WHERE description = %s", ("red",))
+    preparado = conn.prepared_cursor("SELECT * FROM detections WHERE description = %s")
+    conn.close()
+
+    conn = pool.get_connection()
+    assert conn.prepared_cursor("SELECT * FROM detections WHERE description = %s") is preparado
+    conn.close()
+    raw = conexiones[0]
+    assert (raw.resets, raw.rollbacks) == (0, 2)
+    assert pool.stats()["prepared_hits"] == 1
+
+
+@pytest.mark.parametrize("sentencia", [
+    "SET SESSION sql_mode=(SELECT REPLACE(@@sql_mode, 'ONLY_FULL_GROUP_BY', ''));",
+    "SELECT @total := COUNT(*) FROM detections",
+    "CREATE TEMPORARY TABLE t (id INT)",
+])
+def test_sentencias_que_cambian_la_sesion_la_reinician(conexiones, sentencia):
+    pool = ConnectionPool({"database": "db"}, size=1, prepared_statements=4)
+    conn = pool.get_connection()
+    preparado = conn.prepared_cursor("SELECT * FROM detections WHERE id = %s")
+    conn.cursor().execute(sentencia)
+    conn.close()
+
+    raw = conexiones[0]
+    assert raw.resets == 1
+    assert preparado.closed
+    # La sesión reiniciada vuelve a aplicar session_init y las sentencias se preparan de nuevo
+    assert raw.ejecutadas[-1] == connection_pool.DEFAULT_SESSION_INIT[0]
+    conn = pool.get_connection()
+    assert conn.prepared_cursor("SELECT * FROM detections WHERE id = %s") is not preparado
+    conn.close()
+
+
+def test_sin_sentencias_preparadas_siempre_reinicia_la_sesion(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=1)
+    conn = pool.get_connection()
+    assert conn.prepared_cursor("SELECT 1") is None
+    conn.cursor().execute("SELECT 1")
+    conn.close()
+    assert conexiones[0].resets == 1
+
+
+def test_la_conexion_devuelta_se_reutiliza(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=2)
+    with pool.get_connection() as conn:
+        assert pool.stats()["in_use"] == 1
+    conn.close()  # Cerrar dos veces no la devuelve dos veces
+    with pool.get_connection():
+        pass
+
+    assert len(conexiones) == 1
+    assert not conexiones[0].closed
+    stats = pool.stats()
+    assert (stats["checkouts"], stats["created"], stats["in_use"], stats["idle"]) == (2, 1, 0, 1)
+    assert (stats["failures"], stats["discarded"]) == (0, 0)
+
+
+def test_conexion_caida_se_descarta(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=1, ping_after=0)
+    pool.get_connection().close()
+    conexiones[0].conectada = False
+
+    conn = pool.get_connection()
+    assert conn._raw is conexiones[1]
+    assert conexiones[0].closed
+    conn.close()
+    stats = pool.stats()
+    assert (stats["created"], stats["discarded"], stats["idle"]) == (2, 1, 1)
+
+
+def test_conexion_usada_hace_poco_no_se_verifica(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=1, ping_after=60)
+    pool.get_connection().close()
+    conexiones[0].conectada = False
+    with pool.get_connection() as conn:
+        assert conn._raw is conexiones[0]
+
+
+def test_el_pool_limita_las_conexiones_simultaneas(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=2, checkout_timeout=0.01)
+    primera, segunda = pool.get_connection(), pool.get_connection()
+    with pytest.raises(connection_pool.PoolExhaustedError):
+        pool.get_connection()
+    stats = pool.stats()
+    assert (stats["in_use"], stats["failures"], stats["timeouts"]) == (2, 1, 1)
+
+    # Al devolver o descartar una conexión se libera su cupo
+    primera.close()
+    segunda.discard()
+    assert conexiones[1].closed
+    conns = [pool.get_connection(), pool.get_connection()]
+    assert pool.stats()["in_use"] == 2
+    for conn in conns:
+        conn.close()
+    assert pool.stats()["in_use"] == 0
+
+
+def test_fallo_al_conectar_libera_el_cupo(monkeypatch):
+    def connect(**kwargs):
+        raise RuntimeError("servidor no disponible")
+
+    monkeypatch.setattr(connection_pool.mysql.connector, "connect", connect)
+    pool = ConnectionPool({"database": "db"}, size=1, checkout_timeout=0.01)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            pool.get_connection()
+    stats = pool.stats()
+    assert (stats["failures"], stats["timeouts"], stats["in_use"]) == (2, 0, 0)
+
+
+def test_sesion_que_no_se_puede_reiniciar_se_descarta(conexiones):
+    pool = ConnectionPool({"database": "db"}, size=1, checkout_timeout=0.01)
+    conn = pool.get_connection()
+
+    def reset_session():
+        raise RuntimeError("conexión perdida")
+
+    conexiones[0].reset_session = reset_session
+    conn.close()
+
+    assert conexiones[0].closed
+    stats = pool.stats()
+    assert (stats["discarded"], stats["in_use"], stats["idle"]) == (1, 0, 0)
+    with pool.get_connection() as conn:
+        assert conn._raw is conexiones[1]
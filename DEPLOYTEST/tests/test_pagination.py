@@ -0,0 +1,134 @@
+# tests/test_pagination.py
+
+import re
+
+import pytest
+
+from columnar_result import ColumnarResult
+from pagination import KeysetPaginator
+
+# (id, init_time, description): varias filas comparten init_time para probar el desempate por id
+DETECCIONES = [
+    (1, 1000, "red"), (2, 1000, "blue"), (3, 2000, "red"), (4, 2000, "red"),
+    (5, 2000, "white"), (6, 3000, "red"), (7, 4000, "blue"), (8, 4000, "red"),
+]
+
+
+class FakeQueryExecutor:
+    """
+    Ejecuta sobre DETECCIONES las páginas de "SELECT * FROM detections" (orden descendente), aplicando el
+    predicado de llave con los parámetros recibidos.
+    """
+
+    def __init__(self):
+        self.ejecutadas = []
+
+    def ejecutar_sql_acotado(self, sql, params=None, verificar=True):
+        self.ejecutadas.append((sql, params, verificar))
+        filas = sorted(DETECCIONES, key=lambda f: (f[1], f[0]), reverse=True)
+        if params:
+            tiempo, _, llave = params
+            filas = [f for f in filas if f[1] <= tiempo and (f[1] < tiempo or f[0] < llave)]
+        limite = int(re.search(r"LIMIT (\d+)$", sql).group(1))
+        return ColumnarResult.from_rows(
+            ["id", "init_time", "description", "_pagina_tiempo", "_pagina_llave"],
+            [f + (f[1], f[0]) for f in filas[:limite]],
+            truncated=False,
+        )
+
+
+@pytest.fixture
+def paginador():
+    return KeysetPaginator(FakeQueryExecutor(), tamano=3)
+
+
+def test_listado_sin_where_ni_orden(paginador):
+    pagina = paginador.preparar("SELECT * FROM detections;")
+    assert pagina["sql"] == (
+        "SELECT *, `detections`.`init_time` AS _pagina_tiempo, `detections`.`id` AS _pagina_llave "
+        "FROM detections ORDER BY `detections`.`init_time` DESC, `detections`.`id` DESC LIMIT 3"
+    )
+    assert pagina["sql_siguiente"] == (
+        "SELECT *, `detections`.`init_time` AS _pagina_tiempo, `detections`.`id` AS _pagina_llave "
+        "FROM detections WHERE `detections`.`init_time` <= %s "
+        "AND (`detections`.`init_time` < %s OR `detections`.`id` < %s) "
+        "ORDER BY `detections`.`init_time` DESC, `detections`.`id` DESC LIMIT 3"
+    )
+    assert (pagina["params"], pagina["tamano"], pagina["despues"], pagina["numero"]) == ((), 3, None, 1)
+
+
+def test_listado_con_where_orden_y_limit():
+    pagina = KeysetPaginator(None).preparar(
+        "SELECT id, description FROM detections d WHERE description = %s OR acurrancy > %s "
+        "ORDER BY d.init_time ASC, id ASC LIMIT 10",
+        ("red", 0.5),
+    )
+    assert pagina["sql"] == (
+        "SELECT id, description, `d`.`init_time` AS _pagina_tiempo, `d`.`id` AS _pagina_llave "
+        "FROM detections d WHERE description = %s OR acurrancy > %s "
+        "ORDER BY `d`.`init_time` ASC, `d`.`id` ASC LIMIT 10"
+    )
+    # El WHERE original va entre paréntesis para que su OR no se mezcle con el predicado de llave
+    assert pagina["sql_siguiente"] == (
+        "SELECT id, description, `d`.`init_time` AS _pagina_tiempo, `d`.`id` AS _pagina_llave "
+        "FROM detections d WHERE (description = %s OR acurrancy > %s) "
+        "AND `d`.`init_time` >= %s AND (`d`.`init_time` > %s OR `d`.`id` > %s) "
+        "ORDER BY `d`.`init_time` ASC, `d`.`id` ASC LIMIT 10"
+    )
+    assert pagina["params"] == ("red", 0.5)
+    assert pagina["tamano"] == 10
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM detections",
+    "SELECT description, COUNT(*) FROM detections GROUP BY description",
+    "SELECT DISTINCT description FROM detections",
+    "SELECT * FROM detections ORDER BY description",
+    "SELECT * FROM detections ORDER BY init_time DESC, id ASC",
+    "SELECT * FROM detections LIMIT 10 OFFSET 20",
+    "SELECT * FROM detections LIMIT 20, 10",
+    "SELECT * FROM detections d JOIN object o ON o.id = d.object_id",
+    "SELECT * FROM object",
+    "SELECT * FROM detections WHERE id IN (SELECT id FROM detections) /* comentario */",
+    "SELECT * FROM detections WHERE description LIKE 'r%'",
+])
+def test_consultas_no_paginables(sql, paginador):
+    assert paginador.preparar(sql) is None
+
+
+def test_recorre_todas_las_paginas_sin_repetir_filas(paginador):
+    pagina = paginador.preparar("SELECT * FROM detections")
+    ids, numeros = [], []
+    while pagina is not None:
+        resultado = paginador.ejecutar(pagina)
+        assert resultado.columns == ["id", "init_time", "description"]
+        ids += [fila[0] for fila in resultado["data"]]
+        numeros.append(pagina["numero"])
+        pagina = resultado.get("pagina")
+    assert ids == [8, 7, 6, 5, 4, 3, 2, 1]
+    assert numeros == [1, 2, 3]
+
+
+def test_la_pagina_siguiente_continua_despues_de_la_ultima_fila(paginador):
+    resultado = paginador.ejecutar(paginador.preparar("SELECT * FROM detections"))
+    siguiente = resultado["pagina"]
+    assert siguiente["despues"] == (3000, 6)
+    assert type(siguiente["despues"][0]) is int
+
+    resultado = paginador.ejecutar(siguiente)
+    sql, params, verificar = paginador.query_executor.ejecutadas[-1]
+    assert sql == siguiente["sql_siguiente"]
+    assert params == (3000, 3000, 6)
+    assert verificar is True
+    # La segunda página termina a mitad de las filas con init_time 2000: la tercera sigue por id
+    assert resultado["pagina"]["despues"] == (2000, 3)
+    assert [fila[0] for fila in paginador.ejecutar(resultado["pagina"])["data"]] == [2, 1]
+
+
+def test_resultado_fallido_se_entrega_sin_cambios():
+    class FallaExecutor:
+        def ejecutar_sql_acotado(self, sql, params=None, verificar=True):
+            return None
+
+    paginador = KeysetPaginator(FallaExecutor())
+    assert paginador.ejecutar(paginador.preparar("SELECT * FROM detections")) is None
@@ -0,0 +1,75 @@
+# tests/test_question_index.py
+
+import pytest
+
+from question_index import QuestionIndex
+
+DIA_MS = 86400000
+DIAS = {"hoy": 1740787200000, "ayer": 1740787200000 - DIA_MS}
+
+SQL_POR_CAMARA = (
+    "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS camara, COUNT(*) AS total FROM detections "
+    "WHERE attribute_id = 2 AND description = 'red' GROUP BY camara"
+)
+SQL_ROJOS_HOY = (
+    f"SELECT COUNT(*) AS total FROM detections WHERE attribute_id = 2 AND description = 'red' "
+    f"AND init_time BETWEEN {DIAS['hoy']} AND {DIAS['hoy'] + DIA_MS - 1}"
+)
+
+
+@pytest.fixture
+def indice():
+    indice = QuestionIndex(parse_date_reference=lambda ref: (DIAS[ref], DIAS[ref] + DIA_MS - 1))
+    indice.registrar("cuantos autos rojos se detectaron por camara",
+                     {"accion": "contar", "tabla": "detections", "agrupar_por": "camara"}, SQL_POR_CAMARA)
+    indice.registrar("cuántos carros rojos hoy",
+                     {"accion": "contar", "tabla": "detections", "filtros": {"description": "red"}}, SQL_ROJOS_HOY)
+    return indice
+
+
+def test_reutiliza_la_misma_pregunta_con_palabras_vacias(indice):
+    reuso, _ = indice.resolver("¿Cuántos carros rojos hubo hoy?")
+    assert reuso is not None and reuso[1] == SQL_ROJOS_HOY
+
+
+def test_reutiliza_la_misma_pregunta_con_sinonimos(indice):
+    # Poco parecidas por n-gramas, pero con la misma firma
+    assert indice.buscar("cantidad de vehículos rojos detectados hoy", k=1)[0][0] < 0.5
+    reuso, ejemplos = indice.resolver("cantidad de vehículos rojos detectados hoy")
+    assert reuso is not None and reuso[1] == SQL_ROJOS_HOY
+    assert ejemplos == []
+
+
+def test_reutiliza_actualizando_la_fecha(indice):
+    reuso, _ = indice.resolver("cuántos carros rojos ayer")
+    assert reuso is not None
+    assert f"BETWEEN {DIAS['ayer']} AND {DIAS['ayer'] + DIA_MS - 1}" in reuso[1]
+
+
+@pytest.mark.parametrize("pregunta", [
+    "cuantos autos rojos se detectaron por hora",
+    "cuantos autos azules se detectaron por camara",
+    "cuantos autos rojos se detectaron por camara 3",
+    "cuantos autos rojos se detectaron por camara hoy",
+    "cuántos carros rojos con placa hoy",
+    "cuales carros rojos hoy",
+])
+def test_no_reutiliza_preguntas_casi_iguales(indice, pregunta):
+    reuso, ejemplos = indice.resolver(pregunta)
+    assert reuso is None
+    assert ejemplos  # siguen sirviendo como ejemplos para el LLM
+
+
+def test_la_similitud_alta_no_basta_para_reutilizar(indice):
+    similitud, entrada = indice.buscar("cuantos autos rojos se detectaron por hora", k=1)[0]
+    assert similitud >= 0.85 and entrada["sql"] == SQL_POR_CAMARA
+    assert indice.resolver("cuantos autos rojos se detectaron por hora")[0] is None
+    assert indice.stats()["reused"] == 0
+
+
+def test_fecha_no_adaptable_no_se_reutiliza():
+    indice = QuestionIndex(parse_date_reference=lambda ref: (DIAS[ref], DIAS[ref] + DIA_MS - 1))
+    indice.registrar("cuántos carros rojos hoy", {"accion": "contar"},
+                     "SELECT COUNT(*) FROM detections WHERE DATE(FROM_UNIXTIME(init_time / 1000)) = CURDATE()")
+    assert indice.resolver("cuántos carros rojos ayer")[0] is None
+    assert indice.stats()["rejected_dates"] == 1
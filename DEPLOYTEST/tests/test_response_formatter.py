@@ -0,0 +1,59 @@
+# tests/test_response_formatter.py
+
+import pytest
+
+from columnar_result import ColumnarResult
+from intent_templates import IntentRegistry
+from response_formatter import PARTE_GPT, PARTE_TEXTO, ResponseFormatter
+
+RANGO_HOY = (1740787200000, 1740873599999)
+
+
+def resolver_plantilla(pregunta):
+    registro = IntentRegistry(parse_date_reference=lambda referencia: RANGO_HOY)
+    _, estructura, sql, _ = registro.resolver(pregunta)
+    return estructura, sql
+
+
+@pytest.mark.parametrize("rapido", [False, True])
+def test_conteo_por_color_de_plantilla_se_formatea_agrupado(rapido):
+    estructura, sql = resolver_plantilla("por color hoy")
+    resultados = ColumnarResult.from_rows(["description", "cantidad_detecciones"], [("red", 12), ("blue", 4)])
+
+    [(tipo, texto)] = ResponseFormatter("sk-test").planificar_respuesta(resultados, estructura, sql, rapido=rapido)
+
+    assert tipo == (PARTE_TEXTO if rapido else PARTE_GPT)
+    assert "Red: 12 (75.0%)" in texto and "Blue: 4 (25.0%)" in texto
+    assert "total de red" not in texto
+
+
+def test_conteo_por_camara_de_plantilla_usa_la_ultima_columna_como_cantidad():
+    estructura, sql = resolver_plantilla("detecciones por camara")
+    resultados = ColumnarResult.from_rows(
+        ["Camara_Id", "attribute_id", "cantidad"], [("CAM01", 2, 30), ("CAM02", 2, 10)]
+    )
+
+    [(tipo, texto)] = ResponseFormatter("sk-test").planificar_respuesta(resultados, estructura, sql)
+
+    assert tipo == PARTE_GPT
+    assert "Cam01 / 2: 30 (75.0%)" in texto and "Cam02 / 2: 10 (25.0%)" in texto
+    assert "En total se contabilizaron 40" in texto
+
+
+def test_conteo_simple_sigue_usando_el_total():
+    estructura, sql = resolver_plantilla("cuantos autos rojos hoy")
+    resultados = ColumnarResult.from_rows(["total"], [(7,)])
+
+    [(tipo, texto)] = ResponseFormatter("sk-test").planificar_respuesta(resultados, estructura, sql)
+
+    assert tipo == PARTE_GPT
+    assert "tenemos un total de 7 registros" in texto
+
+
+def test_conteo_agrupado_sin_filas():
+    estructura, sql = resolver_plantilla("por color hoy")
+    resultados = ColumnarResult.from_rows(["description", "cantidad_detecciones"], [])
+
+    [(tipo, texto)] = ResponseFormatter("sk-test").planificar_respuesta(resultados, estructura, sql)
+
+    assert tipo == PARTE_TEXTO and "No se encontraron registros" in texto
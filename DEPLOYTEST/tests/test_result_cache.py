@@ -0,0 +1,40 @@
+# tests/test_result_cache.py
+
+import pytest
+
+from result_cache import ResultCache, normalizar_sql, tablas_de_consulta
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM detections WHERE description = 'red'",
+    "select description, count(*) from detections group by 1",
+    "WITH t AS (SELECT * FROM detections) SELECT COUNT(*) FROM t",
+    "SELECT COUNT(*) FROM detections WHERE init_time >= UNIX_TIMESTAMP('2025-03-01') * 1000",
+    "SELECT now_playing FROM canciones",
+])
+def test_consultas_deterministas_se_cachean(sql):
+    assert ResultCache.es_cacheable(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM detections ORDER BY RAND() LIMIT 5",
+    "SELECT COUNT(*) FROM detections WHERE DATE(FROM_UNIXTIME(init_time / 1000)) = CURDATE()",
+    "SELECT COUNT(*) FROM detections WHERE init_time >= (UNIX_TIMESTAMP(NOW()) - 3600) * 1000",
+    "SELECT COUNT(*) FROM detections WHERE init_time >= (UNIX_TIMESTAMP() - 3600) * 1000",
+    "SELECT COUNT(*) FROM detections WHERE DATE(FROM_UNIXTIME(init_time / 1000)) = CURRENT_DATE",
+    "SELECT COUNT(*) FROM detections WHERE FROM_UNIXTIME(init_time / 1000) > current_timestamp - INTERVAL 1 HOUR",
+    "SELECT COUNT(*) FROM detections WHERE FROM_UNIXTIME(init_time / 1000) > UTC_TIMESTAMP() - INTERVAL 1 DAY",
+    "DELETE FROM detections",
+])
+def test_consultas_no_deterministas_no_se_cachean(sql):
+    assert not ResultCache.es_cacheable(sql)
+
+
+def test_normalizar_conserva_los_literales():
+    assert normalizar_sql("SELECT  *\nFROM Detections WHERE description = 'Rojo';") == \
+        "select * from detections where description = 'Rojo'"
+
+
+def test_tablas_de_consulta():
+    assert tablas_de_consulta("SELECT * FROM detections d JOIN db.cameras c ON c.id = d.camera_id") == \
+        ["detections", "cameras"]
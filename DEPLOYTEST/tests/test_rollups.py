@@ -0,0 +1,149 @@
+# tests/test_rollups.py
+
+import pytest
+
+from rollups import DIA_MS, HORA_MS, AggregateRouter, segmentos
+
+MINUTO_MS = 60 * 1000
+# Zona horaria UTC-3: los días del rollup diario empiezan a las 03:00 UTC
+OFFSET_MS = -3 * HORA_MS
+# 2024-12-31 00:00 en UTC-3, inicio de un día del rollup
+D = 1735614000000
+WATERMARK = D + 10 * DIA_MS + 5 * HORA_MS
+
+
+class FakeMaintainer:
+    listo = True
+    tabla = "detections"
+    tabla_hora = "detections_rollup_hora"
+    tabla_dia = "detections_rollup_dia"
+    offset_ms = OFFSET_MS
+    watermark = WATERMARK
+
+
+@pytest.fixture
+def router():
+    return AggregateRouter(FakeMaintainer())
+
+
+@pytest.mark.parametrize("desde, hasta, watermark, usar_dia, esperados", [
+    # Borde inicial a mitad de hora, días completos, horas del último día y lo posterior al watermark
+    (D + HORA_MS + 5, D + 12 * DIA_MS, WATERMARK, True, [
+        ("detalle", D + HORA_MS + 5, D + 2 * HORA_MS),
+        ("hora", D + 2 * HORA_MS, D + DIA_MS),
+        ("dia", D + DIA_MS, D + 10 * DIA_MS),
+        ("hora", D + 10 * DIA_MS, WATERMARK),
+        ("detalle", WATERMARK, D + 12 * DIA_MS),
+    ]),
+    # La medianoche UTC no es un límite de día en UTC-3: hasta las 03:00 UTC se lee por hora
+    (D + 21 * HORA_MS, D + 2 * DIA_MS, WATERMARK, True, [
+        ("hora", D + 21 * HORA_MS, D + DIA_MS),
+        ("dia", D + DIA_MS, D + 2 * DIA_MS),
+    ]),
+    # Watermark a mitad de hora: la hora incompleta sale del detalle
+    (D, None, D + 3 * DIA_MS + 30 * MINUTO_MS, True, [
+        ("dia", D, D + 3 * DIA_MS),
+        ("detalle", D + 3 * DIA_MS, D + 3 * DIA_MS + 30 * MINUTO_MS),
+        ("detalle", D + 3 * DIA_MS + 30 * MINUTO_MS, None),
+    ]),
+    (None, D + 2 * DIA_MS, WATERMARK, True, [("dia", None, D + 2 * DIA_MS)]),
+    (D, D + 2 * DIA_MS, WATERMARK, False, [("hora", D, D + 2 * DIA_MS)]),
+    (D + 10 * MINUTO_MS, D + 20 * MINUTO_MS, WATERMARK, True, [("detalle", D + 10 * MINUTO_MS, D + 20 * MINUTO_MS)]),
+    (WATERMARK + 1, WATERMARK + DIA_MS, WATERMARK, True, [("detalle", WATERMARK + 1, WATERMARK + DIA_MS)]),
+])
+def test_segmentos(desde, hasta, watermark, usar_dia, esperados):
+    assert segmentos(desde, hasta, watermark, OFFSET_MS, usar_dia) == esperados
+
+
+def test_conteo_repartido_entre_detalle_y_rollups(router):
+    sql, params = router.enrutar(
+        None, "SELECT COUNT(*) FROM detections WHERE init_time >= %s AND init_time < %s",
+        (D + HORA_MS + 5, D + 12 * DIA_MS),
+    )
+    assert sql == (
+        "SELECT COALESCE(CAST(SUM(c0) AS SIGNED), 0) AS `COUNT(*)` FROM ("
+        "SELECT COUNT(*) AS c0 FROM `detections` WHERE init_time >= %s AND init_time < %s"
+        " UNION ALL SELECT cnt AS c0 FROM `detections_rollup_hora` WHERE bucket_start >= %s AND bucket_start < %s"
+        " UNION ALL SELECT cnt AS c0 FROM `detections_rollup_dia` WHERE bucket_start >= %s AND bucket_start < %s"
+        " UNION ALL SELECT cnt AS c0 FROM `detections_rollup_hora` WHERE bucket_start >= %s AND bucket_start < %s"
+        " UNION ALL SELECT COUNT(*) AS c0 FROM `detections` WHERE init_time >= %s AND init_time < %s"
+        ") AS resumen"
+    )
+    assert params == (
+        D + HORA_MS + 5, D + 2 * HORA_MS,
+        D + 2 * HORA_MS, D + DIA_MS,
+        D + DIA_MS, D + 10 * DIA_MS,
+        D + 10 * DIA_MS, WATERMARK,
+        WATERMARK, D + 12 * DIA_MS,
+    )
+    assert router.stats == {"reescritas": 1, "directas": 0, "errores": 0}
+
+
+def test_rango_que_termina_en_el_watermark_no_lee_el_detalle(router):
+    sql, params = router.enrutar(
+        None,
+        "SELECT COUNT(*) AS total FROM detections WHERE description = %s AND init_time >= %s AND init_time < %s",
+        ("red", D + DIA_MS, WATERMARK),
+    )
+    assert sql == (
+        "SELECT COALESCE(CAST(SUM(c0) AS SIGNED), 0) AS `total` FROM ("
+        "SELECT cnt AS c0 FROM `detections_rollup_dia` WHERE bucket_start >= %s AND bucket_start < %s"
+        " AND description = %s"
+        " UNION ALL SELECT cnt AS c0 FROM `detections_rollup_hora` WHERE bucket_start >= %s AND bucket_start < %s"
+        " AND description = %s"
+        ") AS resumen"
+    )
+    assert params == (D + DIA_MS, D + 10 * DIA_MS, "red", D + 10 * DIA_MS, WATERMARK, "red")
+
+
+def test_between_incluye_el_extremo_final(router):
+    sql, params = router.enrutar(
+        None, "SELECT COUNT(*) FROM detections WHERE init_time BETWEEN %s AND %s", (D, D + 2 * DIA_MS))
+    assert sql.count("UNION ALL") == 1
+    assert "UNION ALL SELECT COUNT(*) AS c0 FROM `detections` WHERE init_time >= %s AND init_time < %s" in sql
+    assert params == (D, D + 2 * DIA_MS, D + 2 * DIA_MS, D + 2 * DIA_MS + 1)
+
+
+def test_agrupado_por_camara(router):
+    sql, params = router.enrutar(
+        None,
+        "SELECT LEFT(object_id, LENGTH(object_id) - 27) AS camara, COUNT(*) FROM detections "
+        "WHERE init_time >= %s AND init_time < %s GROUP BY camara",
+        (D, D + DIA_MS + 30 * MINUTO_MS),
+    )
+    # Las detecciones sin cámara se agrupan como '' en ambos orígenes y se devuelven como NULL
+    assert sql == (
+        "SELECT NULLIF(d0, '') AS `camara`, CAST(SUM(c0) AS SIGNED) AS `COUNT(*)` FROM ("
+        "SELECT camera_id AS d0, cnt AS c0 FROM `detections_rollup_dia` WHERE bucket_start >= %s AND bucket_start < %s"
+        " UNION ALL SELECT COALESCE(LEFT(object_id, LENGTH(object_id) - 27), '') AS d0, COUNT(*) AS c0"
+        " FROM `detections` WHERE init_time >= %s AND init_time < %s GROUP BY 1"
+        ") AS resumen GROUP BY d0"
+    )
+    assert params == (D, D + DIA_MS, D + DIA_MS, D + DIA_MS + 30 * MINUTO_MS)
+
+
+def test_literales_en_la_consulta(router):
+    sql, params = router.enrutar(
+        None, f"SELECT COUNT(*) FROM detections WHERE init_time >= {D} AND init_time < {D + DIA_MS}")
+    assert sql == (
+        "SELECT COALESCE(CAST(SUM(c0) AS SIGNED), 0) AS `COUNT(*)` FROM ("
+        "SELECT cnt AS c0 FROM `detections_rollup_dia` WHERE bucket_start >= %s AND bucket_start < %s"
+        ") AS resumen"
+    )
+    assert params == (D, D + DIA_MS)
+
+
+@pytest.mark.parametrize("sql, params", [
+    ("SELECT COUNT(*) FROM detections WHERE acurrancy > %s", (0.5,)),
+    ("SELECT COUNT(*) FROM detections WHERE description LIKE %s AND init_time >= %s", ("r%", D)),
+])
+def test_consultas_no_soportadas_no_se_modifican(router, sql, params):
+    assert router.enrutar(None, sql, params) == (sql, params)
+    assert router.stats["directas"] == 1
+
+
+def test_sin_rollups_listos_no_se_modifica():
+    maintainer = FakeMaintainer()
+    maintainer.listo = False
+    sql = "SELECT COUNT(*) FROM detections WHERE init_time >= %s"
+    assert AggregateRouter(maintainer).enrutar(None, sql, (D,)) == (sql, (D,))
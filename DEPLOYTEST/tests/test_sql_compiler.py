@@ -0,0 +1,124 @@
+# tests/test_sql_compiler.py
+
+import pytest
+
+from columnar_result import ColumnarResult
+from response_formatter import PARTE_GPT, ResponseFormatter
+from sql_compiler import SQLCompiler, parametrizar_sql, renderizar_sql
+
+SCHEMA = {
+    "detections": {
+        "columns": {
+            "id": {"type": "int"},
+            "init_time": {"type": "bigint"},
+            "attribute_id": {"type": "int"},
+            "description": {"type": "varchar(255)"},
+        }
+    }
+}
+
+RANGO_HOY = (1740787200000, 1740873599999)
+
+
+@pytest.fixture
+def compilador():
+    return SQLCompiler(parse_date_reference=lambda referencia: RANGO_HOY)
+
+
+def contar(compilador, filtros):
+    return compilador.compilar({"accion": "contar", "tabla": "detections", "filtros": filtros}, SCHEMA)
+
+
+def test_compila_filtros_simples(compilador):
+    assert contar(compilador, {"description": "Rojo", "attribute_id": 2}) == (
+        "SELECT COUNT(*) AS total FROM `detections` WHERE `description` = %s AND `attribute_id` = %s",
+        ("Rojo", 2),
+    )
+
+
+def test_fecha_se_convierte_al_rango_del_dia(compilador):
+    sql, params = contar(compilador, {"init_time": "hoy"})
+    assert sql.endswith("WHERE `init_time` BETWEEN %s AND %s")
+    assert params == RANGO_HOY
+
+
+def test_cota_con_fecha_usa_inicio_o_fin_del_dia(compilador):
+    assert contar(compilador, {"init_time": {">=": "2025-03-01"}})[1] == (RANGO_HOY[0],)
+    assert contar(compilador, {"init_time": {"<=": "2025-03-01"}})[1] == (RANGO_HOY[1],)
+
+
+def test_tiempo_en_milisegundos_se_compila(compilador):
+    assert contar(compilador, {"init_time": {">=": 1740787200000}})[1] == (1740787200000,)
+
+
+@pytest.mark.parametrize("filtros", [
+    {"init_time": "última semana"},
+    {"init_time": "2025-03-01 10:00"},
+    {"init_time": {">=": "2025-03-01 10:00"}},
+    {"init_time": {"<": 1.5}},
+    {"init_time": ["hoy", "ayer"]},
+    {"attribute_id": True},
+    {"attribute_id": {"=": False}},
+    {"attribute_id": [1, True]},
+    {"description": {"$regex": "Ro"}},
+    {"description": {"=": {"a": 1}}},
+    {"description": []},
+    {"description": {}},
+    {"color": "Rojo"},
+])
+def test_filtros_no_soportados_quedan_para_el_llm(compilador, filtros):
+    assert contar(compilador, filtros) is None
+    assert compilador.stats()["fallback"] == 1
+
+
+def test_fecha_sin_interprete_queda_para_el_llm():
+    assert contar(SQLCompiler(), {"init_time": "hoy"}) is None
+
+
+@pytest.mark.parametrize("estructura", [
+    "contar detecciones",
+    {"accion": "contar", "tabla": "vehiculos"},
+    {"accion": "borrar", "tabla": "detections"},
+    {"accion": "contar", "tabla": "detections", "filtros": ["Rojo"]},
+    {"accion": "contar", "tabla": "detections", "ordenar": "init_time"},
+])
+def test_estructuras_no_soportadas_quedan_para_el_llm(compilador, estructura):
+    assert compilador.compilar(estructura, SCHEMA) is None
+
+
+@pytest.mark.parametrize("sql, plantilla, params", [
+    ("SELECT COUNT(*) 'total' FROM detections WHERE description = 'red'",
+     "SELECT COUNT(*) 'total' FROM detections WHERE description = %s", ("red",)),
+    ("SELECT COUNT(*) AS \"total\" FROM detections WHERE init_time BETWEEN 1 AND 2 LIMIT 5",
+     "SELECT COUNT(*) AS \"total\" FROM detections WHERE init_time BETWEEN %s AND %s LIMIT 5", (1, 2)),
+    ("SELECT * FROM detections WHERE description IN ('red', 'blue') AND plate LIKE 'AB\\_%'",
+     "SELECT * FROM detections WHERE description IN (%s, %s) AND plate LIKE %s", ("red", "blue", "AB\\_%")),
+    ("SELECT description COLLATE 'utf8mb4_bin' AS d FROM detections GROUP BY 1 ORDER BY 'd'",
+     "SELECT description COLLATE 'utf8mb4_bin' AS d FROM detections GROUP BY 1 ORDER BY 'd'", None),
+])
+def test_parametrizar_solo_extrae_valores(sql, plantilla, params):
+    assert parametrizar_sql(sql) == ((plantilla, params) if params else (sql, None))
+
+
+def test_parametrizar_y_renderizar_conservan_el_sql():
+    sql = "SELECT COUNT(*) FROM detections WHERE description = 'it''s' AND attribute_id >= 2"
+    assert renderizar_sql(*parametrizar_sql(sql)) == (
+        "SELECT COUNT(*) FROM detections WHERE description = 'it\\'s' AND attribute_id >= 2"
+    )
+
+
+def test_conteo_agrupado_compilado_se_formatea_por_categoria(compilador):
+    estructura = {
+        "accion": "contar", "tabla": "detections", "filtros": {"init_time": "hoy"}, "agrupar_por": "description",
+    }
+    sql, params = compilador.compilar(estructura, SCHEMA)
+    assert sql.startswith("SELECT `description`, COUNT(*) AS cantidad FROM `detections`")
+    resultados = ColumnarResult.from_rows(["description", "cantidad"], [("red", 3), ("white", 1)])
+
+    [(tipo, texto)] = ResponseFormatter("sk-test").planificar_respuesta(
+        resultados, estructura, renderizar_sql(sql, params)
+    )
+
+    assert tipo == PARTE_GPT
+    assert "Red: 3 (75.0%)" in texto and "White: 1 (25.0%)" in texto
+    assert "total de red" not in texto
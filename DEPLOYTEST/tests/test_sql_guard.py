@@ -0,0 +1,193 @@
+# tests/test_sql_guard.py
+
+import json
+
+import pytest
+
+from sql_guard import SQLGuard, _enmascarar, es_tiempo_excedido, estimar_plan, rechazo_tiempo_excedido
+
+# Plan de EXPLAIN FORMAT=JSON de un recorrido completo de detections que deja pasar el 10% de las filas
+PLAN_SIN_INDICE = {
+    "query_block": {
+        "select_id": 1,
+        "cost_info": {"query_cost": "50421.75"},
+        "table": {
+            "table_name": "detections",
+            "access_type": "ALL",
+            "rows_examined_per_scan": 500000,
+            "rows_produced_per_join": 50000,
+            "filtered": "10.00",
+            "cost_info": {"read_cost": "45421.75", "eval_cost": "5000.00"},
+        },
+    }
+}
+
+
+class FakeCursor:
+    def __init__(self, plan=None, error=None):
+        self.plan = plan
+        self.error = error
+        self.ejecutadas = []
+
+    def execute(self, sql, params=None):
+        self.ejecutadas.append((sql, params))
+        if self.error is not None:
+            raise self.error
+
+    def fetchone(self):
+        return (json.dumps(self.plan),) if self.plan is not None else None
+
+    def fetchall(self):
+        return []
+
+
+def test_enmascarar_oculta_literales_y_subconsultas():
+    sql = "SELECT 'a (b', x FROM t WHERE y IN (SELECT z FROM u LIMIT 5) LIMIT 3"
+    enmascarado = _enmascarar(sql)
+    assert len(enmascarado) == len(sql)
+    assert enmascarado == "SELECT " + " " * 6 + ", x FROM t WHERE y IN (" + " " * 23 + ") LIMIT 3"
+
+
+def test_enmascarar_oculta_identificadores_y_comentarios():
+    sql = "SELECT `limit` FROM t /* LIMIT 9 */ WHERE d = 'it\\'s' -- LIMIT 1"
+    enmascarado = _enmascarar(sql)
+    assert len(enmascarado) == len(sql)
+    assert "limit" not in enmascarado.lower()
+    assert enmascarado.split() == ["SELECT", "FROM", "t", "WHERE", "d", "="]
+
+
+def test_enmascarar_conserva_solo_los_parentesis_externos():
+    assert _enmascarar("SELECT COUNT(*) FROM (SELECT a FROM (SELECT b FROM t) x) y") == \
+        "SELECT COUNT( ) FROM (" + " " * 33 + ") y"
+
+
+@pytest.mark.parametrize("sql, tipo", [
+    ("DELETE FROM detections", "DELETE"),
+    ("update detections SET description = 'red'", "UPDATE"),
+    ("/* SELECT */ DROP TABLE detections;", "DROP"),
+    ("", "texto vacío"),
+])
+def test_rechaza_sentencias_que_no_son_de_lectura(sql, tipo):
+    guard = SQLGuard()
+    cursor = FakeCursor(PLAN_SIN_INDICE)
+    sql_final, rechazo = guard.revisar(cursor, sql)
+    assert rechazo["codigo"] == "sentencia_no_permitida"
+    assert tipo in rechazo["motivo"]
+    assert rechazo["sql"] == sql_final == sql.rstrip(";")
+    assert cursor.ejecutadas == []
+    assert guard.stats()["rejected"] == 1
+
+
+def test_no_revisa_show_ni_describe():
+    cursor = FakeCursor(PLAN_SIN_INDICE)
+    assert SQLGuard().revisar(cursor, "SHOW TABLES") == ("SHOW TABLES", None)
+    assert cursor.ejecutadas == []
+
+
+def test_agrega_limit_y_tiempo_maximo():
+    guard = SQLGuard(max_rows_examined=None)
+    cursor = FakeCursor(PLAN_SIN_INDICE)
+    sql, rechazo = guard.revisar(cursor, "SELECT * FROM detections WHERE description = %s;", ("red",))
+    assert rechazo is None
+    assert sql == "SELECT /*+ MAX_EXECUTION_TIME(15000) */ * FROM detections WHERE description = %s LIMIT 1000"
+    # El EXPLAIN se hace sobre la consulta ya con LIMIT y con los mismos parámetros
+    assert cursor.ejecutadas == [
+        ("EXPLAIN FORMAT=JSON SELECT * FROM detections WHERE description = %s LIMIT 1000", ("red",))]
+    assert guard.stats()["limited"] == 1
+
+
+@pytest.mark.parametrize("sql, agregado", [
+    ("SELECT * FROM detections LIMIT 10", False),
+    ("SELECT * FROM detections LIMIT 20, 10", False),
+    ("SELECT * FROM detections WHERE id IN (SELECT id FROM detections LIMIT 5)", True),
+    ("SELECT 'LIMIT 5' FROM detections", True),
+])
+def test_limit_del_nivel_superior(sql, agregado):
+    guard = SQLGuard(max_rows_examined=None, max_execution_ms=None)
+    sql_final, _ = guard.revisar(FakeCursor(PLAN_SIN_INDICE), sql)
+    assert sql_final == (f"{sql} LIMIT 1000" if agregado else sql)
+    assert guard.stats()["limited"] == int(agregado)
+
+
+def test_estimar_plan_recorrido_completo():
+    assert estimar_plan(PLAN_SIN_INDICE) == {
+        "filas_examinadas": 500000,
+        "costo": 50421.75,
+        "tablas_sin_indice": ["detections"],
+        "bloqueante": False,
+    }
+
+
+def test_estimar_plan_corta_la_lectura_con_limit():
+    # Para producir 100 filas con un filtro del 10% basta con leer unas 1.000
+    assert estimar_plan(PLAN_SIN_INDICE, limite=100)["filas_examinadas"] == 1000
+
+
+def test_estimar_plan_con_orden_sin_indice_lee_todo():
+    plan = {"query_block": {"ordering_operation": {"using_filesort": True, **PLAN_SIN_INDICE["query_block"]}}}
+    estimacion = estimar_plan(plan, limite=100)
+    assert estimacion["bloqueante"] is True
+    assert estimacion["filas_examinadas"] == 500000
+
+
+def test_estimar_plan_nested_loop():
+    plan = {"query_block": {"nested_loop": [
+        {"table": {"table_name": "object", "access_type": "ALL", "rows_examined_per_scan": 10,
+                   "rows_produced_per_join": 10}},
+        {"table": {"table_name": "detections", "access_type": "ref", "rows_examined_per_scan": 5,
+                   "rows_produced_per_join": 50}},
+    ]}}
+    # La segunda tabla se recorre una vez por cada fila de la primera: 10 + 10 * 5
+    assert estimar_plan(plan) == {
+        "filas_examinadas": 60, "costo": 0.0, "tablas_sin_indice": ["object"], "bloqueante": False}
+
+
+def test_rechazo_por_filas_estimadas():
+    guard = SQLGuard(max_rows_examined=100000)
+    sql = "SELECT COUNT(*) FROM detections WHERE LEFT(object_id, LENGTH(object_id) - 27) = 'cam1'"
+    sql_final, rechazo = guard.revisar(FakeCursor(PLAN_SIN_INDICE), sql)
+    assert sql_final == f"{sql} LIMIT 1000"
+    assert set(rechazo) == {"codigo", "motivo", "sugerencia", "filas_estimadas", "max_rows_examined",
+                            "costo_estimado", "tablas_sin_indice", "sql"}
+    assert rechazo["codigo"] == "filas_estimadas"
+    assert rechazo["motivo"] == "recorrería unas 500.000 filas y el máximo permitido es 100.000"
+    assert rechazo["filas_estimadas"] == 500000
+    assert rechazo["max_rows_examined"] == 100000
+    assert rechazo["costo_estimado"] == 50421.75
+    assert rechazo["tablas_sin_indice"] == ["detections"]
+    assert "detections" in rechazo["sugerencia"]
+    assert rechazo["sql"] == sql_final
+    assert guard.stats()["rejected"] == 1
+
+
+def test_acotar_reduce_el_tiempo_maximo():
+    guard = SQLGuard(max_rows_examined=100000, accion="acotar")
+    sql, rechazo = guard.revisar(FakeCursor(PLAN_SIN_INDICE), "SELECT COUNT(*) FROM detections")
+    assert rechazo is None
+    assert sql == "SELECT /*+ MAX_EXECUTION_TIME(3000) */ COUNT(*) FROM detections LIMIT 1000"
+    assert guard.stats()["throttled"] == 1
+
+
+def test_explain_fallido_no_impide_la_ejecucion():
+    guard = SQLGuard(max_rows_examined=1)
+    sql, rechazo = guard.revisar(FakeCursor(error=RuntimeError("sin permisos")), "SELECT * FROM detections")
+    assert rechazo is None
+    assert sql.endswith("LIMIT 1000")
+    assert guard.stats()["explain_errors"] == 1
+
+
+def test_rechazo_tiempo_excedido():
+    class ErrorMySQL(Exception):
+        errno = 3024
+
+    assert es_tiempo_excedido(ErrorMySQL())
+    assert not es_tiempo_excedido(RuntimeError())
+    rechazo = rechazo_tiempo_excedido("SELECT 1", 15000)
+    assert set(rechazo) == {"codigo", "motivo", "sugerencia", "max_execution_ms", "sql"}
+    assert rechazo["codigo"] == "tiempo_excedido"
+    assert "15 segundos" in rechazo["motivo"]
+
+
+def test_accion_no_soportada():
+    with pytest.raises(ValueError):
+        SQLGuard(accion="ignorar")